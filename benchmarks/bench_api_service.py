@@ -0,0 +1,109 @@
+"""
+Requests per second of a `Service` against a local stub server, compared with
+a new connection per call as `httpx.request` / `httpx.AsyncClient()` did before.
+    python -m benchmarks.bench_api_service [requests]
+"""
+
+import asyncio
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+from zhtools.api_service import AsyncGetAPI, GetAPI, Service
+
+# requests in flight of the async runs
+CONCURRENCY = 50
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = b'{"ok": true}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class StubService(Service):
+    get = GetAPI("/", "i")
+    async_get = AsyncGetAPI("/", "i")
+
+
+def per_call(url: str, n: int):
+    for i in range(n):
+        httpx.request("get", url, params={"i": i}).json()
+
+
+async def async_per_call(url: str, n: int):
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def one(i: int):
+        async with semaphore, httpx.AsyncClient() as cli:
+            (await cli.get(url, params={"i": i})).json()
+
+    await asyncio.gather(*[one(i) for i in range(n)])
+
+
+def pooled(service: StubService, n: int):
+    for i in range(n):
+        service.get(i)
+
+
+async def async_pooled(service: StubService, n: int):
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def one(i: int):
+        async with semaphore:
+            await service.async_get(i)
+
+    async with service:
+        await asyncio.gather(*[one(i) for i in range(n)])
+
+
+def timed(func, *args) -> float:
+    started = time.perf_counter()
+    result = func(*args)
+    if asyncio.iscoroutine(result):
+        asyncio.run(result)
+    return time.perf_counter() - started
+
+
+def main(n: int = 2000):
+    server = StubServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/"
+    StubService.HOST = url
+    service = StubService()
+
+    print(f"{'impl':<28}{'requests':>10}{'req/s':>10}")
+    try:
+        for name, func, args in (
+            ("httpx.request per call", per_call, (url, n)),
+            ("Service client", pooled, (service, n)),
+            ("AsyncClient per call", async_per_call, (url, n // 10)),
+            ("Service async client", async_pooled, (service, n)),
+        ):
+            count = args[1]
+            print(f"{name:<28}{count:>10}{count / timed(func, *args):>10,.0f}")
+    finally:
+        service.close()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,40 @@
+"""
+Compare `KeyBuilder` with the repr based `cache.default_make_cache_key`.
+    python -m benchmarks.bench_cache_key
+"""
+import timeit
+
+from zhtools.cache.decorators import cache
+from zhtools.cache.keys import KeyBuilder
+
+
+def foo(a, b, c=None, d=1):
+    pass
+
+
+CASES = {
+    "small positional": ((1, "abc"), {}),
+    "kwargs": ((1,), {"d": 3, "b": "abc"}),
+    "large list": ((list(range(1000)), "abc"), {}),
+    "nested dict": (({"k%d" % i: {"v": [i] * 10} for i in range(100)}, 1), {}),
+}
+
+
+def main(number: int = 20000):
+    make_key = KeyBuilder(foo)
+    print(f"{'case':<20}{'repr (us)':>12}{'builder (us)':>14}{'repr len':>10}{'key len':>9}")
+    for name, (args, kwargs) in CASES.items():
+        old = timeit.timeit(
+            lambda: cache.default_make_cache_key(foo, *args, **kwargs), number=number
+        )
+        new = timeit.timeit(lambda: make_key(*args, **kwargs), number=number)
+        old_len = len(cache.default_make_cache_key(foo, *args, **kwargs))
+        new_len = len(make_key(*args, **kwargs))
+        print(
+            f"{name:<20}{old / number * 1e6:>12.2f}{new / number * 1e6:>14.2f}"
+            f"{old_len:>10}{new_len:>9}"
+        )
+
+
+if __name__ == "__main__":
+    main()
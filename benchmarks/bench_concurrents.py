@@ -0,0 +1,51 @@
+"""
+Compare the pooled `ThreadConcurrent` / `ProcessConcurrent` with starting one
+thread or process per task, as they did before.
+    python -m benchmarks.bench_concurrents [tasks]
+"""
+
+import sys
+import time
+from multiprocessing import Process
+from threading import Thread
+
+from zhtools.concurrents import ProcessConcurrent, ThreadConcurrent
+
+
+def task(i: int) -> int:
+    return sum(range(i % 100))
+
+
+def one_per_task(task_cls: type[Thread] | type[Process], n: int):
+    tasks = [task_cls(target=task, args=(i,)) for i in range(n)]
+    for t in tasks:
+        t.start()
+    for t in tasks:
+        t.join()
+
+
+def pooled(concurrent_cls: type[ThreadConcurrent] | type[ProcessConcurrent], n: int):
+    with concurrent_cls(max_workers=8) as c:
+        for i in range(n):
+            c.execute(task, i)
+
+
+def timed(func, *args) -> float:
+    started = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - started
+
+
+def main(n: int = 5000):
+    print(f"{'impl':<28}{'tasks':>8}{'seconds':>10}")
+    for name, func, args in (
+        ("Thread per task", one_per_task, (Thread, n)),
+        ("ThreadConcurrent(8)", pooled, (ThreadConcurrent, n)),
+        ("Process per task", one_per_task, (Process, n // 10)),
+        ("ProcessConcurrent(8)", pooled, (ProcessConcurrent, n // 10)),
+    ):
+        print(f"{name:<28}{args[1]:>8}{timed(func, *args):>10.3f}")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
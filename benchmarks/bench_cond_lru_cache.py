@@ -0,0 +1,38 @@
+"""
+Compare `cond_lru_cache` with building `functools.lru_cache` on every call,
+as it did before, and with plain `functools.lru_cache`.
+    python -m benchmarks.bench_cond_lru_cache
+"""
+
+import functools
+import timeit
+
+from zhtools.cache import cond_lru_cache
+
+
+def fib(n: int) -> int:
+    return n if n < 2 else fib(n - 1) + fib(n - 2)
+
+
+def rebuilt(n: int) -> int:
+    return functools.lru_cache(128)(fib)(n)
+
+
+cached = cond_lru_cache(lambda n: True)(fib)
+plain = functools.lru_cache(128)(fib)
+
+
+def main(number: int = 20000):
+    print(f"{'impl':<24}{'per call (us)':>14}")
+    for name, func in (
+        ("lru_cache per call", rebuilt),
+        ("cond_lru_cache", cached),
+        ("functools.lru_cache", plain),
+    ):
+        seconds = timeit.timeit(lambda: func(20), number=number)
+        print(f"{name:<24}{seconds / number * 1e6:>14.2f}")
+    print(cached.cache_info())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Compare payload size and dumps/loads time of cache codecs.
+    python -m benchmarks.bench_serializers
+"""
+import pickle
+import timeit
+
+from zhtools.cache.serializers import (Codec, Compression, MsgpackSerializer,
+                                       OrjsonSerializer)
+from zhtools.exceptions import ModuleRequired
+
+VALUES = {
+    "small dict": {"id": 1, "name": "zhtools", "tags": ["a", "b"], "score": 9.5},
+    "list of dicts": [
+        {"id": i, "name": f"user{i}", "email": f"user{i}@example.com", "active": i % 2 == 0}
+        for i in range(500)
+    ],
+    "int list": list(range(5000)),
+}
+
+
+def make_codecs() -> dict[str, Codec]:
+    candidates = {
+        "pickle p5": lambda: Codec(),
+        "pickle p5+zlib": lambda: Codec(compression=Compression.ZLIB),
+        "pickle p5+lz4": lambda: Codec(compression=Compression.LZ4),
+        "msgpack": lambda: Codec(MsgpackSerializer()),
+        "msgpack+lz4": lambda: Codec(MsgpackSerializer(), compression=Compression.LZ4),
+        "orjson": lambda: Codec(OrjsonSerializer()),
+        "orjson+zlib": lambda: Codec(OrjsonSerializer(), compression=Compression.ZLIB),
+    }
+    codecs = {}
+    for name, make in candidates.items():
+        try:
+            codecs[name] = make()
+        except ModuleRequired as e:
+            print(f"skip {name}: {e}")
+    return codecs
+
+
+def main(number: int = 2000):
+    codecs = make_codecs()
+    for value_name, value in VALUES.items():
+        print(f"\n{value_name}")
+        print(f"{'codec':<18}{'bytes':>9}{'dumps (us)':>12}{'loads (us)':>12}")
+        data = pickle.dumps(value)
+        dumps = timeit.timeit(lambda: pickle.dumps(value), number=number)
+        loads = timeit.timeit(lambda: pickle.loads(data), number=number)
+        print(f"{'legacy pickle':<18}{len(data):>9}{dumps / number * 1e6:>12.2f}{loads / number * 1e6:>12.2f}")
+        for name, codec in codecs.items():
+            data = codec.dumps(value)
+            dumps = timeit.timeit(lambda: codec.dumps(value), number=number)
+            loads = timeit.timeit(lambda: codec.loads(data), number=number)
+            print(f"{name:<18}{len(data):>9}{dumps / number * 1e6:>12.2f}{loads / number * 1e6:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
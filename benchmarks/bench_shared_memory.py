@@ -0,0 +1,89 @@
+"""
+Throughput and hit rate of worker processes sharing a cache, compared with a
+private `MemoryStorage` per process and a `RedisStorage` on localhost.
+    python -m benchmarks.bench_shared_memory [workers]
+"""
+
+import multiprocessing
+import random
+import sys
+import time
+
+from zhtools.cache import Empty, MemoryStorage, RedisStorage
+from zhtools.cache.shared_memory import SharedMemoryStorage
+
+KEYS = 20000
+OPS = 50000
+
+
+def compute(i: int) -> dict:
+    # stands for the work a miss costs
+    return {"id": i, "items": sum(range(2000))}
+
+
+def worker(storage_factory, seed: int, queue):
+    storage = storage_factory()
+    rnd = random.Random(seed)
+    hits = 0
+    started = time.perf_counter()
+    for _ in range(OPS):
+        key = f"k{rnd.randrange(KEYS)}"
+        val = storage.get(key)
+        if val is Empty:
+            storage.setex(key, compute(0), 60)
+        else:
+            hits += 1
+    queue.put((time.perf_counter() - started, hits))
+
+
+def memory_storage():
+    return MemoryStorage()
+
+
+def shared_memory_storage():
+    return SharedMemoryStorage("bench", slots=65536, slot_size=256)
+
+
+def redis_storage():
+    import redis
+
+    return RedisStorage(redis.Redis())
+
+
+def run(name: str, factory, workers: int):
+    ctx = multiprocessing.get_context("fork")
+    queue = ctx.Queue()
+    procs = [
+        ctx.Process(target=worker, args=(factory, i, queue)) for i in range(workers)
+    ]
+    for p in procs:
+        p.start()
+    results = [queue.get() for _ in procs]
+    for p in procs:
+        p.join()
+    seconds = max(r[0] for r in results)
+    hits = sum(r[1] for r in results)
+    print(f"{name:<22}{workers * OPS / seconds:>14,.0f}{hits / (workers * OPS):>10.1%}")
+
+
+def main(workers: int = 4):
+    print(f"{'storage':<22}{'ops/s':>14}{'hit rate':>10}")
+    run("MemoryStorage", memory_storage, workers)
+
+    storage = shared_memory_storage()
+    try:
+        run("SharedMemoryStorage", shared_memory_storage, workers)
+    finally:
+        storage.close()
+        storage.unlink()
+
+    try:
+        redis_storage().redis_cli.ping()
+    except Exception as e:
+        print(f"{'RedisStorage':<22}skipped: {e!r}")
+    else:
+        run("RedisStorage", redis_storage, workers)
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -1,4 +1,114 @@
+import time
+
 from faker import Faker
 
+from zhtools.concurrents import ACQUIRE_SCRIPT, RELEASE_SCRIPT, RENEW_SCRIPT
+
 
 fake = Faker(locale='zh_CN')
+
+
+class FakeRedis:
+    """a local stand-in for redis.Redis, only commands used by zhtools."""
+
+    def __init__(self):
+        self.data: dict[str, bytes] = {}
+        self.expires: dict[str, float] = {}
+
+    def get(self, key):
+        if self.expires.get(key, float('inf')) <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return self.data.get(key)
+
+    def set(self, key, value, nx=False, px=None):
+        if nx and self.get(key) is not None:
+            return None
+        self.data[key] = value
+        self.expires.pop(key, None)
+        if px is not None:
+            self.pexpire(key, px)
+        return True
+
+    def pexpire(self, key, px):
+        if self.get(key) is None:
+            return 0
+        self.expires[key] = time.monotonic() + px / 1000
+        return 1
+
+    def incr(self, key):
+        self.data[key] = int(self.get(key) or 0) + 1
+        return self.data[key]
+
+    def eval(self, script, numkeys, *keys_and_args):
+        """the scripts of zhtools, run in python."""
+        keys, args = keys_and_args[:numkeys], keys_and_args[numkeys:]
+        if script == ACQUIRE_SCRIPT:
+            if not self.set(keys[0], args[0], nx=True, px=args[1]):
+                return 0
+            return self.incr(keys[1])
+        key, (token, *args) = keys[0], args
+        if self.get(key) != token:
+            return 0
+        if script == RELEASE_SCRIPT:
+            return self.delete(key)
+        if script == RENEW_SCRIPT:
+            return self.pexpire(key, *args)
+        raise NotImplementedError(script)
+
+    def setex(self, key, expire, value):
+        if expire <= 0:
+            raise ValueError('invalid expire time in setex')
+        self.data[key] = value
+        self.expires[key] = time.monotonic() + expire
+        return True
+
+    def pttl(self, key):
+        if self.get(key) is None:
+            return -2
+        if key not in self.expires:
+            return -1
+        return int((self.expires[key] - time.monotonic()) * 1000)
+
+    def mget(self, keys):
+        return [self.get(k) for k in keys]
+
+    def delete(self, *keys):
+        for k in keys:
+            self.expires.pop(k, None)
+        return sum(self.data.pop(k, None) is not None for k in keys)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakeAsyncRedis:
+    """redis.asyncio version of `FakeRedis`."""
+
+    def __init__(self, redis=None):
+        self.redis = redis or FakeRedis()
+
+    def __getattr__(self, name):
+        command = getattr(self.redis, name)
+
+        async def async_command(*args, **kwargs):
+            return command(*args, **kwargs)
+
+        return async_command
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+
+        return command
+
+    def execute(self):
+        commands, self.commands = self.commands, []
+        return [getattr(self.redis, n)(*a, **kw) for n, a, kw in commands]
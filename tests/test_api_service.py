@@ -0,0 +1,516 @@
+import asyncio
+import inspect
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import pytest
+
+from zhtools.api_service import (AsyncGetAPI, AsyncPostAPI, BatchError,
+                                 CircuitOpenError, CircuitState, GetAPI,
+                                 NotSuccessResponse, PostAPI,
+                                 RequestParamError, Service, StreamFormat,
+                                 _JSONArray, _JSONLines)
+from zhtools.cache import AsyncMemoryStorage, MemoryStorage
+from zhtools.config import config
+
+
+class FakeService(Service):
+    HOST = 'http://testserver/'
+
+    login = PostAPI('/login/', 'username', 'password', force=False)
+    users = GetAPI('/users/', 'page')
+    missing = GetAPI('/missing/', 'page')
+    async_login = AsyncPostAPI('/login/', 'username', 'password')
+    async_users = AsyncGetAPI('/users/', 'page')
+
+    def __init__(self):
+        self.requests: list[httpx.Request] = []
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        if request.url.path == '/missing/':
+            return httpx.Response(404)
+        if request.method == 'GET':
+            return httpx.Response(200, json=dict(request.url.params))
+        return httpx.Response(200, json=json.loads(request.content))
+
+    def client_kwargs(self):
+        return super().client_kwargs() | {
+            'transport': httpx.MockTransport(self.handler),
+        }
+
+
+def test_service_client():
+    with FakeService() as service:
+        assert service.login('admin', 'pwd') == {
+            'username': 'admin', 'password': 'pwd', 'force': False,
+        }
+        assert service.users(2) == {'page': '2'}
+        client = service.client
+        service.users(3)
+        # one client for every call
+        assert service.client is client
+        assert len(service.requests) == 3
+
+        with pytest.raises(NotSuccessResponse) as e:
+            service._request('/missing/')
+        assert e.value.status_code == 404
+
+    assert client.is_closed
+    assert service._client is None
+
+
+def test_service_async_client():
+    service = FakeService()
+
+    async def run():
+        async with service:
+            results = await asyncio.gather(
+                *[service.async_users(i) for i in range(10)],
+                service.async_login('admin', 'pwd'),
+            )
+            assert results[:10] == [{'page': str(i)} for i in range(10)]
+            assert results[10] == {'username': 'admin', 'password': 'pwd'}
+            return service.async_client
+
+    client = asyncio.run(run())
+    assert client.is_closed
+    assert inspect.iscoroutinefunction(service.async_users)
+    assert inspect.iscoroutinefunction(FakeService.async_users)
+
+    # a client is recreated for a new loop
+    async def users():
+        await service.async_users(1)
+        return service.async_client
+
+    first = asyncio.run(users())
+    second = asyncio.run(users())
+    assert first is not second
+    asyncio.run(service.aclose())
+    assert service._async_client is None
+
+
+def test_service_limits():
+    class LimitedService(FakeService):
+        MAX_CONNECTIONS = 4
+        KEEPALIVE_EXPIRY = 1
+
+    kwargs = LimitedService().client_kwargs()
+    assert kwargs['limits'] == httpx.Limits(
+        max_connections=4, max_keepalive_connections=20, keepalive_expiry=1,
+    )
+    assert kwargs['http2'] is False
+
+
+def test_endpoint_batch():
+    with FakeService() as service:
+        results = service.users.batch([1, (2,), {'page': 3}])
+        assert results == [{'page': str(i)} for i in range(1, 4)]
+        assert results.ok
+
+        results = service.users.map(range(20), limit=4)
+        assert results == [{'page': str(i)} for i in range(20)]
+
+        results = service.login.batch([('a', 'b'), ('a',)])
+        assert results[0] == {'username': 'a', 'password': 'b', 'force': False}
+        assert isinstance(results[1], RequestParamError)
+        assert list(results.errors) == [1]
+        with pytest.raises(BatchError):
+            results.raise_for_errors()
+
+
+def test_async_endpoint_batch():
+    running = peak = 0
+
+    class SlowService(FakeService):
+        BATCH_LIMIT = 5
+
+        async def slow_handler(self, request):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            page = int(request.url.params['page'])
+            await asyncio.sleep(0.2 if page == 7 else 0.01)
+            running -= 1
+            if page == 3:
+                return httpx.Response(500)
+            return httpx.Response(200, json={'page': page})
+
+        def client_kwargs(self):
+            return super().client_kwargs() | {
+                'transport': httpx.MockTransport(self.slow_handler),
+            }
+
+    async def run():
+        async with SlowService() as service:
+            return await service.async_users.map(range(20), timeout=0.1)
+
+    results = asyncio.run(run())
+    assert peak == 5
+    assert len(results) == 20
+    assert set(results.errors) == {3, 7}
+    assert results.errors[3].status_code == 500
+    assert isinstance(results.errors[7], TimeoutError)
+    assert [r['page'] for r in results if isinstance(r, dict)] == [
+        i for i in range(20) if i not in (3, 7)
+    ]
+
+
+class ScriptedService(Service):
+    """answers with the statuses of `script` in turn, 200 once it runs out."""
+    RETRY_BACKOFF = 0.001
+
+    users = GetAPI('/users/', 'page')
+    login = PostAPI('/login/', 'username')
+    async_users = AsyncGetAPI('/users/', 'page')
+
+    def __init__(self, *script: int | Exception):
+        self.script = list(script)
+        self.sent = 0
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        self.sent += 1
+        status = self.script.pop(0) if self.script else 200
+        if isinstance(status, Exception):
+            raise status
+        return httpx.Response(status, json={'sent': self.sent})
+
+    def client_kwargs(self):
+        return super().client_kwargs() | {
+            'transport': httpx.MockTransport(self.handler),
+        }
+
+
+def test_service_retry():
+    class RetryService(ScriptedService):
+        HOST = 'http://retry.test/'
+        RETRIES = 2
+
+    service = RetryService(503, httpx.ConnectError('refused'))
+    assert service.users(1) == {'sent': 3}
+
+    service = RetryService(503, 503, 503, 200)
+    with pytest.raises(NotSuccessResponse) as e:
+        service.users(1)
+    assert e.value.status_code == 503
+    assert service.sent == 3
+
+    # not idempotent
+    service = RetryService(503)
+    with pytest.raises(NotSuccessResponse):
+        service.login('admin')
+    assert service.sent == 1
+
+    # not retryable
+    service = RetryService(500)
+    with pytest.raises(NotSuccessResponse):
+        service.users(1)
+    assert service.sent == 1
+
+    service = RetryService(*[httpx.ConnectError('refused')] * 3)
+    with pytest.raises(httpx.ConnectError):
+        service.users(1)
+
+    async def run():
+        service = RetryService(502, httpx.ReadTimeout('timeout'))
+        assert await service.async_users(1) == {'sent': 3}
+
+    asyncio.run(run())
+
+
+def test_circuit_breaker():
+    class BreakerService(ScriptedService):
+        HOST = 'http://breaker.test/'
+        RETRIES = 5
+        CIRCUIT_FAILURES = 3
+        CIRCUIT_RESET_TIMEOUT = 0.1
+
+    service = BreakerService(*[503] * 10)
+    # retries stop once the circuit opens
+    with pytest.raises(NotSuccessResponse):
+        service.users(1)
+    assert service.sent == 3
+    with pytest.raises(CircuitOpenError):
+        service.users(1)
+    assert service.sent == 3
+
+    # another service of the host shares the circuit
+    other = BreakerService()
+    with pytest.raises(CircuitOpenError):
+        other.users(1)
+
+    # a failed trial opens it again
+    time.sleep(0.1)
+    with pytest.raises(NotSuccessResponse):
+        service.users(1)
+    assert service.sent == 4
+    with pytest.raises(CircuitOpenError):
+        service.users(1)
+
+    time.sleep(0.1)
+    assert other.users(1) == {'sent': 1}
+    assert service._upstream(service.HOST).breaker.state == CircuitState.CLOSED
+    service.script.clear()
+    assert service.users(1) == {'sent': 5}
+
+
+def test_async_hedged_request():
+    class HedgedService(ScriptedService):
+        HOST = 'http://hedge.test/'
+        HEDGE_QUANTILE = 0.95
+
+    sent = []
+
+    async def handler(request):
+        page = request.url.params['page']
+        sent.append(page)
+        # the first attempt of a slow page is stuck
+        if page == 'slow' and sent.count(page) == 1:
+            await asyncio.sleep(5)
+        else:
+            await asyncio.sleep(0.01)
+        return httpx.Response(200, json={'page': page, 'sent': sent.count(page)})
+
+    async def run():
+        async with HedgedService() as service:
+            service.handler = handler
+            # latencies are recorded without hedging too
+            service.HEDGE_QUANTILE = None
+            for i in range(30):
+                await service.async_users(i)
+            assert len(sent) == 30
+
+            service.HEDGE_QUANTILE = 0.95
+            started = time.monotonic()
+            assert await service.async_users('slow') == {'page': 'slow', 'sent': 2}
+            assert time.monotonic() - started < 1
+
+    asyncio.run(run())
+
+
+class CachedService(Service):
+    HOST = 'http://cached.test/'
+
+    countries = GetAPI('/countries/', 'lang', 'page', cache_ttl=0.2)
+    async_countries = AsyncGetAPI('/countries/', 'lang', 'page', cache_ttl=0.2)
+
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.version = 1
+        self.requests: list[httpx.Request] = []
+        self.lock = threading.Lock()
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        with self.lock:
+            self.requests.append(request)
+        time.sleep(self.delay)
+        etag = f'"v{self.version}"'
+        if request.headers.get('if-none-match') == etag:
+            return httpx.Response(304, headers={'etag': etag})
+        return httpx.Response(
+            200,
+            headers={'etag': etag},
+            json={'version': self.version, **request.url.params},
+        )
+
+    def client_kwargs(self):
+        return super().client_kwargs() | {
+            'transport': httpx.MockTransport(self.handler),
+        }
+
+
+def test_cached_api():
+    config.storage = MemoryStorage()
+    try:
+        service = CachedService()
+        expected = {'version': 1, 'lang': 'en', 'page': '1'}
+        assert service.countries('en', 1) == expected
+        # params are normalized
+        assert service.countries(page=1, lang='en') == expected
+        assert service.countries('zh', 1)['lang'] == 'zh'
+        assert len(service.requests) == 2
+        # results are copies, changing one leaves the cache alone
+        service.countries('en', 1)['version'] = 0
+        assert service.countries('en', 1) == expected
+
+        # revalidated once expired
+        time.sleep(0.2)
+        assert service.countries('en', 1) == expected
+        assert len(service.requests) == 3
+        assert service.requests[-1].headers['if-none-match'] == '"v1"'
+        assert service.countries('en', 1) == expected
+        assert len(service.requests) == 3
+
+        time.sleep(0.2)
+        service.version = 2
+        assert service.countries('en', 1)['version'] == 2
+        assert len(service.requests) == 4
+
+        with pytest.raises(ValueError):
+            PostAPI('/countries/', 'lang', cache_ttl=10)
+    finally:
+        config.storage = None
+
+
+def test_cached_api_coalesced():
+    config.storage = MemoryStorage()
+    service = CachedService(delay=0.1)
+    try:
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(lambda _: service.countries('en', 1), range(8)))
+        assert results == [{'version': 1, 'lang': 'en', 'page': '1'}] * 8
+        assert len(service.requests) == 1
+        # coalesced callers do not share one result
+        assert len({id(result) for result in results}) == 8
+    finally:
+        config.storage = None
+
+
+def test_async_cached_api():
+    config.storage = AsyncMemoryStorage()
+
+    service = CachedService()
+
+    async def handler(request):
+        await asyncio.sleep(0.05)
+        return CachedService.handler(service, request)
+
+    service.handler = handler
+
+    async def run():
+        async with service:
+            results = await asyncio.gather(
+                *[service.async_countries('en', 1) for _ in range(10)]
+            )
+            assert results == [{'version': 1, 'lang': 'en', 'page': '1'}] * 10
+            assert len(service.requests) == 1
+
+            await asyncio.sleep(0.2)
+            assert await service.async_countries('en', 1) == results[0]
+            assert len(service.requests) == 2
+            assert service.requests[-1].headers['if-none-match'] == '"v1"'
+
+    try:
+        asyncio.run(run())
+    finally:
+        # back to the default storage for other tests
+        config.storage = None
+
+
+def feed_chunks(parser, data: bytes, size: int) -> list:
+    items = []
+    for i in range(0, len(data), size):
+        items += parser.feed(data[i:i + size])
+    return items + parser.feed(b'', final=True)
+
+
+def test_json_stream_parsers():
+    items = [
+        {'id': 1, 'name': 'a "quoted" \\ name', 'tags': ['x', 'y']},
+        12345,
+        -1.5e10,
+        '中文',
+        [],
+        None,
+        True,
+        {},
+    ]
+    array = json.dumps(items, ensure_ascii=False).encode()
+    lines = b'\n'.join(json.dumps(item).encode() for item in items) + b'\n\n'
+    for size in (1, 2, 3, 7, 64, len(array)):
+        assert feed_chunks(_JSONArray(json.loads), array, size) == items
+        assert feed_chunks(_JSONLines(json.loads), lines, size) == items
+    assert feed_chunks(_JSONArray(json.loads), b' [ ] ', 1) == []
+
+    for bad in (b'{"a": 1}', b'[1, 2', b'[1 2]', b'[1] 2', b'[1, {]'):
+        with pytest.raises(ValueError):
+            feed_chunks(_JSONArray(json.loads), bad, 2)
+    # malformed input fails in its chunk, without waiting for the end
+    parser = _JSONArray(json.loads)
+    assert parser.feed(b'[{"a": "\\') == []
+    assert parser.feed(b'"]", "b": [1') == []
+    with pytest.raises(ValueError):
+        parser.feed(b'}')
+
+
+class ExportService(Service):
+    HOST = 'http://export.test/'
+
+    orders = GetAPI('/orders/', 'day', stream=StreamFormat.LINES)
+    items = GetAPI('/items/', 'day', stream=StreamFormat.ARRAY)
+    async_orders = AsyncGetAPI('/orders/', 'day', stream=StreamFormat.LINES)
+    async_items = AsyncGetAPI('/items/', 'day', stream='array')
+
+    def __init__(self, count: int):
+        self.count = count
+
+    def body(self, request: httpx.Request):
+        day = request.url.params['day']
+        if request.url.path == '/orders/':
+            for i in range(self.count):
+                yield json.dumps({'day': day, 'id': i}).encode() + b'\n'
+        else:
+            yield b'['
+            for i in range(self.count):
+                yield (b',' if i else b'') + json.dumps({'id': i}).encode()
+            yield b']'
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        if request.url.params['day'] == 'bad':
+            return httpx.Response(400, json={'error': 'bad day'})
+        return httpx.Response(200, content=self.body(request))
+
+    def client_kwargs(self):
+        return super().client_kwargs() | {
+            'transport': httpx.MockTransport(self.handler),
+        }
+
+
+def test_streamed_api():
+    with ExportService(1000) as service:
+        orders = service.orders('2024-01-01')
+        assert next(orders) == {'day': '2024-01-01', 'id': 0}
+        assert sum(1 for _ in orders) == 999
+        assert [item['id'] for item in service.items('x')] == list(range(1000))
+
+        with pytest.raises(NotSuccessResponse) as e:
+            list(service.items('bad'))
+        assert e.value.resp.json() == {'error': 'bad day'}
+        with pytest.raises(TypeError):
+            service.orders.batch(['2024-01-01'])
+
+    with pytest.raises(ValueError):
+        GetAPI('/orders/', 'day', stream=StreamFormat.LINES, cache_ttl=10)
+
+
+def test_async_streamed_api():
+    class AsyncExportService(ExportService):
+        async def abody(self, request):
+            for chunk in self.body(request):
+                yield chunk
+
+        def handler(self, request):
+            return httpx.Response(200, content=self.abody(request))
+
+    async def run():
+        async with AsyncExportService(100) as service:
+            orders = [o async for o in service.async_orders('2024-01-01')]
+            assert orders == [{'day': '2024-01-01', 'id': i} for i in range(100)]
+            items = [i['id'] async for i in service.async_items('x')]
+            assert items == list(range(100))
+
+    asyncio.run(run())
+
+
+def test_service_decode():
+    class DecimalService(FakeService):
+        def decode(self, content):
+            return json.loads(content, parse_float=str)
+
+    with DecimalService() as service:
+        assert service.login('admin', 0.1) == {
+            'username': 'admin', 'password': '0.1', 'force': False,
+        }
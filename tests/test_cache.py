@@ -1,10 +1,33 @@
 import asyncio
+import fcntl
+import functools
+import importlib.util
+import multiprocessing
+import os
+import pickle
+import threading
 import time
 
-from zhtools.cache import Empty, MemoryStorage, cache
+import pytest
+
+from zhtools.cache import (AsyncMemoryStorage, AsyncRedisStorage,
+                           AsyncTieredStorage, BoundedMemoryStorage, Empty,
+                           EvictionPolicy, LocalChannel, MemoryStorage,
+                           RedisStorage, TieredStorage, cache, cond_lru_cache,
+                           reset_stats, shared_memory, stats)
 from zhtools.cache.decorators import get_func_name
+from zhtools.cache.disk import DiskStorage
+from zhtools.cache.keys import KeyBuilder
+from zhtools.cache.metrics import metrics
+from zhtools.cache.serializers import (Codec, Compression, MsgpackSerializer,
+                                       OrjsonSerializer)
+from zhtools.cache.shared_memory import SharedMemoryStorage
+from zhtools.cache.storages import Storage
+from zhtools.cache.writers import AsyncWriter, OverflowPolicy
 from zhtools.config import config
 
+from .common import FakeAsyncRedis, FakeRedis
+
 
 def test_get_func_name():
     def func1():
@@ -101,24 +124,6 @@ def test_classmethod():
     assert called == 2
 
 
-class AsyncMemoryStorage(MemoryStorage):
-    async def get(self, key: str):
-        val, expire = self.data.get(key, (Empty, 0))
-        if val is Empty:
-            return val
-
-        if expire < time.time():
-            del self.data[key]
-            return Empty
-        return val
-
-    async def setex(self, key: str, value, expire: float):
-        if expire is None:
-            expire = float('inf')
-        expire_at = time.time() + expire
-        self.data[key] = (value, expire_at)
-
-
 def test_async():
     config.storage = AsyncMemoryStorage()
 
@@ -132,3 +137,869 @@ def test_async():
         await foo(2)
 
     asyncio.run(run())
+
+
+def test_bounded_memory_storage_lru():
+    storage = BoundedMemoryStorage(max_entries=2)
+    storage.setex('a', 1, 10)
+    storage.setex('b', 2, 10)
+    assert storage.get('a') == 1
+    storage.setex('c', 3, 10)
+    assert storage.get('b') is Empty
+    assert storage.get('a') == 1
+    assert storage.get('c') == 3
+    assert len(storage) == 2
+    assert storage.evictions == 1
+
+
+def test_bounded_memory_storage_lfu():
+    storage = BoundedMemoryStorage(max_entries=2, policy=EvictionPolicy.LFU)
+    storage.setex('a', 1, 10)
+    storage.setex('b', 2, 10)
+    storage.get('a')
+    storage.get('a')
+    storage.get('b')
+    storage.setex('c', 3, 10)
+    assert storage.get('b') is Empty
+    assert storage.get('a') == 1
+    storage.setex('d', 4, 10)
+    assert storage.get('c') is Empty
+    assert storage.evictions == 2
+
+    # removing the last key of the lowest frequency moves eviction up
+    storage = BoundedMemoryStorage(max_entries=3, policy=EvictionPolicy.LFU)
+    for key, reads in (('a', 3), ('b', 1), ('c', 2)):
+        storage.setex(key, key, 10)
+        for _ in range(reads):
+            storage.get(key)
+    storage.delete('b')
+    storage.setex('d', 'd', 10)
+    storage.get('d')
+    storage.get('d')
+    storage.setex('e', 'e', 10)
+    assert storage.get('c') is Empty
+    assert [storage.get(k) for k in 'ade'] == ['a', 'd', 'e']
+
+
+def test_bounded_memory_storage_bytes():
+    storage = BoundedMemoryStorage(max_bytes=100, sizeof=len)
+    storage.setex('a', 'x' * 60, 10)
+    storage.setex('b', 'x' * 30, 10)
+    storage.setex('c', 'x' * 30, 10)
+    assert storage.get('a') is Empty
+    assert storage.nbytes == 60
+    storage.setex('d', 'x' * 200, 10)
+    assert storage.get('d') is Empty
+    assert storage.evicted_bytes == 60
+
+
+def test_memory_storage_purge():
+    storage = MemoryStorage()
+    for i in range(100):
+        storage.setex(f'old{i}', i, 0.01)
+    storage.set('forever', 1)
+    time.sleep(0.02)
+    storage.setex('new', 1, 10)
+    assert len(storage) == 102 - MemoryStorage.purge_batch
+    assert storage.purge_expired() == 100 - MemoryStorage.purge_batch
+    assert len(storage) == 2
+    assert storage.get('forever') == 1
+
+
+def test_memory_storage_sweeper():
+    storage = BoundedMemoryStorage(max_entries=1000)
+    storage.start_sweeper(interval=0.01)
+    for i in range(100):
+        storage.setex(f'k{i}', i, 0.01)
+    time.sleep(0.1)
+    storage.stop_sweeper()
+    assert len(storage) == 0
+    assert storage.evictions == 0
+
+
+def test_coalesce():
+    config.storage = MemoryStorage()
+    called = 0
+    barrier = threading.Barrier(8)
+
+    @cache(coalesce=True)
+    def foo(i):
+        nonlocal called
+        called += 1
+        time.sleep(0.05)
+        return i * i
+
+    def run():
+        barrier.wait()
+        assert foo(3) == 9
+
+    threads = [threading.Thread(target=run) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert called == 1
+
+    @cache(coalesce=True)
+    def bar():
+        time.sleep(0.05)
+        raise ValueError()
+
+    errors = []
+
+    def run_bar():
+        try:
+            bar()
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run_bar) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(errors) == 4
+    assert len({id(e) for e in errors}) < 4
+
+
+@pytest.mark.asyncio
+async def test_async_coalesce():
+    config.storage = AsyncMemoryStorage()
+    called = 0
+
+    @cache(coalesce=True)
+    async def foo(i):
+        nonlocal called
+        called += 1
+        await asyncio.sleep(0.05)
+        return i * i
+
+    assert await asyncio.gather(*[foo(3) for _ in range(10)]) == [9] * 10
+    assert called == 1
+    assert await foo(3) == 9
+    assert called == 1
+
+    @cache(coalesce=True)
+    async def bar():
+        await asyncio.sleep(0.05)
+        raise ValueError()
+
+    results = await asyncio.gather(*[bar() for _ in range(4)], return_exceptions=True)
+    assert all(isinstance(r, ValueError) for r in results)
+
+    # a cancelled caller leaves the shared call running for the others
+    @cache(coalesce=True)
+    async def baz():
+        await asyncio.sleep(0.05)
+        return 1
+
+    first = asyncio.create_task(baz())
+    await asyncio.sleep(0)
+    second = asyncio.create_task(baz())
+    await asyncio.sleep(0.01)
+    first.cancel()
+    assert await second == 1
+    assert first.cancelled()
+
+    # the call is cancelled once no caller is left
+    finished = []
+
+    @cache(coalesce=True)
+    async def qux():
+        await asyncio.sleep(0.05)
+        finished.append(1)
+
+    task = asyncio.create_task(qux())
+    await asyncio.sleep(0.01)
+    task.cancel()
+    await asyncio.sleep(0.08)
+    assert task.cancelled() and finished == []
+
+
+def _wait_until(predicate, timeout=1.0):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.005)
+
+
+def test_stale_while_revalidate():
+    config.storage = MemoryStorage()
+    called = 0
+
+    @cache(expire=0.05, stale_ttl=10)
+    def foo():
+        nonlocal called
+        called += 1
+        return called
+
+    assert foo() == 1
+    assert foo() == 1
+    time.sleep(0.06)
+    assert foo() == 1
+    _wait_until(lambda: called == 2)
+    assert called == 2
+    _wait_until(lambda: foo() == 2)
+    assert foo() == 2
+
+
+def test_early_refresh():
+    config.storage = MemoryStorage()
+    called = 0
+
+    deco = cache(expire=10, early_refresh=1e6)
+
+    @deco
+    def foo():
+        nonlocal called
+        called += 1
+        time.sleep(0.01)
+        return called
+
+    assert foo() == 1
+    assert foo() == 1
+    _wait_until(lambda: called == 2 and not deco._refreshing)
+    assert called == 2
+
+
+@pytest.mark.asyncio
+async def test_async_stale_while_revalidate():
+    config.storage = AsyncMemoryStorage()
+    called = 0
+
+    @cache(expire=0.05, stale_ttl=10)
+    async def foo():
+        nonlocal called
+        called += 1
+        return called
+
+    assert await foo() == 1
+    await asyncio.sleep(0.06)
+    assert await foo() == 1
+    await asyncio.sleep(0.01)
+    assert called == 2
+    assert await foo() == 2
+
+
+class Point:
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+
+def test_key_builder():
+    def foo(a, b=2, *args, c=3, **kwargs):
+        pass
+
+    make_key = KeyBuilder(foo)
+    assert make_key(1) == make_key(1, 2) == make_key(1, b=2) == make_key(a=1, c=3)
+    assert make_key(1) != make_key(1, 3)
+    assert make_key(1, 2, 3) != make_key(1, 2)
+    assert make_key(1, x=1, y=2) == make_key(1, y=2, x=1)
+    assert make_key({'a': [1, 2]}) == make_key({'a': [1, 2]})
+    assert make_key({'a': [1, 2]}) != make_key({'a': [2, 1]})
+    assert make_key(Point(1, 2)) == make_key(Point(1, 2))
+    assert make_key(Point(1, 2)) != make_key(Point(2, 1))
+    assert len(make_key('x' * 10000)) < 200
+    assert make_key('x' * 10000) != make_key('x' * 10001)
+    assert make_key({3, 1, 2}) == make_key({1, 2, 3})
+    with pytest.raises(TypeError):
+        make_key()
+
+
+def test_key_builder_callables():
+    def foo(a, b):
+        pass
+
+    class Adder:
+        def __call__(self, a, b=1):
+            pass
+
+    make_key = KeyBuilder(foo)
+    with pytest.raises(TypeError):
+        make_key(1)
+    with pytest.raises(TypeError):
+        make_key(1, 2, 3)
+    with pytest.raises(TypeError):
+        make_key(1, c=2)
+
+    key = KeyBuilder(Adder())(1)
+    assert key.startswith(f'{__name__}.test_key_builder_callables.<locals>.Adder:')
+    one, two = functools.partial(foo, 1), functools.partial(foo, 2)
+    assert KeyBuilder(one)(2) != KeyBuilder(two)(2)
+
+
+def test_cache_method_instance_key():
+    config.storage = MemoryStorage()
+    try:
+        class Counter:
+            def __init__(self):
+                self.calls = 0
+
+            @cache
+            def get(self, a):
+                self.calls += 1
+                return a
+
+        class Named:
+            def __init__(self, name):
+                self.name = name
+
+            def __cache_key__(self):
+                return self.name
+
+            @cache
+            def get(self, a):
+                return (self.name, id(self))
+
+        # mutating the instance keeps its key
+        counter = Counter()
+        assert [counter.get(1) for _ in range(3)] == [1, 1, 1]
+        assert counter.calls == 1
+        assert Counter().get(1) == 1
+
+        # __cache_key__ names instances, equal names share entries
+        first = Named('a').get(1)
+        assert Named('a').get(1) == first
+        assert Named('b').get(1) != first
+    finally:
+        config.storage = None
+
+
+def test_storage_without_delete():
+    class GetSetStorage(Storage):
+        def __init__(self):
+            self.data = {}
+
+        def get(self, key):
+            return self.data.get(key, Empty)
+
+        def setex(self, key, value, expire):
+            self.data[key] = value
+
+    storage = GetSetStorage()
+    storage.set('a', 1)
+    assert storage.get('a') == 1
+    with pytest.raises(NotImplementedError):
+        storage.delete('a')
+
+
+def test_tiered_storage():
+    l2 = MemoryStorage()
+    channel = LocalChannel()
+    a = TieredStorage(l2, l1_ttl=10, channel=channel)
+    b = TieredStorage(l2, l1_ttl=10, channel=channel)
+    c = TieredStorage(l2, l1_ttl=10)
+    a.setex('k', 1, 100)
+    assert b.get('k') == 1
+    assert c.get('k') == 1
+    assert b.l1.get('k') == 1
+
+    a.setex('k', 2, 100)
+    assert a.l1.get('k') == 2
+    assert b.l1.get('k') is Empty
+    assert b.get('k') == 2
+    assert c.get('k') == 1
+
+    b.delete('k')
+    assert a.get('k') is Empty
+    assert l2.get('k') is Empty
+
+    messages = []
+    channel.subscribe(messages.append)
+    a.set_many({'x': 1, 'y': 2}, 100)
+    assert b.get_many(['x', 'y']) == [1, 2]
+    a.delete_many(['x', 'y'])
+    assert b.l1.get_many(['x', 'y']) == [Empty, Empty]
+    assert len(messages) == 2
+
+
+def test_tiered_storage_l1_ttl():
+    for l2 in (MemoryStorage(), RedisStorage(FakeRedis())):
+        tiered = TieredStorage(l2, l1_ttl=10)
+        l2.setex('k', 1, 1)
+        l2.set_many({'a': 1, 'b': 2}, 1)
+        l2.set('forever', 3)
+        assert tiered.get('k') == 1
+        assert tiered.get_many(['a', 'b', 'forever']) == [1, 2, 3]
+        for key in ('k', 'a', 'b'):
+            assert tiered.l1.data[key][1] <= time.time() + 1
+        assert tiered.l1.data['forever'][1] > time.time() + 9
+
+
+def test_async_tiered_storage():
+    async def main():
+        channel = LocalChannel()
+        l2 = AsyncMemoryStorage()
+        a = AsyncTieredStorage(l2, l1_ttl=10, channel=channel)
+        b = AsyncTieredStorage(l2, l1_ttl=10, channel=channel)
+        await a.setex('k', 1, 0.5)
+        assert await b.get('k') == 1
+        assert b.l1.data['k'][1] <= time.time() + 0.5
+        await a.delete('k')
+        assert b.l1.get('k') is Empty
+
+    asyncio.run(main())
+
+
+def test_storage_many():
+    storage = MemoryStorage()
+    storage.set_many({'a': 1, 'b': 2}, 10)
+    assert storage.get_many(['a', 'b', 'c']) == [1, 2, Empty]
+    storage.delete_many(['a', 'c'])
+    assert storage.get_many(['a', 'b']) == [Empty, 2]
+
+    tiered = TieredStorage(storage)
+    assert tiered.get_many(['a', 'b']) == [Empty, 2]
+    assert tiered.l1.get('b') == 2
+
+
+def test_batch_cache():
+    config.storage = MemoryStorage()
+    fetched = []
+
+    @cache.batch(expire=10)
+    def get_squares(ids, offset=0):
+        fetched.append(list(ids))
+        return {i: i * i + offset for i in ids if i >= 0}
+
+    assert get_squares([1, 2]) == {1: 1, 2: 4}
+    assert get_squares([3, 2, 1, -1, 3]) == {3: 9, 2: 4, 1: 1}
+    assert fetched == [[1, 2], [3, -1]]
+    assert get_squares([1], offset=1) == {1: 2}
+    assert get_squares([2, 3]) == {2: 4, 3: 9}
+    assert fetched == [[1, 2], [3, -1], [1]]
+    assert get_squares(ids=[2, 4], offset=1) == {2: 5, 4: 17}
+    assert fetched[-1] == [2, 4]
+
+
+@pytest.mark.asyncio
+async def test_async_batch_cache():
+    config.storage = AsyncMemoryStorage()
+    fetched = []
+
+    class Repo:
+        @cache.batch(key=lambda func, self, i: f'square:{i}')
+        async def get_squares(self, ids):
+            fetched.append(list(ids))
+            return {i: i * i for i in ids}
+
+    repo = Repo()
+    assert await repo.get_squares([1, 2]) == {1: 1, 2: 4}
+    assert await repo.get_squares([2, 3]) == {2: 4, 3: 9}
+    assert await repo.get_squares(ids=[3, 4]) == {3: 9, 4: 16}
+    assert fetched == [[1, 2], [3], [4]]
+
+
+def test_codec():
+    value = {'a': [1, 2, 3] * 1000, 'b': 'text'}
+    codecs = [Codec(), Codec(compression=Compression.ZLIB)]
+    for module, serializer in (('msgpack', MsgpackSerializer), ('orjson', OrjsonSerializer)):
+        if importlib.util.find_spec(module):
+            codecs.append(Codec(serializer(), compression=Compression.ZLIB))
+    if importlib.util.find_spec('lz4'):
+        codecs.append(Codec(compression=Compression.LZ4, threshold=10))
+
+    loader = Codec()
+    for codec in codecs:
+        data = codec.dumps(value)
+        assert codec.loads(data) == value
+        assert loader.loads(data) == value
+    assert len(Codec(compression=Compression.ZLIB).dumps(value)) < len(Codec().dumps(value))
+    assert loader.loads(pickle.dumps(value)) == value
+
+
+def test_refreshable_cache_codecs():
+    codecs = [Codec()]
+    for module, serializer in (('msgpack', MsgpackSerializer), ('orjson', OrjsonSerializer)):
+        if importlib.util.find_spec(module):
+            codecs.append(Codec(serializer()))
+    try:
+        for codec in codecs:
+            config.storage = RedisStorage(FakeRedis(), codec=codec)
+            called = []
+
+            @cache(expire=10, stale_ttl=10, early_refresh=1)
+            def foo(a):
+                called.append(a)
+                return {'a': a}
+
+            assert foo(1) == foo(1) == {'a': 1}
+            assert called == [1]
+    finally:
+        config.storage = None
+
+
+def test_redis_storage():
+    cli = FakeRedis()
+    storage = RedisStorage(cli, codec=Codec(compression=Compression.ZLIB, threshold=10))
+    storage.setex('a', 'x' * 100, 10)
+    storage.set('b', [1, 2])
+    assert len(cli.data['a']) < 100
+    assert storage.get('a') == 'x' * 100
+    cli.set('raw', b'not a codec value')
+    assert storage.get_many(['a', 'b', 'c', 'raw']) == ['x' * 100, [1, 2], Empty, b'not a codec value']
+    storage.set_many({'c': 3, 'd': 4}, 10)
+    storage.delete_many(['a', 'd'])
+    assert storage.get_many(['a', 'c', 'd']) == [Empty, 3, Empty]
+
+
+def test_stats():
+    config.storage = BoundedMemoryStorage(max_entries=1)
+    reset_stats()
+    events = []
+    config.cache_stats_hook = lambda scope, name, value: events.append((scope, name))
+
+    @cache
+    def foo(i):
+        return i
+
+    foo(1)
+    foo(1)
+    foo(2)
+
+    def run():
+        foo(2)
+
+    t = threading.Thread(target=run)
+    t.start()
+    t.join()
+    config.cache_stats_hook = None
+
+    result = stats()
+    func_stats = result['functions'][f'{foo.__module__}.{foo.__qualname__}']
+    assert func_stats['hits'] == 2
+    assert func_stats['misses'] == 2
+    assert func_stats['sets'] == 2
+    assert func_stats['call']['count'] == 2
+    storage_stats = result['storages']['BoundedMemoryStorage']
+    assert storage_stats['get']['count'] == 4
+    assert storage_stats['evictions'] == 1
+    assert ('storages:BoundedMemoryStorage', 'evictions') in events
+
+    RedisStorage(FakeRedis()).set('a', 'x')
+    assert stats()['storages']['RedisStorage']['bytes_serialized'] > 0
+
+    # counters of finished threads are retired without reading stats
+    for _ in range(200):
+        t = threading.Thread(target=run)
+        t.start()
+        t.join()
+    assert len(metrics._threads) < 50
+    assert stats()['functions'][f'{foo.__module__}.{foo.__qualname__}']['hits'] == 202
+
+
+@pytest.mark.asyncio
+async def test_async_writer():
+    written = []
+
+    async def write(i):
+        await asyncio.sleep(0.01)
+        written.append(i)
+
+    writer = AsyncWriter(max_concurrency=2, max_pending=3, policy=OverflowPolicy.DROP)
+    results = [await writer.submit(write, i) for i in range(5)]
+    assert results == [True, True, True, False, False]
+    assert writer.dropped == 2
+    assert await writer.flush()
+    assert sorted(written) == [0, 1, 2]
+
+    writer = AsyncWriter(max_pending=2)
+    for i in range(5):
+        await writer.submit(write, i)
+        assert writer.pending <= 2
+    await writer.flush()
+    assert writer.pending == 0
+    assert len(written) == 8
+
+
+@pytest.mark.asyncio
+async def test_async_cache_write_behind():
+    cli = FakeAsyncRedis()
+    config.storage = AsyncRedisStorage(cli)
+
+    @cache
+    async def foo(i):
+        return i
+
+    await foo(1)
+    assert config.async_writer.pending == 1
+    assert await config.async_writer.flush()
+    assert [await config.storage.get(key) for key in cli.redis.data] == [1]
+
+
+def test_cond_lru_cache():
+    calls = []
+
+    @cond_lru_cache(lambda a: a > 0, maxsize=2)
+    def foo(a):
+        calls.append(a)
+        return a
+
+    assert [foo(1), foo(1), foo(-1), foo(-1)] == [1, 1, -1, -1]
+    assert calls == [1, -1, -1]
+    assert foo.cache_info() == (1, 1, 2, 1)
+
+    foo(2)
+    foo(3)
+    foo(1)
+    assert calls == [1, -1, -1, 2, 3, 1]
+    assert foo.cache_info().currsize == 2
+
+    foo.cache_clear()
+    assert foo.cache_info() == (0, 0, 2, 0)
+    assert 'cache_info' not in vars(foo.__wrapped__)
+
+
+def test_cond_lru_cache_ttl():
+    calls = []
+
+    @cond_lru_cache(lambda a: True, ttl=0.05)
+    def foo(a):
+        calls.append(a)
+        return a
+
+    foo(1)
+    foo(1)
+    time.sleep(0.06)
+    foo(1)
+    assert calls == [1, 1]
+
+
+def test_cond_lru_cache_method():
+    calls = []
+
+    class A:
+        def __init__(self, n):
+            self.n = n
+
+        @cond_lru_cache(lambda a: True)
+        def foo(self, a):
+            calls.append((self.n, a))
+            return self.n + a
+
+    a, b = A(1), A(2)
+    assert [a.foo(1), a.foo(1), b.foo(1), b.foo(1)] == [2, 2, 3, 3]
+    assert calls == [(1, 1), (2, 1)]
+    assert a.foo.cache_info() == (1, 1, 128, 1)
+    assert A.foo.cache_info() == (2, 2, 256, 2)
+
+    a.foo.cache_clear()
+    assert a.foo.cache_info() == (0, 0, 128, 0)
+    assert b.foo.cache_info() == (1, 1, 128, 1)
+
+    del b
+    assert A.foo.cache_info().currsize == 0
+
+    # concurrent first calls on an instance share one cache
+    barrier = threading.Barrier(8)
+
+    class B:
+        @cond_lru_cache(lambda a: barrier.wait() is not None)
+        def foo(self, a):
+            return a
+
+    c = B()
+    threads = [threading.Thread(target=c.foo, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert c.foo.cache_info() == (0, 8, 128, 8)
+
+
+@pytest.mark.asyncio
+async def test_async_nowait_storage():
+    for storage in (MemoryStorage(), AsyncMemoryStorage()):
+        config.storage = storage
+        called = 0
+
+        @cache
+        async def foo(i):
+            nonlocal called
+            called += 1
+            return i
+
+        @cache.batch
+        async def bar(ids):
+            return {i: i for i in ids}
+
+        assert [await foo(1), await foo(1)] == [1, 1]
+        assert called == 1
+        assert await bar([1, 2]) == {1: 1, 2: 2}
+        assert await bar([2, 3]) == {2: 2, 3: 3}
+        # written inline, nothing left to the write-behind queue
+        assert config.async_writer.pending == 0
+        assert len(storage) == 4
+
+
+def _shared_memory_writer(storage, key, value):
+    storage.setex(key, value, 10)
+
+
+def test_shared_memory_storage(tmp_path):
+    path = str(tmp_path / 'cache')
+    storage = SharedMemoryStorage(slots=8, slot_size=128, segments=2, path=path)
+    storage.setex('a', [1, 2], 10)
+    storage.setex('b', 'x', 0.05)
+    storage.setex('a', [3], 10)
+    assert storage.get('a') == [3]
+    assert storage.get('b') == 'x'
+    assert storage.get('c') is Empty
+    storage.setex('big', 'x' * 200, 10)
+    assert storage.get('big') is Empty
+    storage.setex('small', 'x', 10)
+    storage.setex('small', 'x' * 200, 10)
+    assert storage.get('small') is Empty
+
+    time.sleep(0.06)
+    assert storage.get('b') is Empty
+    storage.delete('a')
+    assert storage.get('a') is Empty
+    assert len(storage) == 0
+
+    # a full segment evicts the entry expiring first
+    for i in range(20):
+        storage.setex(f'k{i}', i, 100 + i)
+    assert len(storage) == 8
+    assert storage.get('k19') == 19
+
+    # other processes share the table
+    other = SharedMemoryStorage(path=path)
+    assert other.per_segment == 4
+    ctx = multiprocessing.get_context('spawn')
+    p = ctx.Process(target=_shared_memory_writer, args=(other, 'p', {'x': 1}))
+    p.start()
+    p.join()
+    assert storage.get('p') == {'x': 1}
+
+    storage.clear()
+    assert len(other) == 0
+    other.close()
+    storage.close()
+    storage.unlink()
+    with pytest.raises(FileNotFoundError):
+        pickle.loads(pickle.dumps(storage))
+
+
+@pytest.mark.skipif(not shared_memory._OFD, reason='needs open file description locks')
+def test_shared_memory_lock_owner(tmp_path):
+    path = str(tmp_path / 'cache')
+    storage = SharedMemoryStorage(slots=8, slot_size=128, segments=2, path=path)
+    storage._acquire(0)
+    # closing another fd of the file keeps the lock, unlike lockf
+    SharedMemoryStorage(path=path).close()
+    fd = os.open(path, os.O_RDWR)
+    probe = shared_memory._FLOCK.pack(fcntl.F_WRLCK, os.SEEK_SET, 64, 1, 0)
+    with pytest.raises(BlockingIOError):
+        fcntl.fcntl(fd, fcntl.F_OFD_SETLK, probe)
+    storage._release(0)
+    fcntl.fcntl(fd, fcntl.F_OFD_SETLK, probe)
+    os.close(fd)
+    storage.close()
+
+
+def test_disk_storage(tmp_path):
+    path = str(tmp_path / 'cache')
+    storage = DiskStorage(path, max_bytes=4096, segment_size=1024, slots=64)
+    storage.setex('a', [1, 2], 10)
+    storage.setex('b', 'x', 0.05)
+    storage.setex('a', [3], 10)
+    assert storage.get('a') == [3]
+    assert storage.get('b') == 'x'
+    assert storage.get('c') is Empty
+    time.sleep(0.06)
+    assert storage.get('b') is Empty
+    storage.delete('a')
+    assert storage.get('a') is Empty
+    storage.setex('a', 'x', 10)
+    storage.setex('a', 'x' * 4096, 10)
+    assert storage.get('a') is Empty
+
+    # segments over max_bytes are compacted to the newest entries
+    for i in range(100):
+        storage.setex(f'k{i}', 'x' * 50, 100)
+    assert storage.get('k99') == 'x' * 50
+    assert 0 < len(storage) < 100
+    segments = [name for name in os.listdir(path) if name.endswith('.seg')]
+    assert sum(os.path.getsize(os.path.join(path, n)) for n in segments) <= 4096
+
+    # survives reopening, shared with other instances
+    storage.setex('p', {'x': 1}, None)
+    other = DiskStorage(path)
+    assert other.slots == 64
+    assert other.get('p') == {'x': 1}
+    other.compact()
+    assert storage.get('p') == {'x': 1}
+    storage.clear()
+    assert other.get('p') is Empty
+    other.close()
+    storage.close()
+
+
+def test_disk_storage_instances(tmp_path):
+    # instances on one directory exclude each other within a process
+    path = str(tmp_path / 'cache')
+    storages = [DiskStorage(path, slots=4096), DiskStorage(path)]
+
+    def write(storage, prefix):
+        for i in range(500):
+            storage.setex(f'{prefix}{i}', f'{prefix}-{i}' * 3, 100)
+
+    threads = [threading.Thread(target=write, args=(s, p)) for s, p in zip(storages, 'ab')]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for prefix in 'ab':
+        for i in range(500):
+            assert storages[0].get(f'{prefix}{i}') == f'{prefix}-{i}' * 3
+    for storage in storages:
+        storage.close()
+
+
+def test_cache_tags():
+    for storage in (MemoryStorage(), RedisStorage(FakeRedis())):
+        config.storage = storage
+        called = []
+
+        @cache(tags=['users'])
+        def foo(i):
+            called.append(i)
+            return i
+
+        @cache(tags=['users', 'orders'])
+        def bar(i):
+            called.append(-i)
+            return i
+
+        foo(1), foo(1), bar(1), bar(1)
+        assert called == [1, -1]
+        cache.invalidate('orders')
+        foo(1), bar(1)
+        assert called == [1, -1, -1]
+        cache.invalidate('users')
+        foo(1), bar(1)
+        assert called == [1, -1, -1, 1, -1]
+
+        # an evicted version does not bring back old entries
+        storage.delete('zhtools:tag:users')
+        foo(1)
+        assert called[-1] == 1
+
+
+@pytest.mark.asyncio
+async def test_async_cache_tags():
+    config.storage = AsyncMemoryStorage()
+    called = []
+
+    @cache(tags=['users'])
+    async def foo(i):
+        called.append(i)
+        return i
+
+    await foo(1)
+    await config.async_writer.flush()
+    await foo(1)
+    await cache.ainvalidate('users')
+    await foo(1)
+    assert called == [1, 1]
@@ -0,0 +1,241 @@
+import array
+import asyncio
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from zhtools.concurrents import (AsyncRedisLock, CoroutineConcurrent,
+                                 ProcessConcurrent, RedisLock,
+                                 ThreadConcurrent, fencing_token,
+                                 with_async_redis_lock, with_keyed_lock,
+                                 with_redis_lock)
+from zhtools.exceptions import LockLost, LockNotAcquired
+
+from .common import FakeAsyncRedis, FakeRedis
+
+
+def test_thread_concurrent():
+    with ThreadConcurrent(max_workers=4) as c:
+        for i in range(100):
+            c.execute(pow, i, 2)
+    assert c.results == [i**2 for i in range(100)]
+
+    with ThreadPoolExecutor(2) as pool:
+        for _ in range(2):
+            with ThreadConcurrent(executor=pool) as c:
+                c.execute(pow, 2, 3)
+            assert c.results == [8]
+        # a shared pool is left running for its owner
+        assert pool.submit(pow, 2, 4).result() == 16
+
+
+def test_nested_thread_concurrent():
+    def inner(i):
+        with ThreadConcurrent(max_workers=2) as c:
+            c.execute(pow, i, 2)
+            c.execute(pow, i, 3)
+        return c.results
+
+    with ThreadConcurrent(max_workers=2) as c:
+        for i in range(4):
+            c.execute(inner, i)
+    assert c.results == [[i**2, i**3] for i in range(4)]
+
+
+def test_thread_concurrent_error():
+    started = []
+
+    def task(i):
+        started.append(i)
+        if i == 1:
+            raise ValueError(i)
+        time.sleep(0.01)
+        return i
+
+    c = ThreadConcurrent(max_workers=2)
+    with pytest.raises(ValueError):
+        with c:
+            futures = [c.execute(task, i) for i in range(50)]
+    assert len(started) < 50
+    assert any(fut.cancelled() for fut in futures)
+    assert threading.active_count() < 10
+
+
+def test_process_concurrent():
+    with ProcessConcurrent(max_workers=2) as c:
+        for i in range(10):
+            c.execute(pow, i, 2)
+    assert c.results == [i**2 for i in range(10)]
+
+    with pytest.raises(ZeroDivisionError):
+        with ProcessConcurrent(max_workers=2) as c:
+            c.execute(divmod, 1, 0)
+
+
+@pytest.mark.asyncio
+async def test_coroutine_concurrent_limit():
+    running = peak = 0
+
+    async def task(i):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.001)
+        running -= 1
+        return i
+
+    async with CoroutineConcurrent(limit=3) as c:
+        for i in range(20):
+            c.execute(task(i))
+    assert c.results == list(range(20))
+    assert peak == 3
+
+    c = CoroutineConcurrent(limit=5)
+    assert await c.execute_batch(task(i) for i in range(50)) == list(range(50))
+
+    results = [r async for r in c.as_completed(task(i) for i in range(50))]
+    assert sorted(results) == [(i, i) for i in range(50)]
+    assert peak == 5
+
+
+@pytest.mark.asyncio
+async def test_coroutine_concurrent_errors():
+    finished = []
+
+    async def task(i, delay=0.0):
+        await asyncio.sleep(delay)
+        if i == 1:
+            raise ValueError(i)
+        finished.append(i)
+        return i
+
+    c = CoroutineConcurrent(limit=2)
+    with pytest.raises(ValueError):
+        await c.execute_batch([task(i) for i in range(5)])
+    assert isinstance(c.results[1], ValueError)
+    assert sorted(finished) == [0, 2, 3, 4]
+
+    finished.clear()
+    c = CoroutineConcurrent(limit=2, fail_fast=True)
+    with pytest.raises(ValueError):
+        await c.execute_batch([task(0, 0.05), task(1)] + [task(i) for i in range(2, 5)])
+    assert finished == []
+
+    c = CoroutineConcurrent(timeout=0.01)
+    results = dict([r async for r in c.as_completed([task(0, 1), task(2)])])
+    assert isinstance(results[0], TimeoutError)
+    assert results[1] == 2
+
+
+def _checksum(item):
+    i, data = item
+    return i, sum(data)
+
+
+def test_process_concurrent_map():
+    c = ProcessConcurrent(max_workers=2)
+    assert list(c.map(abs, range(-50, 0), chunksize=7)) == list(range(50, 0, -1))
+
+    items = [(i, bytes([i]) * 100_000) for i in range(10)]
+    items.append((10, array.array('i', range(1000))))
+    results = list(
+        c.map(_checksum, items, chunksize=3, ordered=False, share_threshold=1000)
+    )
+    assert sorted(results) == [(i, i * 100_000) for i in range(10)] + [(10, 499500)]
+
+    with pytest.raises(ValueError):
+        list(c.map(math.sqrt, [1, -1]))
+
+
+def test_redis_lock():
+    cli = FakeRedis()
+    calls = []
+
+    @with_redis_lock(cli, key=lambda i: f'order:{i}', ttl=0.06, blocking=False)
+    def pay(i):
+        calls.append((i, fencing_token.get()))
+        # renewed while held
+        time.sleep(0.1)
+        assert cli.get(f'zhtools:lock:order:{i}') is not None
+        return i
+
+    assert pay(1) == 1
+    assert calls == [(1, 1)]
+    assert cli.get('zhtools:lock:order:1') is None
+
+    with RedisLock(cli, 'order:2'):
+        with pytest.raises(LockNotAcquired):
+            pay(2)
+        lock = RedisLock(cli, 'order:2', timeout=0.05)
+        assert not lock.acquire()
+    assert pay(2) == 2
+    assert calls[-1] == (2, 2)
+
+    @with_redis_lock(cli, key=lambda: 'expired')
+    def expired():
+        # the lease expired and was taken over while held
+        cli.set('zhtools:lock:expired', 'other')
+
+    with pytest.raises(LockLost):
+        expired()
+
+
+@pytest.mark.asyncio
+async def test_async_redis_lock():
+    cli = FakeAsyncRedis()
+    running = peak = 0
+
+    @with_async_redis_lock(cli, ttl=0.06, timeout=1)
+    async def pay():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.03)
+        running -= 1
+        return fencing_token.get()
+
+    assert sorted(await asyncio.gather(pay(), pay(), pay())) == [1, 2, 3]
+    assert peak == 1
+    assert fencing_token.get() is None
+
+    lock = AsyncRedisLock(cli, 'order:1')
+    with pytest.raises(LockLost):
+        async with lock:
+            await cli.delete('zhtools:lock:order:1')
+    assert lock.lost
+
+
+def test_keyed_lock():
+    running: dict[int, int] = {}
+    peak: dict[int, int] = {}
+
+    @with_keyed_lock(key=lambda uid, i: uid)
+    def charge(uid, i):
+        running[uid] = running.get(uid, 0) + 1
+        peak[uid] = max(peak.get(uid, 0), running[uid])
+        time.sleep(0.005)
+        running[uid] -= 1
+
+    with ThreadConcurrent(max_workers=8) as c:
+        for i in range(24):
+            c.execute(charge, i % 3, i)
+    assert peak == {0: 1, 1: 1, 2: 1}
+    assert len(charge.locks) == 0
+
+
+@pytest.mark.asyncio
+async def test_async_keyed_lock():
+    order = []
+
+    @with_keyed_lock(key=lambda uid: uid)
+    async def charge(uid):
+        order.append(('start', uid))
+        await asyncio.sleep(0.01)
+        order.append(('end', uid))
+
+    await asyncio.gather(charge(1), charge(1), charge(2))
+    assert order[:3] == [('start', 1), ('start', 2), ('end', 1)]
+    assert len(charge.locks) == 0
@@ -1,9 +1,24 @@
+import asyncio
+import collections
+import copy
 import functools
-from collections.abc import Callable
+import inspect
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import weakref
+from collections.abc import AsyncIterator, Callable, Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from enum import StrEnum
-from typing import Any, Awaitable, ClassVar
-from urllib.parse import urljoin
+from typing import Any, Awaitable, ClassVar, NamedTuple
+from urllib.parse import urlencode, urljoin, urlsplit
 
+from zhtools.cache.keys import digest
+from zhtools.cache.storages import Empty, Storage
+from zhtools.concurrents import AsyncSingleFlight, CoroutineConcurrent, SingleFlight
 from zhtools.config import config
 from zhtools.exceptions import ModuleRequired
 
@@ -12,6 +27,33 @@ try:
 except ImportError:
     raise ModuleRequired("httpx")
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+if orjson is not None:
+    _loads = orjson.loads
+elif msgspec is not None:
+    _loads = msgspec.json.decode
+else:
+    _loads = json.loads
+
+CACHE_PREFIX = "zhtools:api:"
+
+_clients_lock = threading.Lock()
+# concurrent identical GETs of cached apis share one request
+_flight = SingleFlight()
+_async_flight = AsyncSingleFlight()
+# latencies of a host kept to compute the hedging delay
+_LATENCY_WINDOW = 200
+_HEDGE_MIN_SAMPLES = 20
+
 
 class NotSuccessResponse(Exception):
     def __init__(self, status_code: int, resp: httpx.Response):
@@ -31,36 +73,490 @@ class RequestMethod(StrEnum):
     PATCH = "patch"
 
 
-def API(
-    method: RequestMethod, path: str, *params: str, **default: Any
-) -> Callable[..., dict]:
-    def _api(self: "Service", *args: str, **kwargs: Any) -> dict:
-        data = {params[i]: arg for i, arg in enumerate(args)}
-        data.update(kwargs)
-        if set(data) != set(params):
-            raise RequestParamError()
+class StreamFormat(StrEnum):
+    # one JSON value per line
+    LINES = "lines"
+    # items of a top level JSON array
+    ARRAY = "array"
 
-        for k, v in default.items():
-            data.setdefault(k, v)
-        return self._request(path, data=data, method=method)
 
-    return _api
+class _JSONLines:
+    def __init__(self, decode: Callable[[bytes], Any]):
+        self.decode = decode
+        self.pending = b""
 
+    def feed(self, chunk: bytes, final: bool = False) -> list:
+        lines = (self.pending + chunk).split(b"\n")
+        self.pending = b"" if final else lines.pop()
+        return [self.decode(line) for line in lines if line.strip()]
 
-def AsyncAPI(
-    method: RequestMethod, path: str, *params: str, **default: Any
-) -> Callable[..., Awaitable[dict]]:
-    async def _api(self: "Service", *args: str, **kwargs: Any) -> dict:
-        data = {params[i]: arg for i, arg in enumerate(args)}
+
+_WHITESPACE = re.compile(rb"[ \t\n\r]*")
+# a string after its opening quote, up to the closing one or the chunk end
+_STRING_BODY = re.compile(rb'(?:[^"\\]|\\.)*', re.DOTALL)
+# what may come between strings and brackets in an array or object
+_BARE = re.compile(rb"[\w \t\n\r+\-.,:]*")
+# a number, true, false or null
+_SCALAR = re.compile(rb"[\w+\-.]*")
+# what comes next in a JSON array
+_START, _FIRST, _ITEM, _VALUE, _NEXT, _DONE = range(6)
+
+
+class _JSONArray:
+    """
+    items of a JSON array, each decoded once its last byte arrives.
+    Strings and brackets of the current item are tracked across chunks, so
+    every byte is scanned once and malformed input fails in its chunk.
+    """
+
+    def __init__(self, decode: Callable[[bytes], Any]):
+        self.decode = decode
+        self.state = _START
+        # bytes of the current item, its open brackets and strings
+        self.parts: list[bytes] = []
+        self.closers: list[bytes] = []
+        self.in_string = False
+        self.escaped = False
+
+    def feed(self, chunk: bytes, final: bool = False) -> list:
+        items = []
+        pos = start = 0
+        end = len(chunk)
+        while True:
+            if self.state == _VALUE:
+                stop = self._scan(chunk, pos, final)
+                if stop is None:
+                    self.parts.append(chunk[start:])
+                    break
+                self.parts.append(chunk[start:stop])
+                items.append(self.decode(b"".join(self.parts)))
+                self.parts = []
+                self.state = _NEXT
+                pos = stop
+                continue
+
+            pos = _WHITESPACE.match(chunk, pos).end()
+            if pos == end:
+                break
+            c = chunk[pos : pos + 1]
+            if self.state == _START:
+                if c != b"[":
+                    raise ValueError("response is not a JSON array.")
+                self.state = _FIRST
+                pos += 1
+            elif self.state == _DONE:
+                raise ValueError("extra data after the JSON array.")
+            elif self.state == _NEXT:
+                if c not in (b",", b"]"):
+                    raise ValueError(f"expecting ',' or ']' in the JSON array: {c!r}")
+                self.state = _ITEM if c == b"," else _DONE
+                pos += 1
+            elif self.state == _FIRST and c == b"]":
+                self.state = _DONE
+                pos += 1
+            else:
+                self.state = _VALUE
+                start = pos
+                self.closers = []
+                self.in_string = c == b'"'
+                self.escaped = False
+                if c == b"[" or c == b"{":
+                    self.closers.append(b"]" if c == b"[" else b"}")
+                if self.in_string or self.closers:
+                    pos += 1
+        if final and self.state != _DONE:
+            raise ValueError("truncated JSON array.")
+        return items
+
+    def _scan(self, chunk: bytes, pos: int, final: bool) -> int | None:
+        """end of the current item in chunk, None if it goes on in the next one."""
+        closers = self.closers
+        end = len(chunk)
+        if not closers and not self.in_string:
+            pos = _SCALAR.match(chunk, pos).end()
+            # a scalar reaching the end of the chunk may go on in the next one
+            return pos if pos < end or final else None
+
+        while pos < end:
+            if self.in_string:
+                if self.escaped:
+                    # the last chunk ended with a backslash
+                    self.escaped = False
+                    pos += 1
+                    continue
+                pos = _STRING_BODY.match(chunk, pos).end()
+                if pos == end:
+                    return None
+                if chunk[pos : pos + 1] == b"\\":
+                    self.escaped = True
+                    return None
+                self.in_string = False
+                pos += 1
+                if not closers:
+                    return pos
+                continue
+
+            pos = _BARE.match(chunk, pos).end()
+            if pos == end:
+                return None
+            c = chunk[pos : pos + 1]
+            pos += 1
+            if c == b'"':
+                self.in_string = True
+            elif c == b"[" or c == b"{":
+                closers.append(b"]" if c == b"[" else b"}")
+            elif c == closers[-1]:
+                closers.pop()
+                if not closers:
+                    return pos
+            else:
+                raise ValueError(f"unexpected {c!r} in the JSON array.")
+        return None
+
+
+# may be sent again without changing the outcome, RFC 9110 9.2.2
+IDEMPOTENT_METHODS = frozenset(
+    {RequestMethod.GET, RequestMethod.PUT, RequestMethod.DELETE}
+)
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, host: str):
+        self.host = host
+
+    def __str__(self) -> str:
+        return f"Circuit of [{self.host}] is open, the request is not sent."
+
+
+class CircuitState(StrEnum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing host.
+    `failures` failures in a row open the circuit and requests are refused.
+    After `reset_timeout` seconds one trial request is let through, its
+    success closes the circuit and its failure opens it again.
+    """
+
+    def __init__(self, host: str, failures: int = 5, reset_timeout: float = 30):
+        self.host = host
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.state = CircuitState.CLOSED
+        self._failed = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == CircuitState.CLOSED:
+                return True
+            # a trial that never reported back is replaced after reset_timeout too
+            now = time.monotonic()
+            if now - self._opened_at >= self.reset_timeout:
+                self.state = CircuitState.HALF_OPEN
+                self._opened_at = now
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = CircuitState.CLOSED
+            self._failed = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failed += 1
+            if self.state == CircuitState.HALF_OPEN or self._failed >= self.failures:
+                self.state = CircuitState.OPEN
+                self._opened_at = time.monotonic()
+
+
+class _Upstream:
+    """state of a host shared by the services calling it."""
+
+    def __init__(self, host: str):
+        self.host = host
+        # made by the first service enabling it, with its thresholds
+        self.breaker: CircuitBreaker | None = None
+        self.latencies: collections.deque[float] = collections.deque(
+            maxlen=_LATENCY_WINDOW
+        )
+
+    def latency(self, quantile: float) -> float | None:
+        if len(self.latencies) < _HEDGE_MIN_SAMPLES:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[int(quantile * (len(latencies) - 1))]
+
+
+_upstreams: dict[str, _Upstream] = {}
+
+
+class BatchError(Exception):
+    def __init__(self, errors: dict[int, Exception], total: int):
+        self.errors = errors
+        self.total = total
+
+    def __str__(self) -> str:
+        return f"{len(self.errors)} of {self.total} calls failed."
+
+
+class BatchResult(list):
+    """results of `Endpoint.batch` in call order, a failed call keeps its exception."""
+
+    @property
+    def errors(self) -> dict[int, Exception]:
+        return {i: r for i, r in enumerate(self) if isinstance(r, Exception)}
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    def raise_for_errors(self):
+        errors = self.errors
+        if errors:
+            raise BatchError(errors, len(self))
+
+
+class _CachedResponse(NamedTuple):
+    fresh_until: float
+    etag: str | None
+    last_modified: str | None
+    result: Any
+
+
+def _copy(value: Any) -> Any:
+    """deep copy of a decoded json value, faster than `copy.deepcopy` on it."""
+    cls = type(value)
+    if cls is dict:
+        return {k: _copy(v) for k, v in value.items()}
+    if cls is list:
+        return [_copy(v) for v in value]
+    if cls in (str, int, float, bool) or value is None:
+        return value
+    return copy.deepcopy(value)
+
+
+class Endpoint:
+    """an api of a `Service`, made by `API` and its aliases."""
+
+    def __init__(
+        self,
+        method: RequestMethod,
+        path: str,
+        params: tuple[str, ...],
+        default: dict[str, Any],
+        cache_ttl: float | None = None,
+        stream: StreamFormat | None = None,
+    ):
+        if cache_ttl is not None and method != RequestMethod.GET:
+            raise ValueError("only GET apis can be cached.")
+        if cache_ttl is not None and stream is not None:
+            raise ValueError("streamed apis can't be cached.")
+        self.method = method
+        self.path = path
+        self.params = params
+        self.default = default
+        self.cache_ttl = cache_ttl
+        self.stream = None if stream is None else StreamFormat(stream)
+
+    def __get__(self, instance: "Service | None", owner=None):
+        if instance is None:
+            return self
+        return BoundEndpoint(self, instance)
+
+    def build(self, args: tuple, kwargs: dict[str, Any]) -> dict:
+        data = {self.params[i]: arg for i, arg in enumerate(args)}
         data.update(kwargs)
-        if set(data) != set(params):
+        if set(data) != set(self.params):
             raise RequestParamError()
 
-        for k, v in default.items():
+        for k, v in self.default.items():
             data.setdefault(k, v)
-        return await self._async_request(path, data=data, method=method)
+        return data
+
+    @staticmethod
+    def _arguments(call: Any) -> tuple[tuple, dict[str, Any]]:
+        if isinstance(call, tuple):
+            return call, {}
+        if isinstance(call, dict):
+            return (), call
+        return (call,), {}
 
-    return _api
+    def __call__(
+        self, service: "Service", *args: Any, **kwargs: Any
+    ) -> dict | Iterator[Any]:
+        if self.stream is not None:
+            return service._stream(
+                self.path, self.method, self.build(args, kwargs), self.stream
+            )
+        return service._request(
+            self.path,
+            data=self.build(args, kwargs),
+            method=self.method,
+            cache_ttl=self.cache_ttl,
+        )
+
+    def _call(self, service: "Service", call: Any, timeout: float | None) -> dict:
+        args, kwargs = self._arguments(call)
+        return service._request(
+            self.path,
+            data=self.build(args, kwargs),
+            method=self.method,
+            timeout=timeout,
+            cache_ttl=self.cache_ttl,
+        )
+
+    def batch(
+        self,
+        service: "Service",
+        calls: Iterable[Any],
+        limit: int | None = None,
+        timeout: float | None = None,
+    ) -> BatchResult:
+        """
+        run calls in a thread pool of the batch, at most `limit` at once.
+        `timeout` is the httpx timeout of each call.
+        """
+        limit = limit or service.BATCH_LIMIT
+        results = BatchResult()
+        running: dict[Future, int] = {}
+        it = iter(calls)
+        with ThreadPoolExecutor(limit) as executor:
+            while True:
+                for call in itertools.islice(it, limit - len(running)):
+                    fut = executor.submit(self._call, service, call, timeout)
+                    running[fut] = len(results)
+                    results.append(None)
+                if not running:
+                    return results
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    results[running.pop(fut)] = fut.exception() or fut.result()
+
+
+class AsyncEndpoint(Endpoint):
+    def __get__(self, instance: "Service | None", owner=None):
+        # like an `async def` function, for `inspect.iscoroutinefunction`
+        return inspect.markcoroutinefunction(super().__get__(instance, owner))
+
+    async def __call__(self, service: "Service", *args: Any, **kwargs: Any) -> dict:
+        return await service._async_request(
+            self.path,
+            data=self.build(args, kwargs),
+            method=self.method,
+            cache_ttl=self.cache_ttl,
+        )
+
+    async def batch(
+        self,
+        service: "Service",
+        calls: Iterable[Any],
+        limit: int | None = None,
+        timeout: float | None = None,
+    ) -> BatchResult:
+        """
+        run calls concurrently, at most `limit` at once.
+        `timeout` bounds each call, a timed out one fails with TimeoutError.
+        """
+        c = CoroutineConcurrent(limit=limit or service.BATCH_LIMIT, timeout=timeout)
+        results = BatchResult()
+        cors = (self(service, *a, **kw) for a, kw in map(self._arguments, calls))
+        async for i, result in c.as_completed(cors):
+            if i >= len(results):
+                results.extend([None] * (i + 1 - len(results)))
+            results[i] = result
+        return results
+
+
+class AsyncStreamEndpoint(AsyncEndpoint):
+    """an async api returning an async iterator of the items it receives."""
+
+    __get__ = Endpoint.__get__
+
+    def __call__(  # type: ignore[override]
+        self, service: "Service", *args: Any, **kwargs: Any
+    ) -> AsyncIterator[Any]:
+        return service._async_stream(
+            self.path, self.method, self.build(args, kwargs), self.stream
+        )
+
+
+class BoundEndpoint:
+    """
+    an endpoint of a service instance, callable like a method.
+    `batch` takes one argument per call, a tuple of positional arguments,
+    a dict of keyword arguments or a single value:
+    >>> results = await service.get_user.batch([(1, 10), {'page': 2, 'size': 10}])
+    `map` zips its iterables into positional arguments:
+    >>> results = await service.get_user.map(range(100), itertools.repeat(10), limit=20)
+    >>> results.errors
+    {3: NotSuccessResponse(...)}
+    """
+
+    def __init__(self, endpoint: Endpoint, service: "Service"):
+        self.endpoint = endpoint
+        self.service = service
+
+    def __call__(self, *args: Any, **kwargs: Any):
+        return self.endpoint(self.service, *args, **kwargs)
+
+    def batch(
+        self,
+        calls: Iterable[Any],
+        limit: int | None = None,
+        timeout: float | None = None,
+    ):
+        if self.endpoint.stream is not None:
+            raise TypeError("streamed apis can't be batched.")
+        return self.endpoint.batch(self.service, calls, limit, timeout)
+
+    def map(
+        self,
+        *iterables: Iterable[Any],
+        limit: int | None = None,
+        timeout: float | None = None,
+    ):
+        return self.batch(zip(*iterables), limit, timeout)
+
+
+def API(
+    method: RequestMethod,
+    path: str,
+    *params: str,
+    cache_ttl: float | None = None,
+    stream: StreamFormat | None = None,
+    **default: Any,
+) -> Callable[..., dict]:
+    """
+    `cache_ttl` caches the results of a GET api in `config.storage` for that
+    many seconds, see `Service.CACHE_STALE_TTL`:
+    >>> countries = GetAPI('/api/v1/countries/', 'lang', cache_ttl=3600)
+    `stream` makes the api return an iterator of the items of a JSON lines or
+    JSON array response, decoded as it is received:
+    >>> export = GetAPI('/api/v1/orders/export/', 'day', stream=StreamFormat.LINES)
+    >>> for order in service.export('2024-01-01'):
+    """
+    return Endpoint(method, path, params, default, cache_ttl, stream)
+
+
+def AsyncAPI(
+    method: RequestMethod,
+    path: str,
+    *params: str,
+    cache_ttl: float | None = None,
+    stream: StreamFormat | None = None,
+    **default: Any,
+) -> Callable[..., Awaitable[dict]]:
+    """streamed async apis return an async iterator, see `API`."""
+    if stream is not None:
+        return AsyncStreamEndpoint(method, path, params, default, cache_ttl, stream)
+    return AsyncEndpoint(method, path, params, default, cache_ttl, stream)
 
 
 PostAPI = functools.partial(API, RequestMethod.POST)
@@ -93,10 +589,114 @@ class Service:
     async api:
     >>> async def get_users(page: int, size: int):
     >>>    return await service.get_user(page, size)
+    run many calls of an api concurrently, see `BoundEndpoint`:
+    >>> results = await service.get_user.map(range(1, 100), itertools.repeat(10))
+    retry idempotent requests, stop calling a failing host and hedge slow
+    async requests:
+    >>> class MyApiService(Service):
+    >>>     RETRIES = 2
+    >>>     CIRCUIT_FAILURES = 5
+    >>>     HEDGE_QUANTILE = 0.95
+    A service keeps its connections open between calls, close it when done:
+    >>> with MyApiService() as service:
+    >>>     service.login('admin', 'pwd')
+    >>> async with MyApiService() as service:
+    >>>     await service.get_user(1, 10)
     """
 
     HOST: ClassVar[str]
     TIMEOUT: ClassVar[int] = 5
+    # connection pool of each client, see `httpx.Limits`
+    MAX_CONNECTIONS: ClassVar[int | None] = 100
+    MAX_KEEPALIVE_CONNECTIONS: ClassVar[int | None] = 20
+    KEEPALIVE_EXPIRY: ClassVar[float | None] = 5
+    # requires `h2`, pip install zhtools[http2]
+    HTTP2: ClassVar[bool] = False
+    # calls running at once in `batch` / `map` of endpoints
+    BATCH_LIMIT: ClassVar[int] = 10
+    # retries of idempotent requests failing with a transport error or a
+    # status in RETRY_STATUSES, after a random delay up to
+    # RETRY_BACKOFF * 2 ** attempt capped by RETRY_BACKOFF_MAX
+    RETRIES: ClassVar[int] = 0
+    RETRY_BACKOFF: ClassVar[float] = 0.1
+    RETRY_BACKOFF_MAX: ClassVar[float] = 2
+    RETRY_STATUSES: ClassVar[frozenset[int]] = frozenset({429, 502, 503, 504})
+    # failures in a row opening the circuit of the host, None to disable,
+    # see `CircuitBreaker`
+    CIRCUIT_FAILURES: ClassVar[int | None] = None
+    CIRCUIT_RESET_TIMEOUT: ClassVar[float] = 30
+    # async idempotent requests slower than this quantile of the recent
+    # latencies of the host are sent a second time, the first response wins
+    HEDGE_QUANTILE: ClassVar[float | None] = None
+    # expired results of cached apis with an ETag or Last-Modified are kept
+    # this long, then revalidated by a conditional request
+    CACHE_STALE_TTL: ClassVar[float] = 3600
+
+    _client: httpx.Client | None = None
+    _async_client: httpx.AsyncClient | None = None
+    _async_loop: weakref.ref[asyncio.AbstractEventLoop] | None = None
+
+    def client_kwargs(self) -> dict[str, Any]:
+        """
+        arguments of both clients, override to add auth, proxies or a transport:
+        >>> def client_kwargs(self):
+        >>>     return super().client_kwargs() | {"transport": httpx.MockTransport(handler)}
+        """
+        if self.HTTP2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                raise ModuleRequired("h2")
+        return {
+            "timeout": self.TIMEOUT,
+            "limits": httpx.Limits(
+                max_connections=self.MAX_CONNECTIONS,
+                max_keepalive_connections=self.MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=self.KEEPALIVE_EXPIRY,
+            ),
+            "http2": self.HTTP2,
+        }
+
+    @property
+    def client(self) -> httpx.Client:
+        if self._client is None:
+            with _clients_lock:
+                if self._client is None:
+                    self._client = httpx.Client(**self.client_kwargs())
+        return self._client
+
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        """client of the running loop, its connections can't be used by another loop."""
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_loop() is not loop:
+            self._async_client = httpx.AsyncClient(**self.client_kwargs())
+            self._async_loop = weakref.ref(loop)
+        return self._async_client
+
+    def close(self):
+        client, self._client = self._client, None
+        if client is not None:
+            client.close()
+
+    async def aclose(self):
+        """close both clients, the async one is dropped if opened by another loop."""
+        self.close()
+        client, self._async_client = self._async_client, None
+        if client is not None and self._async_loop() is asyncio.get_running_loop():
+            await client.aclose()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
 
     def prepare_request(
         self, data: dict | None, method: RequestMethod
@@ -109,25 +709,16 @@ class Service:
         method: RequestMethod = RequestMethod.POST,
         data: dict | None = None,
         form_data: dict | None = None,
+        timeout: float | None = None,
+        cache_ttl: float | None = None,
     ) -> dict:
-        data, headers = self.prepare_request(data, method)
-        url = urljoin(self.HOST, path)
-        params = json_data = None
-        if method == RequestMethod.GET:
-            params = data
-        else:
-            json_data = data
-
-        config.log_info(f"http request: {url}, data: {data}")
-        resp = httpx.request(
-            method,
-            url,
-            params=params,
-            json=json_data,
-            data=form_data,
-            timeout=self.TIMEOUT,
-            headers=headers or None,
-        )
+        url, kwargs = self._request_args(path, method, data, form_data)
+        kwargs["timeout"] = httpx.USE_CLIENT_DEFAULT if timeout is None else timeout
+        if cache_ttl is not None:
+            storage = self._cache_storage(sync=True)
+            if storage is not None:
+                return self._cached_get(storage, cache_ttl, url, **kwargs)
+        resp = self._send(method, url, **kwargs)
         return self.handle_result(resp)
 
     async def _async_request(
@@ -136,27 +727,325 @@ class Service:
         method: RequestMethod = RequestMethod.POST,
         data: dict | None = None,
         form_data: dict | None = None,
+        cache_ttl: float | None = None,
     ) -> dict:
+        url, kwargs = self._request_args(path, method, data, form_data)
+        if cache_ttl is not None:
+            return await self._async_cached_get(cache_ttl, url, **kwargs)
+        resp = await self._async_send(method, url, **kwargs)
+        return self.handle_result(resp)
+
+    def _request_args(
+        self,
+        path: str,
+        method: RequestMethod,
+        data: dict | None,
+        form_data: dict | None,
+    ) -> tuple[str, dict[str, Any]]:
+        """url and arguments of the client request."""
         data, headers = self.prepare_request(data, method)
         url = urljoin(self.HOST, path)
-        params = json_data = None
+        config.log_info(f"http request: {url}, data: {data}")
+        kwargs = {"data": form_data, "headers": headers or None}
         if method == RequestMethod.GET:
-            params = data
+            kwargs["params"] = data
         else:
-            json_data = data
-        async with httpx.AsyncClient() as cli:
-            resp = await cli.request(
-                method,
+            kwargs["json"] = data
+        return url, kwargs
+
+    def _parser(self, fmt: StreamFormat) -> _JSONLines | _JSONArray:
+        if fmt == StreamFormat.LINES:
+            return _JSONLines(self.decode)
+        return _JSONArray(self.decode)
+
+    def _stream(
+        self,
+        path: str,
+        method: RequestMethod,
+        data: dict | None,
+        fmt: StreamFormat,
+        form_data: dict | None = None,
+    ) -> Iterator[Any]:
+        """
+        items of the response as they are received. Streams are not retried
+        or hedged, a consumed part can't be taken back.
+        """
+        url, kwargs = self._request_args(path, method, data, form_data)
+        parser = self._parser(fmt)
+        with self.client.stream(method, url, **kwargs) as resp:
+            if resp.status_code != 200:
+                resp.read()
+                raise NotSuccessResponse(resp.status_code, resp)
+            for chunk in resp.iter_bytes():
+                yield from parser.feed(chunk)
+        yield from parser.feed(b"", final=True)
+
+    async def _async_stream(
+        self,
+        path: str,
+        method: RequestMethod,
+        data: dict | None,
+        fmt: StreamFormat,
+        form_data: dict | None = None,
+    ) -> AsyncIterator[Any]:
+        url, kwargs = self._request_args(path, method, data, form_data)
+        parser = self._parser(fmt)
+        async with self.async_client.stream(method, url, **kwargs) as resp:
+            if resp.status_code != 200:
+                await resp.aread()
+                raise NotSuccessResponse(resp.status_code, resp)
+            async for chunk in resp.aiter_bytes():
+                for item in parser.feed(chunk):
+                    yield item
+        for item in parser.feed(b"", final=True):
+            yield item
+
+    @staticmethod
+    def _cache_storage(sync: bool) -> Storage | None:
+        """
+        `config.storage`, or its `nowait` storage if it has one.
+        None if it can only be awaited and the caller is sync.
+        """
+        storage = config.storage
+        if not inspect.iscoroutinefunction(storage.get):
+            return storage
+        nowait = getattr(storage, "nowait", None)
+        if nowait is not None or sync:
+            return nowait
+        return storage
+
+    @staticmethod
+    def _cache_key(url: str, params: dict | None, headers: dict | None) -> str:
+        """url with sorted params, headers added by `prepare_request` count too."""
+        query = urlencode(sorted(httpx.QueryParams(params).multi_items()))
+        vary = urlencode(sorted((headers or {}).items()))
+        return CACHE_PREFIX + digest(f"{url}?{query}#{vary}".encode())
+
+    @staticmethod
+    def _conditional(
+        headers: dict | None, entry: _CachedResponse | None
+    ) -> dict | None:
+        if entry is None:
+            return headers
+        headers = dict(headers or {})
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    def _refreshed(
+        self, resp: httpx.Response, entry: _CachedResponse | None, ttl: float
+    ) -> tuple[_CachedResponse, float]:
+        """the new entry and how long to store it."""
+        if resp.status_code == 304 and entry is not None:
+            result = entry.result
+            etag = resp.headers.get("etag", entry.etag)
+            last_modified = resp.headers.get("last-modified", entry.last_modified)
+        else:
+            result = self.handle_result(resp)
+            etag = resp.headers.get("etag")
+            last_modified = resp.headers.get("last-modified")
+        expire = ttl + self.CACHE_STALE_TTL if etag or last_modified else ttl
+        return _CachedResponse(time.time() + ttl, etag, last_modified, result), expire
+
+    @staticmethod
+    def _fresh(raw: Any) -> tuple[_CachedResponse | None, bool]:
+        """the stored entry and whether it can be used without a request."""
+        if raw is Empty:
+            return None, False
+        entry = _CachedResponse(*raw)
+        return entry, entry.fresh_until > time.time()
+
+    def _cached_get(
+        self,
+        storage: Storage,
+        ttl: float,
+        url: str,
+        params: dict | None,
+        headers: dict | None,
+        **kwargs,
+    ) -> dict:
+        # callers get their own copy, the stored result is shared
+        key = self._cache_key(url, params, headers)
+        entry, fresh = self._fresh(storage.get(key))
+        if fresh:
+            return _copy(entry.result)
+
+        def revalidate() -> dict:
+            resp = self._send(
+                RequestMethod.GET,
                 url,
                 params=params,
-                json=json_data,
-                data=form_data,
-                timeout=self.TIMEOUT,
-                headers=headers or None,
+                headers=self._conditional(headers, entry),
+                **kwargs,
             )
-            return self.handle_result(resp)
+            refreshed, expire = self._refreshed(resp, entry, ttl)
+            storage.setex(key, tuple(refreshed), expire)
+            return refreshed.result
+
+        return _copy(_flight.do(key, revalidate))
+
+    async def _async_cached_get(
+        self,
+        ttl: float,
+        url: str,
+        params: dict | None,
+        headers: dict | None,
+        **kwargs,
+    ) -> dict:
+        storage = self._cache_storage(sync=False)
+        is_async = inspect.iscoroutinefunction(storage.get)
+        key = self._cache_key(url, params, headers)
+        raw = await storage.get(key) if is_async else storage.get(key)
+        entry, fresh = self._fresh(raw)
+        if fresh:
+            return _copy(entry.result)
+
+        async def revalidate() -> dict:
+            resp = await self._async_send(
+                RequestMethod.GET,
+                url,
+                params=params,
+                headers=self._conditional(headers, entry),
+                **kwargs,
+            )
+            refreshed, expire = self._refreshed(resp, entry, ttl)
+            if is_async:
+                await storage.setex(key, tuple(refreshed), expire)
+            else:
+                storage.setex(key, tuple(refreshed), expire)
+            return refreshed.result
+
+        # futures of a flight belong to one loop
+        loop = asyncio.get_running_loop()
+        return _copy(await _async_flight.do((key, id(loop)), revalidate))
+
+    def _upstream(self, url: str) -> _Upstream:
+        host = urlsplit(url).netloc
+        upstream = _upstreams.get(host)
+        if upstream is None:
+            upstream = _upstreams.setdefault(host, _Upstream(host))
+        if self.CIRCUIT_FAILURES is not None and upstream.breaker is None:
+            with _clients_lock:
+                if upstream.breaker is None:
+                    upstream.breaker = CircuitBreaker(
+                        host, self.CIRCUIT_FAILURES, self.CIRCUIT_RESET_TIMEOUT
+                    )
+        return upstream
+
+    def _attempts(self, method: RequestMethod) -> int:
+        return 1 + self.RETRIES if method in IDEMPOTENT_METHODS else 1
+
+    def _backoff(self, attempt: int) -> float:
+        """full jitter, retries of many clients don't arrive together."""
+        return random.uniform(
+            0, min(self.RETRY_BACKOFF_MAX, self.RETRY_BACKOFF * 2**attempt)
+        )
+
+    def _allowed(self, upstream: _Upstream) -> bool:
+        return self.CIRCUIT_FAILURES is None or upstream.breaker.allow()
+
+    def _record(
+        self, upstream: _Upstream, resp: httpx.Response | None, started: float
+    ) -> bool:
+        """record an attempt, None is a transport error. True to retry it."""
+        if resp is None:
+            failed = retry = True
+        else:
+            retry = resp.status_code in self.RETRY_STATUSES
+            failed = retry or resp.status_code >= 500
+        if not failed:
+            upstream.latencies.append(time.monotonic() - started)
+        if self.CIRCUIT_FAILURES is not None:
+            if failed:
+                upstream.breaker.record_failure()
+            else:
+                upstream.breaker.record_success()
+        return retry
+
+    def _send(self, method: RequestMethod, url: str, **kwargs) -> httpx.Response:
+        upstream = self._upstream(url)
+        resp = error = None
+        for attempt in range(self._attempts(method)):
+            if attempt:
+                config.log_info(f"http retry {attempt}: {url}")
+                time.sleep(self._backoff(attempt - 1))
+            # an open circuit stops retries too
+            if not self._allowed(upstream):
+                break
+            started = time.monotonic()
+            try:
+                resp, error = self.client.request(method, url, **kwargs), None
+            except httpx.TransportError as e:
+                resp, error = None, e
+            if not self._record(upstream, resp, started):
+                break
+        if error is not None:
+            raise error
+        if resp is None:
+            raise CircuitOpenError(upstream.host)
+        return resp
+
+    async def _async_send(
+        self, method: RequestMethod, url: str, **kwargs
+    ) -> httpx.Response:
+        upstream = self._upstream(url)
+        hedge = None
+        if self.HEDGE_QUANTILE is not None and method in IDEMPOTENT_METHODS:
+            hedge = upstream.latency(self.HEDGE_QUANTILE)
+        resp = error = None
+        for attempt in range(self._attempts(method)):
+            if attempt:
+                config.log_info(f"http retry {attempt}: {url}")
+                await asyncio.sleep(self._backoff(attempt - 1))
+            if not self._allowed(upstream):
+                break
+            started = time.monotonic()
+            try:
+                resp, error = await self._hedged(hedge, method, url, **kwargs), None
+            except httpx.TransportError as e:
+                resp, error = None, e
+            if not self._record(upstream, resp, started):
+                break
+        if error is not None:
+            raise error
+        if resp is None:
+            raise CircuitOpenError(upstream.host)
+        return resp
+
+    async def _hedged(
+        self, delay: float | None, method: RequestMethod, url: str, **kwargs
+    ) -> httpx.Response:
+        """send again if no response after `delay`, the first success wins."""
+        client = self.async_client
+        if delay is None:
+            return await client.request(method, url, **kwargs)
+
+        tasks = {asyncio.create_task(client.request(method, url, **kwargs))}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                config.log_info(f"http hedge after {delay:.3f}s: {url}")
+                tasks.add(asyncio.create_task(client.request(method, url, **kwargs)))
+            while True:
+                done, tasks = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                if not tasks:
+                    return done.pop().result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def decode(self, content: bytes) -> Any:
+        """decode a JSON body, with orjson or msgspec when installed."""
+        return _loads(content)
 
     def handle_result(self, resp: httpx.Response) -> dict:
         if resp.status_code != 200:
             raise NotSuccessResponse(resp.status_code, resp)
-        return resp.json()
+        return self.decode(resp.content)
@@ -1,3 +1,11 @@
 from .decorators import cache, cond_lru_cache
-from .storages import (AsyncRedisStorage, AsyncStorage, Empty, MemoryStorage,
-                       RedisStorage, Storage)
+from .keys import KeyBuilder
+from .metrics import reset_stats, stats
+from .serializers import (Codec, Compression, MsgpackSerializer,
+                          OrjsonSerializer, PickleSerializer, Serializer)
+from .storages import (AsyncMemoryStorage, AsyncRedisStorage, AsyncStorage,
+                       AsyncTieredStorage, BoundedMemoryStorage, Empty,
+                       EvictionPolicy, InvalidationChannel, LocalChannel,
+                       MemoryStorage, RedisChannel, RedisStorage, Storage,
+                       TieredStorage)
+from .writers import AsyncWriter, OverflowPolicy
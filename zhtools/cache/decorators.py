@@ -1,15 +1,45 @@
 import asyncio
 import functools
 import inspect
-from collections.abc import Callable
-from typing import Any, Protocol, Self, overload
+import math
+import random
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from collections.abc import Callable, Hashable, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, NamedTuple, Protocol, Self, overload
 
 import wrapt
 
+from zhtools.concurrents import AsyncSingleFlight, SingleFlight
 from zhtools.config import config
-from zhtools.typing import CommonWrapped, CommonWrapper
+from zhtools.typed import CommonWrapped, CommonWrapper
 
-from .storages import Empty
+from .keys import KeyBuilder, instance_key
+from .metrics import metrics
+from .storages import Empty, Storage
+
+_KWARGS_MARK = object()
+# version of each tag, folded into the keys of functions having the tag
+TAG_PREFIX = "zhtools:tag:"
+
+
+# storage class -> whether it returns values rather than coroutines
+_sync_storage_types: dict[type, bool] = {}
+
+
+def _nowait(storage: Storage) -> Storage | None:
+    """the storage to call without awaiting, None if it has to be awaited."""
+    cls = type(storage)
+    is_sync = _sync_storage_types.get(cls)
+    if is_sync is None:
+        is_sync = _sync_storage_types[cls] = not inspect.iscoroutinefunction(cls.get)
+    if is_sync:
+        return storage
+    return getattr(storage, "nowait", None)
 
 
 def _is_async(func: Callable):
@@ -24,6 +54,193 @@ def get_func_name(func: Callable) -> str:
     return func.__class__.__name__
 
 
+def _scope(func: Callable) -> Callable:
+    """bound methods are counted on their function."""
+    return getattr(func, "__func__", func)
+
+
+# the only key of a stored `CacheEntry`
+_ENTRY_KEY = "__zhtools_cache_entry__"
+
+
+class CacheEntry(NamedTuple):
+    """a cached value with the metadata needed to refresh it ahead of expiry."""
+
+    value: Any
+    expire_at: float
+    # seconds the wrapped function took to compute the value
+    delta: float
+
+    def dump(self) -> dict:
+        """stored as a dict, msgpack and orjson would load a tuple as a list."""
+        return {_ENTRY_KEY: list(self)}
+
+    @classmethod
+    def load(cls, data: Any) -> "CacheEntry | None":
+        """the entry stored in data, None for plain values."""
+        if isinstance(data, CacheEntry):
+            # pickled by older versions
+            return data
+        if type(data) is dict and len(data) == 1 and _ENTRY_KEY in data:
+            return cls(*data[_ENTRY_KEY])
+        return None
+
+
+_refresh_executor: ThreadPoolExecutor | None = None
+
+
+def _get_refresh_executor() -> ThreadPoolExecutor:
+    global _refresh_executor
+    if _refresh_executor is None:
+        _refresh_executor = ThreadPoolExecutor(
+            max_workers=4, thread_name_prefix="zhtools-cache-refresh"
+        )
+    return _refresh_executor
+
+
+class batch_cache[K, V]:
+    """
+    cache a function that takes a list of ids and returns a dict of id -> value,
+    cached ids are read in one `get_many`, the missing ones are passed to the
+    function in one call. Ids absent from the returned dict are not cached.
+    >>> @cache.batch(expire=60)
+    >>> def get_users(ids: list[int]) -> dict[int, User]:
+    ...
+    `key` is called with a single id in place of the list:
+    >>> @cache.batch(key=lambda func, uid: f'user:{uid}')
+    >>> async def get_users(ids: list[int]) -> dict[int, User]:
+    ...
+    """
+
+    def __new__(
+        cls,
+        func: Callable | None = None,
+        *,
+        key: Callable[..., str] | None = None,
+        expire: int | None = None,
+    ):
+        obj = super().__new__(cls)
+        cls.__init__(obj, key=key, expire=expire)
+        if func is not None and (callable(func) or isinstance(func, classmethod)):
+            return obj.__call__(func)
+
+        return obj
+
+    def __init__(
+        self,
+        *,
+        key: Callable[..., str] | None = None,
+        expire: int | None = None,
+    ):
+        self.key = key
+        self.expire: float = expire or config.default_expire or float("inf")
+        self._key_builders: dict[Callable, KeyBuilder] = {}
+        self._params: dict[Callable, tuple[str, ...]] = {}
+
+    def get_keys(
+        self, func: Callable, instance: Any, ids: list[K], args, kwargs
+    ) -> list[str]:
+        if self.key is None:
+            make_key = self._key_builders[getattr(func, "__func__", func)]
+            if instance is not None and not inspect.isclass(instance):
+                instance = instance_key(instance)
+        else:
+            make_key = functools.partial(self.key, func)
+        if instance is not None and not inspect.isclass(instance):
+            return [make_key(instance, i, *args, **kwargs) for i in ids]
+        return [make_key(i, *args, **kwargs) for i in ids]
+
+    def _bind_ids(
+        self, func: Callable, instance: Any, args, kwargs
+    ) -> tuple[list[K], tuple, dict]:
+        """the ids, passed by position or by name, and the other arguments."""
+        if args:
+            return list(dict.fromkeys(args[0])), args[1:], kwargs
+
+        params = self._params[getattr(func, "__func__", func)]
+        # methods and classmethods are registered with self / cls
+        name = params[0 if instance is None else 1]
+        if name not in kwargs:
+            raise TypeError(f"{func.__name__}() missing argument: '{name}'")
+        kwargs = dict(kwargs)
+        return list(dict.fromkeys(kwargs.pop(name))), (), kwargs
+
+    @staticmethod
+    def _split(ids: list[K], cached: list) -> tuple[dict[K, V], list[K]]:
+        result: dict[K, V] = {}
+        missing: list[K] = []
+        for i, val in zip(ids, cached):
+            if val is Empty:
+                missing.append(i)
+            else:
+                result[i] = val
+        return result, missing
+
+    @staticmethod
+    def _count(func: Callable, hits: int, misses: int):
+        if config.cache_stats:
+            metrics.incr(_scope(func), "hits", hits)
+            metrics.incr(_scope(func), "misses", misses)
+
+    @staticmethod
+    def _merge(ids: list[K], result: dict[K, V]) -> dict[K, V]:
+        return {i: result[i] for i in ids if i in result}
+
+    @wrapt.decorator
+    def wrapper(self, func: Callable, instance: Any, args, kwargs) -> dict[K, V]:
+        ids, rest, kwargs = self._bind_ids(func, instance, args, kwargs)
+        keys = self.get_keys(func, instance, ids, rest, kwargs)
+        result, missing = self._split(ids, config.storage.get_many(keys))
+        self._count(func, len(result), len(missing))
+        if missing:
+            fetched = func(missing, *rest, **kwargs)
+            key_map = dict(zip(ids, keys))
+            config.storage.set_many(
+                {key_map[i]: v for i, v in fetched.items() if i in key_map},
+                self.expire,
+            )
+            result.update(fetched)
+        return self._merge(ids, result)
+
+    @wrapt.decorator
+    async def async_wrapper(
+        self, func: Callable, instance: Any, args, kwargs
+    ) -> dict[K, V]:
+        ids, rest, kwargs = self._bind_ids(func, instance, args, kwargs)
+        keys = self.get_keys(func, instance, ids, rest, kwargs)
+        storage = config.storage
+        nowait = _nowait(storage)
+        if nowait is not None:
+            cached = nowait.get_many(keys)
+        else:
+            cached = await storage.get_many(keys)
+        result, missing = self._split(ids, cached)
+        self._count(func, len(result), len(missing))
+        if missing:
+            fetched = await func(missing, *rest, **kwargs)
+            key_map = dict(zip(ids, keys))
+            mapping = {key_map[i]: v for i, v in fetched.items() if i in key_map}
+            if nowait is not None:
+                nowait.set_many(mapping, self.expire)
+            else:
+                await storage.set_many(mapping, self.expire)
+            result.update(fetched)
+        return self._merge(ids, result)
+
+    def __call__(self, func: Callable) -> Callable:
+        target = func.__func__ if isinstance(func, classmethod) else func
+        self._params[target] = tuple(inspect.signature(target).parameters)
+        if self.key is None:
+            if isinstance(func, classmethod):
+                self._key_builders[target] = KeyBuilder(target, skip_first=True)
+            else:
+                self._key_builders[target] = KeyBuilder(target)
+
+        if _is_async(func):
+            return self.async_wrapper(func)  # type: ignore
+        return self.wrapper(func)  # type: ignore
+
+
 class cache[T, **P]:
     """
     >>> from zhtools.cache.storages import RedisStorage
@@ -31,11 +248,37 @@ class cache[T, **P]:
     >>> @cache
     >>> def foo(a: int, b: int) -> int:
     ...
-    >>> @cache(key=lambda a, b: f'{a}:{b}')
+    keys are built by `KeyBuilder` from the function signature by default,
+    instances of methods are named by `__cache_key__()` if defined, else
+    their class and id():
+    >>> @cache(key=lambda func, a, b: f'{a}:{b}')
     >>> def foo1(a: int, b: int) -> int:
     ...
+    concurrent misses of the same key share one call with `coalesce=True`:
+    >>> @cache(coalesce=True)
+    >>> def foo2(a: int) -> int:
+    ...
+    serve the old value for up to `stale_ttl` seconds after `expire` while it is
+    refreshed in background, `early_refresh` (XFetch beta, 1 is a good default)
+    starts refreshing hot keys probabilistically before they expire:
+    >>> @cache(expire=60, stale_ttl=10, early_refresh=1)
+    >>> def foo3(a: int) -> int:
+    ...
+    functions taking a list of ids, see `batch_cache`:
+    >>> @cache.batch
+    >>> def get_users(ids: list[int]) -> dict[int, User]:
+    ...
+    drop every entry of a tag at once, keys carry the tag versions so this is
+    a single write however many entries the tag has:
+    >>> @cache(tags=["users"])
+    >>> def get_user(uid: int) -> User:
+    ...
+    >>> cache.invalidate("users")
+    >>> await cache.ainvalidate("users")  # for async storages
     """
 
+    batch = batch_cache
+
     class MakeCacheKeyFunc(Protocol):
         def __call__(
             self, func: Callable[P, T], *args: P.args, **kwargs: P.kwargs
@@ -43,6 +286,7 @@ class cache[T, **P]:
 
     @staticmethod
     def default_make_cache_key(func: Callable[P, T], *args, **kwargs):
+        """the repr based key of old versions, `key=cache.default_make_cache_key` to keep it."""
         return f"{get_func_name(func)}:{(args, kwargs)}"
 
     @overload
@@ -53,19 +297,35 @@ class cache[T, **P]:
         cls,
         func: Callable[P, T],
         *,
-        key: MakeCacheKeyFunc = default_make_cache_key,
+        key: MakeCacheKeyFunc | None = None,
         expire: int | None = None,
+        coalesce: bool = False,
+        stale_ttl: int = 0,
+        early_refresh: float = 0,
+        tags: Iterable[str] = (),
     ) -> Callable[P, T]: ...
 
     def __new__(
         cls,
         func: Callable[P, T] | None = None,
         *,
-        key: MakeCacheKeyFunc = default_make_cache_key,
+        key: MakeCacheKeyFunc | None = None,
         expire: int | None = None,
+        coalesce: bool = False,
+        stale_ttl: int = 0,
+        early_refresh: float = 0,
+        tags: Iterable[str] = (),
     ) -> Callable[P, T] | Self:
         obj: Self = super().__new__(cls)
-        cls.__init__(obj, key=key)
+        cls.__init__(
+            obj,
+            key=key,
+            expire=expire,
+            coalesce=coalesce,
+            stale_ttl=stale_ttl,
+            early_refresh=early_refresh,
+            tags=tags,
+        )
         if func is not None and (callable(func) or isinstance(func, classmethod)):
             return obj.__call__(func)
 
@@ -74,18 +334,201 @@ class cache[T, **P]:
     def __init__(
         self,
         *,
-        key: MakeCacheKeyFunc = default_make_cache_key,
+        key: MakeCacheKeyFunc | None = None,
         expire: int | None = None,
+        coalesce: bool = False,
+        stale_ttl: int = 0,
+        early_refresh: float = 0,
+        tags: Iterable[str] = (),
     ):
         self.key = key
-        self.expire: int = expire or config.default_expire or 0
+        self.expire: float = expire or config.default_expire or float("inf")
+        self.coalesce = coalesce
+        self.stale_ttl = stale_ttl
+        self.early_refresh = float(early_refresh)
+        # entries are wrapped in `CacheEntry` only when they may be refreshed
+        self.refreshable = self.expire != float("inf") and bool(
+            stale_ttl or early_refresh
+        )
+        self._flight: SingleFlight[T] = SingleFlight()
+        self._async_flight: AsyncSingleFlight[T] = AsyncSingleFlight()
+        self._refreshing: set[str] = set()
+        self._refresh_lock = threading.Lock()
+        self._refresh_tasks: set[asyncio.Task] = set()
+        self._key_builders: dict[Callable, KeyBuilder] = {}
+        self.tags = tuple(tags)
+        self._tag_keys = [f"{TAG_PREFIX}{tag}" for tag in self.tags]
+
+    @staticmethod
+    def _tag_versions(tags: Iterable[str]) -> dict[str, str]:
+        """new versions of tags, keyed by their storage key."""
+        return {f"{TAG_PREFIX}{tag}": uuid.uuid4().hex[:12] for tag in tags}
+
+    @staticmethod
+    def invalidate(*tags: str):
+        """drop the entries of functions having any of tags."""
+        config.storage.set_many(cache._tag_versions(tags), float("inf"))
+
+    @staticmethod
+    async def ainvalidate(*tags: str):
+        storage = config.storage
+        nowait = _nowait(storage)
+        versions = cache._tag_versions(tags)
+        if nowait is not None:
+            nowait.set_many(versions, float("inf"))
+        else:
+            await storage.set_many(versions, float("inf"))
+
+    def _fold_versions(self, key: str, versions: list) -> tuple[str, dict]:
+        """key with the tag versions, and the versions to create."""
+        created = {}
+        for i, version in enumerate(versions):
+            if version is Empty:
+                # a missing version is new rather than a default, so entries
+                # written before it was evicted are not served again
+                tag_key, versions[i] = self._tag_versions([self.tags[i]]).popitem()
+                created[tag_key] = versions[i]
+        return f"{key}@{','.join(versions)}", created
+
+    def _tagged(self, storage: Storage, key: str) -> str:
+        key, created = self._fold_versions(key, storage.get_many(self._tag_keys))
+        if created:
+            storage.set_many(created, float("inf"))
+        return key
+
+    async def _async_tagged(self, storage: Storage, key: str) -> str:
+        key, created = self._fold_versions(key, await storage.get_many(self._tag_keys))
+        if created:
+            await storage.set_many(created, float("inf"))
+        return key
 
     def get_key(self, func: Callable[P, T], instance: Any, args, kwargs) -> str:
+        if self.key is None:
+            # bound methods share their underlying function's builder
+            make_key = self._key_builders[getattr(func, "__func__", func)]
+            if instance is not None and not inspect.isclass(instance):
+                return make_key(instance_key(instance), *args, **kwargs)
+            return make_key(*args, **kwargs)
+
         if instance is not None and not inspect.isclass(instance):
             return self.key(func, instance, *args, **kwargs)
         else:
             return self.key(func, *args, **kwargs)
 
+    def should_refresh(self, entry: CacheEntry) -> bool:
+        now = time.time()
+        if now >= entry.expire_at:
+            return True
+        if not self.early_refresh:
+            return False
+        # XFetch: refresh earlier for slow functions, the closer to expire_at the likelier
+        gap = -entry.delta * self.early_refresh * math.log(1.0 - random.random())
+        return now + gap >= entry.expire_at
+
+    def _unwrap(self, cache_result: Any) -> tuple[Any, bool]:
+        """return the cached value and whether it should be refreshed."""
+        entry = CacheEntry.load(cache_result) if self.refreshable else None
+        if entry is not None:
+            return entry.value, self.should_refresh(entry)
+        return cache_result, False
+
+    def _make_entry(self, result: T, started: float) -> tuple[Any, float]:
+        """return the value to store and its expire."""
+        if not self.refreshable:
+            return result, self.expire
+        now = time.time()
+        entry = CacheEntry(result, now + self.expire, now - started)
+        return entry.dump(), self.expire + self.stale_ttl
+
+    def _get(self, storage: Storage, func: Callable, key: str) -> Any:
+        if not config.cache_stats:
+            return storage.get(key)
+
+        started = time.perf_counter()
+        try:
+            val = storage.get(key)
+        except Exception:
+            metrics.incr(type(storage), "errors")
+            raise
+        metrics.storage_op(
+            type(storage),
+            "get",
+            _scope(func),
+            "misses" if val is Empty else "hits",
+            time.perf_counter() - started,
+        )
+        return val
+
+    def _set(
+        self, storage: Storage, func: Callable, key: str, value: Any, expire: float
+    ):
+        if not config.cache_stats:
+            return storage.setex(key, value, expire)
+
+        started = time.perf_counter()
+        try:
+            storage.setex(key, value, expire)
+        except Exception:
+            metrics.incr(type(storage), "errors")
+            raise
+        metrics.storage_op(
+            type(storage), "set", _scope(func), "sets", time.perf_counter() - started
+        )
+
+    async def _async_get(self, storage: Storage, func: Callable, key: str) -> Any:
+        if not config.cache_stats:
+            return await storage.get(key)
+
+        started = time.perf_counter()
+        try:
+            val = await storage.get(key)
+        except Exception:
+            metrics.incr(type(storage), "errors")
+            raise
+        metrics.storage_op(
+            type(storage),
+            "get",
+            _scope(func),
+            "misses" if val is Empty else "hits",
+            time.perf_counter() - started,
+        )
+        return val
+
+    async def _async_set(
+        self, storage: Storage, func: Callable, key: str, value: Any, expire: float
+    ):
+        if not config.cache_stats:
+            return await storage.setex(key, value, expire)
+
+        started = time.perf_counter()
+        try:
+            await storage.setex(key, value, expire)
+        except Exception:
+            metrics.incr(type(storage), "errors")
+            raise
+        metrics.storage_op(
+            type(storage), "set", _scope(func), "sets", time.perf_counter() - started
+        )
+
+    def _observe_call(self, func: Callable, started: float, failed: bool):
+        if not config.cache_stats:
+            return
+        if failed:
+            metrics.incr(_scope(func), "errors")
+        else:
+            metrics.observe(_scope(func), "call", time.perf_counter() - started)
+
+    def _start_refresh(self, key: str) -> bool:
+        with self._refresh_lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def _finish_refresh(self, key: str):
+        with self._refresh_lock:
+            self._refreshing.discard(key)
+
     @wrapt.decorator
     def wrapper(
         self,
@@ -95,53 +538,311 @@ class cache[T, **P]:
         kwargs,
     ) -> Callable[P, T]:
         _key = self.get_key(func, instance, args, kwargs)
-        cache_result = config.storage.get(_key)
+        if self._tag_keys:
+            _key = self._tagged(config.storage, _key)
+        cache_result = self._get(config.storage, func, _key)
+        if cache_result is not Empty:
+            value, refresh = self._unwrap(cache_result)
+            if refresh and self._start_refresh(_key):
+                _get_refresh_executor().submit(self._refresh, func, _key, args, kwargs)
+            return value
+
+        if self.coalesce:
+            return self._flight.do(_key, self._load, func, _key, args, kwargs)  # type: ignore
+
+        return self._compute(func, _key, args, kwargs)  # type: ignore
+
+    def _compute(self, func: Callable[P, T], key: str, args, kwargs) -> T:
+        started = time.time()
+        timer = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except BaseException:
+            self._observe_call(func, timer, failed=True)
+            raise
+        self._observe_call(func, timer, failed=False)
+        value, expire = self._make_entry(result, started)
+        self._set(config.storage, func, key, value, expire)
+        return result
+
+    def _load(self, func: Callable[P, T], key: str, args, kwargs) -> T:
+        # another flight may have filled the key after our miss
+        cache_result = config.storage.get(key)
         if cache_result is not Empty:
-            return cache_result
+            return self._unwrap(cache_result)[0]
 
-        result = func(*args, **kwargs)  # type: ignore
-        config.storage.setex(_key, result, self.expire)
-        return result  # type: ignore
+        return self._compute(func, key, args, kwargs)
+
+    def _refresh(self, func: Callable[P, T], key: str, args, kwargs):
+        try:
+            self._compute(func, key, args, kwargs)
+        except Exception:
+            config.log_exception(f"refresh cache {key} failed.")
+        finally:
+            self._finish_refresh(key)
 
     @wrapt.decorator
     async def async_wrapper(
         self, func: Callable[P, T], instance: Any, args, kwargs
     ) -> Callable[P, T]:
         _key = self.get_key(func, instance, args, kwargs)
-        cache_result = await config.storage.get(_key)
+        storage = config.storage
+        nowait = _nowait(storage)
+        if nowait is not None:
+            if self._tag_keys:
+                _key = self._tagged(nowait, _key)
+            cache_result = self._get(nowait, func, _key)
+        else:
+            if self._tag_keys:
+                _key = await self._async_tagged(storage, _key)
+            cache_result = await self._async_get(storage, func, _key)
         if cache_result is not Empty:
-            return cache_result
+            value, refresh = self._unwrap(cache_result)
+            if refresh and self._start_refresh(_key):
+                task = asyncio.create_task(
+                    self._async_refresh(func, _key, args, kwargs)
+                )
+                self._refresh_tasks.add(task)
+                task.add_done_callback(self._refresh_tasks.discard)
+            return value
 
-        result = await func(*args, **kwargs)  # type: ignore
-        asyncio.create_task(config.storage.setex(_key, result, self.expire))  # type: ignore
+        if self.coalesce:
+            return await self._async_flight.do(
+                _key, self._async_load, func, _key, args, kwargs
+            )
+
+        started = time.time()
+        timer = time.perf_counter()
+        try:
+            result = await func(*args, **kwargs)  # type: ignore
+        except BaseException:
+            self._observe_call(func, timer, failed=True)
+            raise
+        self._observe_call(func, timer, failed=False)
+        value, expire = self._make_entry(result, started)
+        if nowait is not None:
+            self._set(nowait, func, _key, value, expire)
+        else:
+            await config.async_writer.submit(
+                self._async_set, storage, func, _key, value, expire
+            )
         return result
 
+    async def _async_compute(self, func: Callable, key: str, args, kwargs) -> T:
+        started = time.time()
+        timer = time.perf_counter()
+        try:
+            result = await func(*args, **kwargs)
+        except BaseException:
+            self._observe_call(func, timer, failed=True)
+            raise
+        self._observe_call(func, timer, failed=False)
+        value, expire = self._make_entry(result, started)
+        storage = config.storage
+        nowait = _nowait(storage)
+        if nowait is not None:
+            self._set(nowait, func, key, value, expire)
+        else:
+            await self._async_set(storage, func, key, value, expire)
+        return result
+
+    async def _async_load(self, func: Callable, key: str, args, kwargs) -> T:
+        storage = config.storage
+        nowait = _nowait(storage)
+        if nowait is not None:
+            cache_result = nowait.get(key)
+        else:
+            cache_result = await storage.get(key)
+        if cache_result is not Empty:
+            return self._unwrap(cache_result)[0]
+
+        # write before the flight ends, so callers after it get a hit
+        return await self._async_compute(func, key, args, kwargs)
+
+    async def _async_refresh(self, func: Callable, key: str, args, kwargs):
+        try:
+            await self._async_compute(func, key, args, kwargs)
+        except Exception:
+            config.log_exception(f"refresh cache {key} failed.")
+        finally:
+            self._finish_refresh(key)
+
     def __call__(self, func: Callable[P, T]) -> Callable[P, T]:
+        if self.key is None:
+            if isinstance(func, classmethod):
+                self._key_builders[func.__func__] = KeyBuilder(
+                    func.__func__, skip_first=True
+                )
+            else:
+                self._key_builders[func] = KeyBuilder(func)
+
         if _is_async(func):
             return self.async_wrapper(func)  # type: ignore
         return self.wrapper(func)  # type: ignore
 
 
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int | None
+    currsize: int
+
+
+class _LRUCache(OrderedDict):
+    """one lru cache of `cond_lru_cache`, with its own counters."""
+
+    def __init__(self):
+        super().__init__()
+        self.hits = 0
+        self.misses = 0
+
+
+class _CondLRUBoundWrapper(wrapt.BoundFunctionWrapper):
+    def cache_info(self) -> CacheInfo:
+        return self._self_parent._self_lru.cache_info(self._self_instance)
+
+    def cache_clear(self):
+        self._self_parent._self_lru.cache_clear(self._self_instance)
+
+
+class _CondLRUWrapper(wrapt.FunctionWrapper):
+    # cache_info / cache_clear live on the wrapper, bound methods report the
+    # cache of their instance
+    __bound_function_wrapper__ = _CondLRUBoundWrapper
+
+    def __init__(self, wrapped: Callable, lru: "cond_lru_cache"):
+        super().__init__(wrapped, lru.wrapper)
+        self._self_lru = lru
+
+    def cache_info(self) -> CacheInfo:
+        return self._self_lru.cache_info()
+
+    def cache_clear(self):
+        self._self_lru.cache_clear()
+
+
 class cond_lru_cache:
-    """use functools.lru_cache when use_cache return True"""
+    """
+    thread-safe lru cache, only used when `use_cache(*args, **kwargs)` returns True.
+    Entries expire after `ttl` seconds if given, methods get a cache per instance.
+    >>> @cond_lru_cache(lambda a: a > 0, maxsize=256, ttl=60)
+    >>> def foo(a: int) -> int:
+    ...
+    >>> foo.cache_info()
+    CacheInfo(hits=0, misses=0, maxsize=256, currsize=0)
+    >>> foo.cache_clear()
+    `obj.method.cache_info()` reports the cache of `obj`, `Cls.method.cache_info()`
+    the totals of all instances, with `maxsize` summed over their caches.
+    """
 
     def __init__(
-        self, use_cache: Callable[..., bool], maxsize: int = 128, typed: bool = False
+        self,
+        use_cache: Callable[..., bool],
+        maxsize: int | None = 128,
+        typed: bool = False,
+        ttl: float | None = None,
     ):
         self.use_cache = use_cache
         self.maxsize = maxsize
         self.typed = typed
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._cache = _LRUCache()
+        self._instance_caches: weakref.WeakKeyDictionary[Any, _LRUCache] = (
+            weakref.WeakKeyDictionary()
+        )
 
-    @wrapt.decorator
-    def __call__(
+    def make_key(self, args: tuple, kwargs: dict) -> Hashable:
+        key = args
+        if kwargs:
+            key += (_KWARGS_MARK, *kwargs.items())
+        if self.typed:
+            key += tuple(type(v) for v in args)
+            key += tuple(type(v) for v in kwargs.values())
+        return key
+
+    def _get_cache(self, instance: Any, create: bool = True) -> _LRUCache | None:
+        if instance is None or inspect.isclass(instance):
+            return self._cache
+        try:
+            cache = self._instance_caches.get(instance)
+            if cache is None and create:
+                cache = self._instance_caches[instance] = _LRUCache()
+            return cache
+        except TypeError:
+            # not weak referenceable or not hashable, do not cache
+            return None
+
+    def cache_info(self, instance: Any = None) -> CacheInfo:
+        """the cache of `instance`, or totals of all caches."""
+        with self._lock:
+            if instance is not None and not inspect.isclass(instance):
+                cache = self._get_cache(instance, create=False)
+                if cache is None:
+                    return CacheInfo(0, 0, self.maxsize, 0)
+                return CacheInfo(cache.hits, cache.misses, self.maxsize, len(cache))
+
+            caches = list(self._instance_caches.values())
+            if self._cache or not caches:
+                caches.append(self._cache)
+            maxsize = None if self.maxsize is None else self.maxsize * len(caches)
+            currsize = sum(len(cache) for cache in caches)
+            return CacheInfo(self.hits, self.misses, maxsize, currsize)
+
+    def cache_clear(self, instance: Any = None):
+        """clear the cache of `instance`, or all caches."""
+        with self._lock:
+            if instance is not None and not inspect.isclass(instance):
+                cache = self._get_cache(instance, create=False)
+                if cache is not None:
+                    self.hits -= cache.hits
+                    self.misses -= cache.misses
+                    self._instance_caches.pop(instance, None)
+                return
+
+            self._cache.clear()
+            self._cache.hits = self._cache.misses = 0
+            self._instance_caches.clear()
+            self.hits = self.misses = 0
+
+    def wrapper(
         self,
         func: CommonWrapped,
         instance: Any,
         args,
         kwargs,
     ) -> CommonWrapper:
-        deco_func = functools.lru_cache(self.maxsize, self.typed)(func)
-        if self.use_cache(*args, **kwargs):
-            return deco_func(*args, **kwargs)
+        if self.maxsize == 0 or not self.use_cache(*args, **kwargs):
+            return func(*args, **kwargs)
+
+        key = self.make_key(args, kwargs)
+        with self._lock:
+            # created under the lock, concurrent first calls share one cache
+            cache = self._get_cache(instance)
+            if cache is not None:
+                entry = cache.get(key)
+                if entry is not None:
+                    if entry[1] > time.monotonic():
+                        cache.move_to_end(key)
+                        cache.hits += 1
+                        self.hits += 1
+                        return entry[0]
+                    del cache[key]
+                cache.misses += 1
+                self.misses += 1
+        if cache is None:
+            return func(*args, **kwargs)
+
+        result = func(*args, **kwargs)
+        expire_at = float("inf") if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            cache[key] = (result, expire_at)
+            cache.move_to_end(key)
+            if self.maxsize is not None and len(cache) > self.maxsize:
+                cache.popitem(last=False)
+        return result
 
-        return func(*args, **kwargs)
+    def __call__(self, func: CommonWrapped) -> CommonWrapper:
+        return _CondLRUWrapper(func, self)  # type: ignore
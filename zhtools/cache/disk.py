@@ -0,0 +1,422 @@
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+
+from .keys import digest64
+from .serializers import Codec
+from .shared_memory import _lock, _storages
+from .storages import Empty, Storage
+
+_MAGIC = b"ZHDS"
+_VERSION = 1
+# magic, version, slots, next segment, active segment, generation,
+# active segment size, total size of segments
+_HEADER = struct.Struct("<4sIIIIIQQ")
+_HEADER_SIZE = 64
+# state, key length, segment, value length, key hash, record offset, expire at
+_SLOT = struct.Struct("<BxHII4xQQd")
+# key length, value length, expire at; key and value follow
+_RECORD = struct.Struct("<IId")
+
+_FREE = 0
+_USED = 1
+_DELETED = 2
+
+
+class DiskStorage[T](Storage):
+    """
+    Storage kept in a directory, survives restarts and is shared by the
+    processes that open it.
+    Records are appended to segment files of `segment_size` bytes, located by
+    a mmap'd hash index of `slots` entries. Once segments exceed `max_bytes`
+    they are compacted: live entries are rewritten newest first up to half
+    of `max_bytes`, older ones are dropped.
+    Values are decoded straight from a memoryview of the mapped segment.
+    Readers share an open file description lock on the index (a `flock` where
+    those are missing), writers hold it exclusively, so instances on the same
+    directory exclude each other in one process too.
+    >>> config.storage = DiskStorage("/var/cache/myapp", max_bytes=10 * 2**30)
+    """
+
+    # slots probed for a key, a full window evicts the entry expiring first
+    max_probe: int = 64
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = 2**30,
+        segment_size: int = 64 * 2**20,
+        slots: int = 2**18,
+        codec: Codec | None = None,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.segment_size = segment_size
+        self.codec = codec or Codec()
+        os.makedirs(path, exist_ok=True)
+        self._fd = os.open(os.path.join(path, "index"), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            self.slots = self._init_index(slots)
+            self._index = mmap.mmap(self._fd, _HEADER_SIZE + self.slots * _SLOT.size)
+        except BaseException:
+            os.close(self._fd)
+            raise
+        self._lock = threading.RLock()
+        # segment id -> read only map, maps of compacted segments are dropped
+        # when the generation changes
+        self._maps: dict[int, mmap.mmap] = {}
+        self._generation = self._header()[5]
+        self._write_segment = -1
+        self._write_fd = -1
+        _storages.add(self)
+
+    def _init_index(self, slots: int) -> int:
+        _lock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size == 0:
+                os.ftruncate(self._fd, _HEADER_SIZE + slots * _SLOT.size)
+                os.pwrite(
+                    self._fd, _HEADER.pack(_MAGIC, _VERSION, slots, 1, 0, 0, 0, 0), 0
+                )
+                return slots
+            magic, version, slots, *_ = _HEADER.unpack(
+                os.pread(self._fd, _HEADER.size, 0)
+            )
+            if magic != _MAGIC or version != _VERSION:
+                raise ValueError(f"{self.path} is not a cache directory")
+            return slots
+        finally:
+            _lock(self._fd, fcntl.LOCK_UN)
+
+    def _reopen(self):
+        # a forked child gets its own open file description for locking
+        if self._index.closed:
+            return
+        proc = f"/proc/self/fd/{self._fd}"
+        index = os.path.join(self.path, "index")
+        fd = os.open(proc if os.path.exists(proc) else index, os.O_RDWR)
+        os.close(self._fd)
+        self._fd = fd
+
+    def _header(self) -> tuple:
+        return _HEADER.unpack_from(self._index, 0)
+
+    def _set_header(
+        self,
+        next_segment: int,
+        active: int,
+        generation: int,
+        active_size: int,
+        total: int,
+    ):
+        _HEADER.pack_into(
+            self._index,
+            0,
+            _MAGIC,
+            _VERSION,
+            self.slots,
+            next_segment,
+            active,
+            generation,
+            active_size,
+            total,
+        )
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.path, f"{segment:08d}.seg")
+
+    def _lock_shared(self):
+        self._lock.acquire()
+        try:
+            _lock(self._fd, fcntl.LOCK_SH)
+            self._check_generation()
+        except BaseException:
+            self._lock.release()
+            raise
+
+    def _lock_exclusive(self):
+        self._lock.acquire()
+        try:
+            _lock(self._fd, fcntl.LOCK_EX)
+            self._check_generation()
+        except BaseException:
+            self._lock.release()
+            raise
+
+    def _unlock(self):
+        try:
+            _lock(self._fd, fcntl.LOCK_UN)
+        finally:
+            self._lock.release()
+
+    def _check_generation(self):
+        generation = self._header()[5]
+        if generation != self._generation:
+            self._close_maps()
+            self._generation = generation
+
+    def _close_maps(self):
+        for m in self._maps.values():
+            m.close()
+        self._maps.clear()
+        if self._write_fd >= 0:
+            os.close(self._write_fd)
+        self._write_segment = self._write_fd = -1
+
+    def _segment_map(self, segment: int, size: int) -> mmap.mmap:
+        """a map of segment covering at least `size` bytes."""
+        m = self._maps.get(segment)
+        if m is None or len(m) < size:
+            if m is not None:
+                m.close()
+            fd = os.open(self._segment_path(segment), os.O_RDONLY)
+            try:
+                m = self._maps[segment] = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+            finally:
+                os.close(fd)
+        return m
+
+    def _locate(self, key: bytes) -> tuple[int, int]:
+        h = digest64(key)
+        return h, h % self.slots
+
+    def _slot_offsets(self, start: int):
+        for i in range(min(self.slots, self.max_probe)):
+            yield _HEADER_SIZE + (start + i) % self.slots * _SLOT.size
+
+    def _all_slots(self) -> range:
+        return range(_HEADER_SIZE, _HEADER_SIZE + self.slots * _SLOT.size, _SLOT.size)
+
+    def _matches(self, key: bytes, segment: int, offset: int) -> bool:
+        begin = offset + _RECORD.size
+        try:
+            m = self._segment_map(segment, begin + len(key))
+        except FileNotFoundError:
+            return False
+        return m[begin : begin + len(key)] == key
+
+    def _find(self, key: bytes, h: int, start: int) -> int | None:
+        """offset in the index of the slot holding key, expired or not."""
+        index = self._index
+        for slot in self._slot_offsets(start):
+            state, klen, segment, _, kh, offset, _ = _SLOT.unpack_from(index, slot)
+            if state == _FREE:
+                return None
+            if (
+                state == _USED
+                and kh == h
+                and klen == len(key)
+                and self._matches(key, segment, offset)
+            ):
+                return slot
+        return None
+
+    def _find_for_write(self, key: bytes, h: int, start: int, now: float) -> int:
+        """the slot holding key, else the first reusable one, else a victim."""
+        index = self._index
+        reusable = victim = None
+        victim_expire = float("inf")
+        for slot in self._slot_offsets(start):
+            state, klen, segment, _, kh, offset, expire_at = _SLOT.unpack_from(
+                index, slot
+            )
+            if state == _FREE:
+                return slot if reusable is None else reusable
+            if (
+                state == _USED
+                and kh == h
+                and klen == len(key)
+                and self._matches(key, segment, offset)
+            ):
+                return slot
+            if state == _DELETED or expire_at <= now:
+                if reusable is None:
+                    reusable = slot
+            elif expire_at < victim_expire:
+                victim, victim_expire = slot, expire_at
+        if reusable is not None:
+            return reusable
+        if victim is not None:
+            return victim
+        return next(self._slot_offsets(start))
+
+    def get(self, key: str) -> T | object:
+        k = key.encode()
+        h, start = self._locate(k)
+        self._lock_shared()
+        try:
+            slot = self._find(k, h, start)
+            if slot is None:
+                return Empty
+            _, klen, segment, vlen, _, offset, expire_at = _SLOT.unpack_from(
+                self._index, slot
+            )
+            if expire_at <= time.time():
+                return Empty
+            begin = offset + _RECORD.size + klen
+            m = self._segment_map(segment, begin + vlen)
+            with memoryview(m) as view, view[begin : begin + vlen] as data:
+                return self.codec.loads(data)
+        finally:
+            self._unlock()
+
+    def setex(self, key: str, value: T, expire: float):
+        k = key.encode()
+        data = self.codec.dumps(value)
+        now = time.time()
+        if expire is None or expire == float("inf"):
+            expire_at = float("inf")
+        else:
+            expire_at = now + expire
+        record = _RECORD.pack(len(k), len(data), expire_at) + k + data
+        if len(record) > self.max_bytes // 2:
+            # not cached, but the previous value must not be served either
+            self.delete(key)
+            return
+
+        h, start = self._locate(k)
+        self._lock_exclusive()
+        try:
+            segment, offset = self._append(record)
+            slot = self._find_for_write(k, h, start, now)
+            _SLOT.pack_into(
+                self._index,
+                slot,
+                _USED,
+                len(k),
+                segment,
+                len(data),
+                h,
+                offset,
+                expire_at,
+            )
+            if self._header()[7] > self.max_bytes:
+                self._compact()
+        finally:
+            self._unlock()
+
+    def _append(self, record: bytes) -> tuple[int, int]:
+        """write record to the active segment, return where it is."""
+        _, _, _, next_segment, active, generation, size, total = self._header()
+        if active == 0 or (size and size + len(record) > self.segment_size):
+            active, next_segment, size = next_segment, next_segment + 1, 0
+        if self._write_segment != active:
+            if self._write_fd >= 0:
+                os.close(self._write_fd)
+            self._write_fd = os.open(
+                self._segment_path(active), os.O_RDWR | os.O_CREAT, 0o600
+            )
+            self._write_segment = active
+        os.pwrite(self._write_fd, record, size)
+        self._set_header(
+            next_segment, active, generation, size + len(record), total + len(record)
+        )
+        return active, size
+
+    def delete(self, key: str):
+        k = key.encode()
+        h, start = self._locate(k)
+        self._lock_exclusive()
+        try:
+            slot = self._find(k, h, start)
+            if slot is not None:
+                self._index[slot] = _DELETED
+        finally:
+            self._unlock()
+
+    def __len__(self) -> int:
+        now = time.time()
+        self._lock_shared()
+        try:
+            count = 0
+            for slot in self._all_slots():
+                state, *_, expire_at = _SLOT.unpack_from(self._index, slot)
+                count += state == _USED and expire_at > now
+            return count
+        finally:
+            self._unlock()
+
+    def compact(self):
+        self._lock_exclusive()
+        try:
+            self._compact()
+        finally:
+            self._unlock()
+
+    def _compact(self):
+        now = time.time()
+        live = []
+        for slot in self._all_slots():
+            state, klen, segment, vlen, h, offset, expire_at = _SLOT.unpack_from(
+                self._index, slot
+            )
+            if state == _USED and expire_at > now:
+                live.append((segment, offset, klen, vlen, h, expire_at))
+
+        # newest first up to the budget, then written oldest first
+        live.sort(reverse=True)
+        kept, budget = [], self.max_bytes // 2
+        for entry in live:
+            budget -= _RECORD.size + entry[2] + entry[3]
+            if budget < 0:
+                break
+            kept.append(entry)
+        kept.reverse()
+
+        # copied record by record into new segments, old ones are kept
+        # mapped until the index points to the copies
+        _, _, _, first_new, _, generation, _, _ = self._header()
+        self._index[_HEADER_SIZE:] = bytes(self.slots * _SLOT.size)
+        self._set_header(first_new, 0, generation + 1, 0, 0)
+        for old_segment, old_offset, klen, vlen, h, expire_at in kept:
+            end = old_offset + _RECORD.size + klen + vlen
+            record = self._segment_map(old_segment, end)[old_offset:end]
+            segment, offset = self._append(record)
+            key = record[_RECORD.size : _RECORD.size + klen]
+            slot = self._find_for_write(key, h, h % self.slots, now)
+            _SLOT.pack_into(
+                self._index, slot, _USED, klen, segment, vlen, h, offset, expire_at
+            )
+        self._close_maps()
+        self._generation = generation + 1
+        self._remove_segments(first_new)
+
+    def _remove_segments(self, before: int):
+        for name in os.listdir(self.path):
+            if name.endswith(".seg") and int(name[:-4]) < before:
+                try:
+                    os.unlink(os.path.join(self.path, name))
+                except FileNotFoundError:
+                    pass
+
+    def clear(self):
+        self._lock_exclusive()
+        try:
+            _, _, _, next_segment, _, generation, _, _ = self._header()
+            self._close_maps()
+            self._index[_HEADER_SIZE:] = bytes(self.slots * _SLOT.size)
+            self._set_header(next_segment, 0, generation + 1, 0, 0)
+            self._generation = generation + 1
+            self._remove_segments(next_segment)
+        finally:
+            self._unlock()
+
+    def flush(self):
+        """write the index and segments to disk."""
+        self._lock_exclusive()
+        try:
+            self._index.flush()
+            if self._write_fd >= 0:
+                os.fsync(self._write_fd)
+        finally:
+            self._unlock()
+
+    def close(self):
+        _storages.discard(self)
+        with self._lock:
+            self._close_maps()
+            self._index.close()
+            os.close(self._fd)
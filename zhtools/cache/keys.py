@@ -0,0 +1,191 @@
+import datetime
+import decimal
+import functools
+import hashlib
+import inspect
+import pickle
+import types
+import uuid
+from collections.abc import Callable
+from typing import Any
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+# types whose repr is stable across processes and identifies the value
+_REPR_TYPES = frozenset(
+    {
+        int,
+        float,
+        bool,
+        str,
+        bytes,
+        type(None),
+        decimal.Decimal,
+        datetime.date,
+        datetime.datetime,
+        datetime.time,
+        datetime.timedelta,
+        uuid.UUID,
+    }
+)
+
+# types failed to pickle once, not to try again on every call
+_unpicklable_types: set[type] = set()
+
+
+def digest(data: bytes) -> str:
+    if xxhash is not None:
+        return xxhash.xxh3_128_hexdigest(data)
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def digest64(data: bytes) -> int:
+    """a 64 bits hash, unlike hash() the same in every process."""
+    if xxhash is not None:
+        return xxhash.xxh3_64_intdigest(data)
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest())
+
+
+def normalize(value: Any) -> str:
+    """
+    a stable text form of value.
+    simple values use their repr, sets their sorted members, objects defining
+    `__cache_key__()` the form of what it returns, others are
+    identified by a digest of their pickled state, so objects whose repr
+    includes id() get the same key in every process. Pickles of containers
+    holding sets depend on the hash seed and may differ between processes.
+    Unpicklable values fall back to repr.
+    """
+    t = type(value)
+    if t in _REPR_TYPES:
+        return repr(value)
+    if t is set or t is frozenset:
+        return f"{t.__name__}({','.join(sorted(map(normalize, value)))})"
+    if hasattr(t, "__cache_key__"):
+        return normalize(value.__cache_key__())
+    if t not in _unpicklable_types:
+        try:
+            return f"#{digest(pickle.dumps(value, 5))}"
+        except Exception:
+            _unpicklable_types.add(t)
+    if t is tuple or t is list:
+        return repr(type(value)(map(normalize, value)))
+    if isinstance(value, (type, types.FunctionType, types.BuiltinFunctionType)):
+        return f"{value.__module__}.{value.__qualname__}"
+    return repr(value)
+
+
+def instance_key(obj: Any) -> str:
+    """
+    the `self` of a cached method, named by `__cache_key__()` if defined,
+    else by its class and id(): its state is not pickled on every call and
+    mutating it keeps the key.
+    """
+    if hasattr(type(obj), "__cache_key__"):
+        return normalize(obj.__cache_key__())
+    t = type(obj)
+    return f"{t.__module__}.{t.__qualname__}@{id(obj):x}"
+
+
+def func_name(func: Callable) -> str:
+    """module qualified name, callable instances are named by their class."""
+    if isinstance(func, functools.partial):
+        bound = func.args + tuple(sorted(func.keywords.items()))
+        return f"{func_name(func.func)}({','.join(map(normalize, bound))})"
+    qualname = getattr(func, "__qualname__", None)
+    if qualname is None:
+        cls = type(func)
+        return f"{cls.__module__}.{cls.__qualname__}"
+    return f"{func.__module__}.{qualname}"
+
+
+class KeyBuilder:
+    """
+    Build cache keys from a function's arguments.
+    The signature is inspected once, arguments are bound to parameter order
+    with defaults filled, so `foo(1, b=2)` and `foo(1, 2)` share a key.
+    Keys longer than `max_length` are hashed, so are non-simple arguments,
+    note dicts with the same items in a different order hash differently.
+    >>> make_key = KeyBuilder(foo)
+    >>> make_key(1, b=2)
+    'module.foo:1, 2'
+    """
+
+    max_length: int = 128
+
+    def __init__(self, func: Callable, skip_first: bool = False):
+        func = inspect.unwrap(func)
+        self.prefix = func_name(func)
+        params = list(inspect.signature(func).parameters.values())
+        if skip_first:
+            params = params[1:]
+
+        kinds = inspect.Parameter
+        self.names: tuple[str, ...] = tuple(
+            p.name
+            for p in params
+            if p.kind in (kinds.POSITIONAL_ONLY, kinds.POSITIONAL_OR_KEYWORD)
+        )
+        self.kwonly: tuple[str, ...] = tuple(
+            p.name for p in params if p.kind == kinds.KEYWORD_ONLY
+        )
+        self.defaults: dict[str, Any] = {
+            p.name: p.default for p in params if p.default is not p.empty
+        }
+        self.var_positional = any(p.kind == kinds.VAR_POSITIONAL for p in params)
+        self.var_keyword = any(p.kind == kinds.VAR_KEYWORD for p in params)
+        # positional only calls: number of args -> defaults of the rest
+        self._tails: dict[int, tuple] = {}
+        if not (self.kwonly or self.var_positional or self.var_keyword):
+            for i in range(len(self.names) + 1):
+                rest = self.names[i:]
+                if all(name in self.defaults for name in rest):
+                    self._tails[i] = tuple(self.defaults[name] for name in rest)
+
+    def bind(self, args: tuple, kwargs: dict[str, Any]) -> tuple:
+        """arguments in parameter order, extra ones appended in a stable order."""
+        n = len(args)
+        if not kwargs:
+            tail = self._tails.get(n)
+            if tail is not None:
+                return args + tail
+
+        if n > len(self.names) and not self.var_positional:
+            raise TypeError(
+                f"{self.prefix}() takes {len(self.names)} positional arguments"
+                f" but {n} were given"
+            )
+        parts = list(args[: len(self.names)])
+        for name in self.names[n:] + self.kwonly:
+            if name in kwargs:
+                parts.append(kwargs[name])
+            elif name in self.defaults:
+                parts.append(self.defaults[name])
+            else:
+                raise TypeError(f"{self.prefix}() missing argument: '{name}'")
+        if self.var_positional and n > len(self.names):
+            parts.append(args[len(self.names) :])
+        known = set(self.names) | set(self.kwonly)
+        extra = [k for k in kwargs if k not in known]
+        if self.var_keyword:
+            parts.append(tuple(sorted((k, kwargs[k]) for k in extra)))
+        elif extra:
+            raise TypeError(f"{self.prefix}() got an unexpected argument: '{extra[0]}'")
+        return tuple(parts)
+
+    def __call__(self, *args, **kwargs) -> str:
+        parts = self.bind(args, kwargs)
+        for v in parts:
+            if type(v) not in _REPR_TYPES:
+                text = ",".join(map(normalize, parts))
+                break
+        else:
+            text = repr(parts)[1:-1]
+
+        if len(text) > self.max_length:
+            text = digest(text.encode())
+        return f"{self.prefix}:{text}"
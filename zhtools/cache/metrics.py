@@ -0,0 +1,172 @@
+import threading
+from collections import defaultdict
+from collections.abc import Hashable
+from typing import Any
+
+from zhtools.config import config
+
+__all__ = ["metrics", "stats", "reset_stats"]
+
+# latency bucket i counts durations below 2 ** i microseconds, the last slot is the sum
+_BUCKETS = 32
+
+
+class _Counters:
+    """counters of one thread, only written by that thread."""
+
+    def __init__(self):
+        self.thread = threading.current_thread()
+        self.counts: defaultdict[tuple[Hashable, str], int] = defaultdict(int)
+        self.histograms: dict[tuple[Hashable, str], list[float]] = {}
+
+    def merge(self, other: "_Counters"):
+        for k, v in list(other.counts.items()):
+            self.counts[k] += v
+        for k, hist in list(other.histograms.items()):
+            mine = self.histograms.setdefault(k, [0] * (_BUCKETS + 1))
+            for i, n in enumerate(hist):
+                mine[i] += n
+
+
+def describe(scope: Hashable) -> tuple[str, str]:
+    """scopes are storage classes or decorated functions."""
+    if isinstance(scope, type):
+        return "storages", scope.__name__
+    module = getattr(scope, "__module__", None)
+    qualname = getattr(scope, "__qualname__", None) or repr(scope)
+    return "functions", f"{module}.{qualname}" if module else qualname
+
+
+class Metrics:
+    """
+    Counters and latency histograms of the cache, by storage class and by
+    decorated function. Every thread writes its own counters without locking,
+    they are merged on read.
+    Set `config.cache_stats = False` to turn it off, or `config.cache_stats_hook`
+    to receive every event as (scope, name, value), e.g. to forward to statsd.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._threads: list[_Counters] = []
+        # counters of finished threads
+        self._retired = _Counters()
+        # threads are pruned when registering a new one doubles this
+        self._pruned_size = 0
+        self._lock = threading.Lock()
+
+    def _counters(self) -> _Counters:
+        try:
+            return self._local.counters
+        except AttributeError:
+            counters = self._local.counters = _Counters()
+            with self._lock:
+                if len(self._threads) >= 2 * self._pruned_size + 8:
+                    self._prune()
+                self._threads.append(counters)
+            return counters
+
+    def _prune(self):
+        """merge the counters of finished threads into `_retired`, under lock."""
+        alive = []
+        for counters in self._threads:
+            if counters.thread.is_alive():
+                alive.append(counters)
+            else:
+                self._retired.merge(counters)
+        self._threads = alive
+        self._pruned_size = len(alive)
+
+    @staticmethod
+    def _observe(counters: _Counters, key: tuple[Hashable, str], seconds: float):
+        hist = counters.histograms.get(key)
+        if hist is None:
+            hist = counters.histograms[key] = [0] * (_BUCKETS + 1)
+        hist[min(int(seconds * 1e6).bit_length(), _BUCKETS - 1)] += 1
+        hist[_BUCKETS] += seconds
+
+    @staticmethod
+    def _emit(scope: Hashable, name: str, value: float):
+        hook = config.cache_stats_hook
+        if hook is not None:
+            hook(":".join(describe(scope)), name, value)
+
+    def incr(self, scope: Hashable, name: str, n: int = 1):
+        self._counters().counts[(scope, name)] += n
+        self._emit(scope, name, n)
+
+    def observe(self, scope: Hashable, name: str, seconds: float):
+        self._observe(self._counters(), (scope, name), seconds)
+        self._emit(scope, name, seconds)
+
+    def storage_op(
+        self, storage: Hashable, op: str, func: Hashable, event: str, seconds: float
+    ):
+        """a storage `op` called by `func` took `seconds` and was counted as `event`."""
+        counters = self._counters()
+        self._observe(counters, (storage, op), seconds)
+        counters.counts[(func, event)] += 1
+        if config.cache_stats_hook is not None:
+            self._emit(storage, op, seconds)
+            self._emit(func, event, 1)
+
+    def _merged(self) -> _Counters:
+        total = _Counters()
+        with self._lock:
+            self._prune()
+            alive = self._threads
+            total.merge(self._retired)
+        for counters in alive:
+            total.merge(counters)
+        return total
+
+    def snapshot(self) -> dict[str, dict[str, dict[str, Any]]]:
+        """
+        >>> metrics.snapshot()
+        {'functions': {'app.foo': {'hits': 9, 'misses': 1, 'call': {'count': 1, ...}}},
+         'storages': {'MemoryStorage': {'get': {'count': 10, 'avg': 1e-06, 'p50': ...}}}}
+        """
+        merged = self._merged()
+        result: dict[str, dict[str, dict[str, Any]]] = {}
+        for (scope, name), n in merged.counts.items():
+            kind, scope_name = describe(scope)
+            result.setdefault(kind, {}).setdefault(scope_name, {})[name] = n
+        for (scope, name), hist in merged.histograms.items():
+            kind, scope_name = describe(scope)
+            count = int(sum(hist[:_BUCKETS]))
+            result.setdefault(kind, {}).setdefault(scope_name, {})[name] = {
+                "count": count,
+                "avg": hist[_BUCKETS] / count if count else 0,
+                "p50": _quantile(hist, count, 0.5),
+                "p99": _quantile(hist, count, 0.99),
+            }
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._threads = []
+            self._retired = _Counters()
+            self._pruned_size = 0
+            self._local = threading.local()
+
+
+def _quantile(hist: list[float], count: int, q: float) -> float:
+    """upper bound in seconds of the bucket holding the q quantile."""
+    rank = count * q
+    seen = 0.0
+    for i in range(_BUCKETS):
+        seen += hist[i]
+        if seen >= rank and hist[i]:
+            return 2**i / 1e6
+    return 0
+
+
+metrics = Metrics()
+
+
+def stats() -> dict[str, dict[str, dict[str, Any]]]:
+    return metrics.snapshot()
+
+
+def reset_stats():
+    metrics.reset()
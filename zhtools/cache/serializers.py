@@ -0,0 +1,170 @@
+import abc
+import pickle
+import zlib
+from enum import StrEnum
+from typing import Any, ClassVar
+
+from zhtools.exceptions import ModuleRequired
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+
+type Buffer = bytes | bytearray | memoryview
+
+
+class Serializer(metaclass=abc.ABCMeta):
+    # stored in the low 4 bits of the header byte, must be unique in 1-15
+    codec_id: ClassVar[int]
+
+    @abc.abstractmethod
+    def dumps(self, value: Any) -> bytes:
+        pass
+
+    @abc.abstractmethod
+    def loads(self, data: Buffer) -> Any:
+        pass
+
+
+class PickleSerializer(Serializer):
+    codec_id = 1
+
+    def __init__(self, protocol: int = 5):
+        self.protocol = protocol
+
+    def dumps(self, value: Any) -> bytes:
+        return pickle.dumps(value, self.protocol)
+
+    def loads(self, data: Buffer) -> Any:
+        return pickle.loads(data)
+
+
+class MsgpackSerializer(Serializer):
+    """basic types only, tuples are loaded as lists."""
+
+    codec_id = 2
+
+    def __init__(self):
+        if msgpack is None:
+            raise ModuleRequired("msgpack")
+
+    def dumps(self, value: Any) -> bytes:
+        return msgpack.packb(value)
+
+    def loads(self, data: Buffer) -> Any:
+        return msgpack.unpackb(data, strict_map_key=False)
+
+
+class OrjsonSerializer(Serializer):
+    """json types only, plus datetime, dataclass, uuid and numpy as orjson does."""
+
+    codec_id = 3
+
+    def __init__(self):
+        if orjson is None:
+            raise ModuleRequired("orjson")
+
+    def dumps(self, value: Any) -> bytes:
+        return orjson.dumps(value)
+
+    def loads(self, data: Buffer) -> Any:
+        return orjson.loads(data)
+
+
+_serializer_classes: dict[int, type[Serializer]] = {
+    cls.codec_id: cls
+    for cls in (PickleSerializer, MsgpackSerializer, OrjsonSerializer)
+}
+_serializers: dict[int, Serializer] = {}
+
+
+def register_serializer(cls: type[Serializer]):
+    if cls.codec_id in _serializer_classes or not 0 < cls.codec_id < 16:
+        raise ValueError(f"invalid or duplicate codec_id {cls.codec_id}")
+    _serializer_classes[cls.codec_id] = cls
+
+
+def _get_serializer(codec_id: int) -> Serializer:
+    if codec_id not in _serializers:
+        if codec_id not in _serializer_classes:
+            raise ValueError(f"unknown codec_id {codec_id}")
+        _serializers[codec_id] = _serializer_classes[codec_id]()
+    return _serializers[codec_id]
+
+
+class Compression(StrEnum):
+    ZLIB = "zlib"
+    LZ4 = "lz4"
+
+
+_ZLIB_FLAG = 0x10
+_LZ4_FLAG = 0x20
+# every pickle of protocol >= 2 starts with the PROTO opcode
+_LEGACY_PICKLE = 0x80
+
+
+class Codec:
+    """
+    Serialize cache values with a header byte that marks how to load them:
+    the low 4 bits are the serializer's `codec_id`, 0x10 / 0x20 mark zlib / lz4
+    compression. Values written by old versions (plain pickle) still load.
+    Payloads shorter than `threshold` bytes are not compressed.
+    >>> codec = Codec(OrjsonSerializer(), compression=Compression.LZ4)
+    >>> config.storage = RedisStorage(redis_cli, codec=codec)
+    Any codec loads values written by another one.
+    """
+
+    def __init__(
+        self,
+        serializer: Serializer | None = None,
+        compression: Compression | None = None,
+        threshold: int = 1024,
+        level: int = 1,
+    ):
+        self.serializer = serializer or PickleSerializer()
+        self.compression = Compression(compression) if compression else None
+        if self.compression == Compression.LZ4 and lz4_frame is None:
+            raise ModuleRequired("lz4")
+        self.threshold = threshold
+        self.level = level
+
+    def dumps(self, value: Any) -> bytes:
+        body = self.serializer.dumps(value)
+        header = self.serializer.codec_id
+        if self.compression is not None and len(body) >= self.threshold:
+            if self.compression == Compression.ZLIB:
+                compressed = zlib.compress(body, self.level)
+                flag = _ZLIB_FLAG
+            else:
+                compressed = lz4_frame.compress(body, compression_level=self.level)
+                flag = _LZ4_FLAG
+            if len(compressed) < len(body):
+                body = compressed
+                header |= flag
+        return header.to_bytes() + body
+
+    def loads(self, data: Buffer) -> Any:
+        header = data[0]
+        if header == _LEGACY_PICKLE:
+            return pickle.loads(data)
+
+        body: Buffer = memoryview(data)[1:]
+        if header & _ZLIB_FLAG:
+            body = zlib.decompress(body)
+        elif header & _LZ4_FLAG:
+            if lz4_frame is None:
+                raise ModuleRequired("lz4")
+            body = lz4_frame.decompress(body)
+        return _get_serializer(header & 0x0F).loads(body)
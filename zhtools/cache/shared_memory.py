@@ -0,0 +1,313 @@
+import fcntl
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import weakref
+
+from .keys import digest64
+from .serializers import Codec
+from .storages import Empty, Storage
+
+_MAGIC = b"ZHSM"
+_VERSION = 1
+# magic, version, segments, slots per segment, slot size
+_HEADER = struct.Struct("<4sIIII")
+_HEADER_SIZE = 64
+# state, key length, value length, key hash, expire at; key and value follow
+_SLOT = struct.Struct("<BxHIQd")
+
+_FREE = 0
+_USED = 1
+_DELETED = 2
+
+# open file description locks belong to the fd, not the process like lockf
+# ones, which any close() of the same file in the process drops
+_OFD = hasattr(fcntl, "F_OFD_SETLKW")
+# struct flock: type, whence, start, len, pid
+_FLOCK = struct.Struct("hhqqi4x")
+
+# storages with a `_reopen` method, called in forked children so they do
+# not share lock owners with the parent
+_storages: weakref.WeakSet = weakref.WeakSet()
+
+
+def _lock(fd: int, op: int, length: int = 0, start: int = 0):
+    """
+    lock or unlock a byte range, a length of 0 runs to the end of the file.
+    Without OFD locks the whole file is locked.
+    """
+    if not _OFD:
+        fcntl.flock(fd, op)
+        return
+    if op == fcntl.LOCK_EX:
+        kind = fcntl.F_WRLCK
+    elif op == fcntl.LOCK_SH:
+        kind = fcntl.F_RDLCK
+    else:
+        kind = fcntl.F_UNLCK
+    fcntl.fcntl(
+        fd, fcntl.F_OFD_SETLKW, _FLOCK.pack(kind, os.SEEK_SET, start, length, 0)
+    )
+
+
+def _reopen_after_fork():
+    for storage in list(_storages):
+        storage._reopen()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reopen_after_fork)
+
+
+def _default_path(name: str) -> str:
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, f"zhtools-cache-{name}")
+
+
+class SharedMemoryStorage[T](Storage):
+    """
+    Storage shared by the processes of one host, in a mmap'd file under
+    /dev/shm. The file is a fixed-size hash table split into `segments`,
+    each probed linearly and locked by a thread lock plus an open file
+    description range lock (a whole file `flock` where those are missing).
+    Values are encoded by `codec`, values larger than a slot are not cached
+    and a full segment evicts the entry expiring first.
+    Every process opens the same name, the first one creates the table and
+    later ones keep its layout, with `create=False` a missing table raises:
+    >>> config.storage = SharedMemoryStorage("myapp", slots=65536, slot_size=1024)
+    """
+
+    def __init__(
+        self,
+        name: str = "default",
+        slots: int = 16384,
+        slot_size: int = 512,
+        segments: int = 64,
+        codec: Codec | None = None,
+        path: str | None = None,
+        create: bool = True,
+    ):
+        if slot_size <= _SLOT.size:
+            raise ValueError(f"slot_size must be larger than {_SLOT.size}")
+        self.codec = codec or Codec()
+        self.path = path or _default_path(name)
+        flags = os.O_RDWR | os.O_CREAT if create else os.O_RDWR
+        self._fd = os.open(self.path, flags, 0o600)
+        try:
+            self._init_table(segments, max(1, slots // segments), slot_size, create)
+            self._mm = mmap.mmap(self._fd, self._size)
+        except BaseException:
+            os.close(self._fd)
+            raise
+        if _OFD:
+            self._locks = [threading.Lock() for _ in range(self.segments)]
+        else:
+            # flock covers the whole file, one thread of the process at a time
+            self._locks = [threading.Lock()] * self.segments
+        _storages.add(self)
+
+    def _init_table(
+        self, segments: int, per_segment: int, slot_size: int, create: bool
+    ):
+        _lock(self._fd, fcntl.LOCK_EX, _HEADER_SIZE, 0)
+        try:
+            if os.fstat(self._fd).st_size == 0:
+                if not create:
+                    raise ValueError(f"{self.path} is not a cache table")
+                header = _HEADER.pack(
+                    _MAGIC, _VERSION, segments, per_segment, slot_size
+                )
+                os.ftruncate(
+                    self._fd, _HEADER_SIZE + segments * per_segment * slot_size
+                )
+                os.pwrite(self._fd, header, 0)
+            else:
+                header = os.pread(self._fd, _HEADER.size, 0)
+                magic, version, segments, per_segment, slot_size = _HEADER.unpack(
+                    header
+                )
+                if magic != _MAGIC or version != _VERSION:
+                    raise ValueError(f"{self.path} is not a cache table")
+        finally:
+            _lock(self._fd, fcntl.LOCK_UN, _HEADER_SIZE, 0)
+
+        self.segments = segments
+        self.per_segment = per_segment
+        self.slot_size = slot_size
+        self._segment_size = per_segment * slot_size
+        self._size = _HEADER_SIZE + segments * self._segment_size
+
+    def __reduce__(self):
+        # reopened by path in spawned processes, fails if the file is gone
+        args = ("", 0, self.slot_size, 1, self.codec, self.path, False)
+        return SharedMemoryStorage, args
+
+    def _reopen(self):
+        # a forked child gets its own open file description for locking
+        if self._mm.closed:
+            return
+        proc = f"/proc/self/fd/{self._fd}"
+        fd = os.open(proc if os.path.exists(proc) else self.path, os.O_RDWR)
+        os.close(self._fd)
+        self._fd = fd
+
+    def _locate(self, key: bytes) -> tuple[int, int, int]:
+        """hash, segment, first slot to probe."""
+        h = digest64(key)
+        rest, segment = divmod(h, self.segments)
+        return h, segment, rest % self.per_segment
+
+    def _acquire(self, segment: int):
+        self._locks[segment].acquire()
+        try:
+            _lock(
+                self._fd,
+                fcntl.LOCK_EX,
+                self._segment_size,
+                _HEADER_SIZE + segment * self._segment_size,
+            )
+        except BaseException:
+            self._locks[segment].release()
+            raise
+
+    def _release(self, segment: int):
+        try:
+            _lock(
+                self._fd,
+                fcntl.LOCK_UN,
+                self._segment_size,
+                _HEADER_SIZE + segment * self._segment_size,
+            )
+        finally:
+            self._locks[segment].release()
+
+    def _slots(self, segment: int, start: int):
+        base = _HEADER_SIZE + segment * self._segment_size
+        for i in range(self.per_segment):
+            yield base + (start + i) % self.per_segment * self.slot_size
+
+    def _find(self, key: bytes, h: int, segment: int, start: int) -> int | None:
+        """offset of the slot holding key, expired or not."""
+        mm = self._mm
+        for offset in self._slots(segment, start):
+            state, klen, _, kh, _ = _SLOT.unpack_from(mm, offset)
+            if state == _FREE:
+                return None
+            if state == _USED and kh == h and klen == len(key):
+                begin = offset + _SLOT.size
+                if mm[begin : begin + klen] == key:
+                    return offset
+        return None
+
+    def _find_for_write(
+        self, key: bytes, h: int, segment: int, start: int, now: float
+    ) -> int:
+        """the slot holding key, else the first reusable one, else a victim."""
+        mm = self._mm
+        reusable = victim = None
+        victim_expire = float("inf")
+        for offset in self._slots(segment, start):
+            state, klen, _, kh, expire_at = _SLOT.unpack_from(mm, offset)
+            if state == _FREE:
+                return offset if reusable is None else reusable
+            if state == _USED and kh == h and klen == len(key):
+                begin = offset + _SLOT.size
+                if mm[begin : begin + klen] == key:
+                    return offset
+            if state == _DELETED or expire_at <= now:
+                if reusable is None:
+                    reusable = offset
+            elif expire_at < victim_expire:
+                victim, victim_expire = offset, expire_at
+        if reusable is not None:
+            return reusable
+        if victim is not None:
+            return victim
+        return next(self._slots(segment, start))
+
+    def get(self, key: str) -> T | object:
+        k = key.encode()
+        h, segment, start = self._locate(k)
+        self._acquire(segment)
+        try:
+            offset = self._find(k, h, segment, start)
+            if offset is None:
+                return Empty
+            _, klen, vlen, _, expire_at = _SLOT.unpack_from(self._mm, offset)
+            if expire_at <= time.time():
+                return Empty
+            begin = offset + _SLOT.size + klen
+            data = self._mm[begin : begin + vlen]
+        finally:
+            self._release(segment)
+        return self.codec.loads(data)
+
+    def setex(self, key: str, value: T, expire: float):
+        k = key.encode()
+        data = self.codec.dumps(value)
+        if _SLOT.size + len(k) + len(data) > self.slot_size:
+            # not cached, but the previous value must not be served either
+            self.delete(key)
+            return
+
+        now = time.time()
+        if expire is None or expire == float("inf"):
+            expire_at = float("inf")
+        else:
+            expire_at = now + expire
+        h, segment, start = self._locate(k)
+        self._acquire(segment)
+        try:
+            offset = self._find_for_write(k, h, segment, start, now)
+            begin = offset + _SLOT.size
+            self._mm[begin : begin + len(k)] = k
+            self._mm[begin + len(k) : begin + len(k) + len(data)] = data
+            _SLOT.pack_into(self._mm, offset, _USED, len(k), len(data), h, expire_at)
+        finally:
+            self._release(segment)
+
+    def delete(self, key: str):
+        k = key.encode()
+        h, segment, start = self._locate(k)
+        self._acquire(segment)
+        try:
+            offset = self._find(k, h, segment, start)
+            if offset is not None:
+                self._mm[offset] = _DELETED
+        finally:
+            self._release(segment)
+
+    def __len__(self) -> int:
+        now = time.time()
+        count = 0
+        for segment in range(self.segments):
+            self._acquire(segment)
+            try:
+                for offset in self._slots(segment, 0):
+                    state, _, _, _, expire_at = _SLOT.unpack_from(self._mm, offset)
+                    count += state == _USED and expire_at > now
+            finally:
+                self._release(segment)
+        return count
+
+    def clear(self):
+        empty = bytes(self._segment_size)
+        for segment in range(self.segments):
+            base = _HEADER_SIZE + segment * self._segment_size
+            self._acquire(segment)
+            try:
+                self._mm[base : base + self._segment_size] = empty
+            finally:
+                self._release(segment)
+
+    def close(self):
+        _storages.discard(self)
+        self._mm.close()
+        os.close(self._fd)
+
+    def unlink(self):
+        """remove the file, processes that opened it keep their mapping."""
+        os.unlink(self.path)
@@ -1,8 +1,21 @@
 import abc
+import asyncio
+import heapq
 import logging
-import pickle
+import sys
+import threading
 import time
 import typing
+import uuid
+from collections import OrderedDict, defaultdict
+from collections.abc import Callable, Iterable, Mapping, Sequence
+from enum import StrEnum
+from typing import Any
+
+from zhtools.config import config
+
+from .metrics import metrics
+from .serializers import Codec
 
 if typing.TYPE_CHECKING:
     from redis import Redis
@@ -23,8 +36,35 @@ class Storage[T](metaclass=abc.ABCMeta):
     def setex(self, key: str, value: T, expire: float):
         pass
 
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def get_with_ttl(self, key: str) -> tuple[T | object, float | None]:
+        """the value and its remaining seconds, None if unknown or never expires."""
+        return self.get(key), None
+
+    def get_many(self, keys: Sequence[str]) -> list[T | object]:
+        return [self.get(key) for key in keys]
+
+    def get_many_with_ttl(
+        self, keys: Sequence[str]
+    ) -> list[tuple[T | object, float | None]]:
+        return [(val, None) for val in self.get_many(keys)]
+
+    def set_many(self, mapping: Mapping[str, T], expire: float):
+        for key, value in mapping.items():
+            self.setex(key, value, expire)
+
+    def delete_many(self, keys: Iterable[str]):
+        for key in keys:
+            self.delete(key)
+
 
 class AsyncStorage[T](Storage, metaclass=abc.ABCMeta):
+    # a sync storage with the same data that never blocks, `@cache` calls it
+    # instead of awaiting this one
+    nowait: Storage[T] | None = None
+
     @abc.abstractmethod
     async def get(self, key: str) -> T:
         pass
@@ -36,50 +76,392 @@ class AsyncStorage[T](Storage, metaclass=abc.ABCMeta):
     async def setex(self, key: str, value: T, expire: float):
         pass
 
+    async def delete(self, key: str):
+        raise NotImplementedError
+
+    async def get_with_ttl(self, key: str) -> tuple[T | object, float | None]:
+        return await self.get(key), None
+
+    async def get_many(self, keys: Sequence[str]) -> list[T | object]:
+        return [await self.get(key) for key in keys]
+
+    async def get_many_with_ttl(
+        self, keys: Sequence[str]
+    ) -> list[tuple[T | object, float | None]]:
+        return [(val, None) for val in await self.get_many(keys)]
+
+    async def set_many(self, mapping: Mapping[str, T], expire: float):
+        for key, value in mapping.items():
+            await self.setex(key, value, expire)
+
+    async def delete_many(self, keys: Iterable[str]):
+        for key in keys:
+            await self.delete(key)
+
 
 class MemoryStorage[T](Storage):
+    """
+    Expired entries are dropped when read, purged in small batches by writes
+    through an expiry heap, and optionally by a background sweeper.
+    Writes read `time.time()` once, a clock ticked by the sweeper would be
+    cheaper but cut ttls short by up to its interval.
+    >>> storage = MemoryStorage()
+    >>> storage.start_sweeper(interval=1)
+    or in an event loop:
+    >>> task = asyncio.create_task(storage.sweep(interval=1))
+    """
+
+    # max expired entries reclaimed by one write / one sweeper round
+    purge_batch: int = 16
+    sweep_batch: int = 1024
+
     def __init__(self):
         self.data: dict[str, tuple[T, float]] = {}
+        # heap of (expire_at, key), entries are stale once the key is rewritten
+        self._expires: list[tuple[float, str]] = []
+        self._lock = threading.Lock()
+        self._sweeper: threading.Thread | None = None
+        self._sweeper_stop = threading.Event()
 
     def get(self, key: str) -> T | object:
         val, expire = self.data.get(key, (Empty, 0))
         if val is Empty:
             return val
 
-        if expire < time.time():
-            del self.data[key]
+        now = time.time()
+        if expire < now:
+            with self._lock:
+                entry = self.data.get(key)
+                if entry is not None and entry[1] < now:
+                    self._remove(key)
             return Empty
         return val
 
     def setex(self, key: str, value: T, expire: float):
-        if expire is None:
-            expire = float("inf")
-        expire_at = time.time() + expire
+        if expire is None or expire == float("inf"):
+            with self._lock:
+                self._insert(key, value, float("inf"))
+            return
+
+        now = time.time()
+        expire_at = now + expire
+        with self._lock:
+            if not self._insert(key, value, expire_at):
+                return
+
+            heapq.heappush(self._expires, (expire_at, key))
+            if self._expires[0][0] <= now:
+                self._purge(now, self.purge_batch)
+            if len(self._expires) > 2 * len(self.data) + self.sweep_batch:
+                self._rebuild_expires()
+
+    def delete(self, key: str):
+        with self._lock:
+            if key in self.data:
+                self._remove(key)
+
+    def get_with_ttl(self, key: str) -> tuple[T | object, float | None]:
+        val = self.get(key)
+        if val is Empty:
+            return val, None
+        _, expire_at = self.data.get(key, (val, float("inf")))
+        if expire_at == float("inf"):
+            return val, None
+        return val, expire_at - time.time()
+
+    def get_many_with_ttl(
+        self, keys: Sequence[str]
+    ) -> list[tuple[T | object, float | None]]:
+        return [self.get_with_ttl(key) for key in keys]
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def purge_expired(self, limit: int | None = None) -> int:
+        """remove expired entries, return the number of removed entries."""
+        with self._lock:
+            return self._purge(time.time(), limit)
+
+    def start_sweeper(self, interval: float = 1.0) -> threading.Thread:
+        if self._sweeper is None or not self._sweeper.is_alive():
+            self._sweeper_stop.clear()
+            self._sweeper = threading.Thread(
+                target=self._sweep_forever,
+                args=(interval,),
+                name=f"{self.__class__.__name__}-sweeper",
+                daemon=True,
+            )
+            self._sweeper.start()
+        return self._sweeper
+
+    def stop_sweeper(self):
+        if self._sweeper is None:
+            return
+        self._sweeper_stop.set()
+        self._sweeper.join()
+        self._sweeper = None
+
+    async def sweep(self, interval: float = 1.0):
+        while True:
+            await asyncio.sleep(interval)
+            self._sweep_once()
+
+    def _sweep_forever(self, interval: float):
+        while not self._sweeper_stop.wait(interval):
+            self._sweep_once()
+
+    def _sweep_once(self):
+        # release the lock between batches so writers are not blocked
+        while True:
+            with self._lock:
+                now = time.time()
+                if not self._expires or self._expires[0][0] > now:
+                    return
+                self._purge(now, self.sweep_batch)
+
+    def _insert(self, key: str, value: T, expire_at: float) -> bool:
         self.data[key] = (value, expire_at)
+        return True
 
+    def _remove(self, key: str):
+        del self.data[key]
+
+    def _purge(self, now: float, limit: int | None) -> int:
+        removed = popped = 0
+        heap = self._expires
+        while heap and heap[0][0] <= now and (limit is None or popped < limit):
+            expire_at, key = heapq.heappop(heap)
+            popped += 1
+            entry = self.data.get(key)
+            if entry is not None and entry[1] == expire_at:
+                self._remove(key)
+                removed += 1
+        return removed
+
+    def _rebuild_expires(self):
+        self._expires = [
+            (expire_at, key)
+            for key, (_, expire_at) in self.data.items()
+            if expire_at != float("inf")
+        ]
+        heapq.heapify(self._expires)
 
-class RedisStorage[T](Storage):
-    def __init__(self, redis_cli: "Redis"):
-        self.redis_cli = redis_cli
+
+class AsyncMemoryStorage[T](AsyncStorage):
+    """
+    MemoryStorage for async code, async functions decorated with `@cache`
+    read and write the wrapped storage directly, without awaiting.
+    >>> config.storage = AsyncMemoryStorage(BoundedMemoryStorage(max_entries=1000))
+    """
+
+    def __init__(self, storage: MemoryStorage[T] | None = None):
+        self.nowait = storage if storage is not None else MemoryStorage()
+
+    async def get(self, key: str) -> T:
+        return self.nowait.get(key)
+
+    async def setex(self, key: str, value: T, expire: float):
+        self.nowait.setex(key, value, expire)
+
+    async def delete(self, key: str):
+        self.nowait.delete(key)
+
+    async def get_with_ttl(self, key: str) -> tuple[T | object, float | None]:
+        return self.nowait.get_with_ttl(key)
+
+    async def get_many(self, keys: Sequence[str]) -> list[T | object]:
+        return self.nowait.get_many(keys)
+
+    async def get_many_with_ttl(
+        self, keys: Sequence[str]
+    ) -> list[tuple[T | object, float | None]]:
+        return self.nowait.get_many_with_ttl(keys)
+
+    async def set_many(self, mapping: Mapping[str, T], expire: float):
+        self.nowait.set_many(mapping, expire)
+
+    async def delete_many(self, keys: Iterable[str]):
+        self.nowait.delete_many(keys)
+
+    def __len__(self) -> int:
+        return len(self.nowait)
+
+
+class EvictionPolicy(StrEnum):
+    LRU = "lru"
+    LFU = "lfu"
+
+
+class BoundedMemoryStorage[T](MemoryStorage):
+    """
+    MemoryStorage with a size limit, evicts entries by LRU or LFU when full.
+    >>> config.storage = BoundedMemoryStorage(max_entries=10000)
+    >>> config.storage = BoundedMemoryStorage(max_bytes=1 << 26, policy=EvictionPolicy.LFU)
+    `max_bytes` is measured by `sizeof`, which is shallow by default.
+    """
+
+    def __init__(
+        self,
+        max_entries: int | None = None,
+        max_bytes: int | None = None,
+        policy: EvictionPolicy = EvictionPolicy.LRU,
+        sizeof: Callable[[Any], int] = sys.getsizeof,
+    ):
+        super().__init__()
+        self.data: OrderedDict[str, tuple[T, float]] = OrderedDict()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.policy = EvictionPolicy(policy)
+        self.sizeof = sizeof
+        self.sizes: dict[str, int] = {}
+        self.nbytes = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+        # lfu: key -> frequency, frequency -> keys in insertion order
+        self._freqs: dict[str, int] = {}
+        self._freq_keys: defaultdict[int, OrderedDict[str, None]] = defaultdict(
+            OrderedDict
+        )
+        # frequencies in use as a circular list in ascending order, from and
+        # to the head 0, the lowest one is found without scanning
+        self._next_freq: dict[int, int] = {0: 0}
+        self._prev_freq: dict[int, int] = {0: 0}
 
     def get(self, key: str) -> T | object:
-        ret = self.redis_cli.get(key)
+        with self._lock:
+            val, expire = self.data.get(key, (Empty, 0))
+            if val is Empty:
+                return val
+
+            if expire < time.time():
+                self._remove(key)
+                return Empty
+
+            self._touch(key)
+            return val
+
+    def _insert(self, key: str, value: T, expire_at: float) -> bool:
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        if key in self.data:
+            self._remove(key)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return False
+
+        while self.data and self._is_full(size):
+            self._evict()
+
+        self.data[key] = (value, expire_at)
+        self.sizes[key] = size
+        self.nbytes += size
+        if self.policy == EvictionPolicy.LFU:
+            if 1 not in self._freq_keys:
+                self._link_freq(1, 0)
+            self._freqs[key] = 1
+            self._freq_keys[1][key] = None
+        return True
+
+    def _is_full(self, incoming: int) -> bool:
+        if self.max_entries is not None and len(self.data) >= self.max_entries:
+            return True
+        if self.max_bytes is not None and self.nbytes + incoming > self.max_bytes:
+            return True
+        return False
+
+    def _touch(self, key: str):
+        if self.policy == EvictionPolicy.LRU:
+            self.data.move_to_end(key)
+            return
+
+        freq = self._freqs[key]
+        if freq + 1 not in self._freq_keys:
+            self._link_freq(freq + 1, freq)
+        self._freqs[key] = freq + 1
+        self._freq_keys[freq + 1][key] = None
+        self._drop_freq_key(freq, key)
+
+    def _link_freq(self, freq: int, after: int):
+        following = self._next_freq[after]
+        self._next_freq[after] = freq
+        self._prev_freq[freq] = after
+        self._next_freq[freq] = following
+        self._prev_freq[following] = freq
+
+    def _drop_freq_key(self, freq: int, key: str):
+        keys = self._freq_keys[freq]
+        del keys[key]
+        if not keys:
+            del self._freq_keys[freq]
+            before = self._prev_freq.pop(freq)
+            after = self._next_freq.pop(freq)
+            self._next_freq[before] = after
+            self._prev_freq[after] = before
+
+    def _evict(self):
+        if self.policy == EvictionPolicy.LRU:
+            key = next(iter(self.data))
+        else:
+            key = next(iter(self._freq_keys[self._next_freq[0]]))
+        self.evictions += 1
+        self.evicted_bytes += self.sizes.get(key, 0)
+        self._remove(key)
+        if config.cache_stats:
+            metrics.incr(type(self), "evictions")
+
+    def _remove(self, key: str):
+        del self.data[key]
+        self.nbytes -= self.sizes.pop(key, 0)
+        if self.policy == EvictionPolicy.LFU:
+            self._drop_freq_key(self._freqs.pop(key), key)
+
+
+class _RedisCodec:
+    def __init__(self, redis_cli: "Redis", codec: Codec | None = None):
+        self.redis_cli = redis_cli
+        self.codec = codec or Codec()
+
+    def _loads(self, ret: Any) -> Any:
         if ret is None:
             return Empty
 
         if isinstance(ret, bytes):
             try:
-                ret = pickle.loads(ret)
-            except pickle.UnpicklingError:
+                ret = self.codec.loads(ret)
+            except Exception:
+                # not written by a codec, return as is
                 pass
 
         return ret
 
-    def setex(self, key: str, value: T, expire: float):
+    def _with_ttl(self, ret: Any, pttl: int) -> tuple[Any, float | None]:
+        # PTTL is -1 for keys without expiry, -2 for missing ones
+        return self._loads(ret), pttl / 1000 if pttl >= 0 else None
+
+    def _dumps(self, value: Any) -> bytes | None:
         try:
-            _value = pickle.dumps(value)
-        except pickle.PickleError:
-            logging.error(f"cache value {value} can not pickle.")
+            data = self.codec.dumps(value)
+        except Exception:
+            logging.error(f"cache value {value} can not serialize.")
+            if config.cache_stats:
+                metrics.incr(type(self), "errors")
+            return None
+
+        if config.cache_stats:
+            metrics.incr(type(self), "bytes_serialized", len(data))
+        return data
+
+
+class RedisStorage[T](_RedisCodec, Storage):
+    """
+    values are serialized by `codec`, pickle protocol 5 by default.
+    >>> RedisStorage(redis_cli, codec=Codec(compression=Compression.ZLIB))
+    """
+
+    def get(self, key: str) -> T | object:
+        return self._loads(self.redis_cli.get(key))
+
+    def setex(self, key: str, value: T, expire: float):
+        _value = self._dumps(value)
+        if _value is None:
             return
 
         if expire is None or expire == float("inf"):
@@ -87,32 +469,335 @@ class RedisStorage[T](Storage):
         else:
             self.redis_cli.setex(key, int(expire), _value)
 
+    def delete(self, key: str):
+        self.redis_cli.delete(key)
 
-class AsyncRedisStorage[T](AsyncStorage):
-    def __init__(self, redis_cli: "Redis"):
-        self.redis_cli = redis_cli
+    def get_with_ttl(self, key: str) -> tuple[T | object, float | None]:
+        pipe = self.redis_cli.pipeline(transaction=False).get(key).pttl(key)
+        ret, pttl = pipe.execute()
+        return self._with_ttl(ret, pttl)
 
-    async def get(self, key: str) -> T | object:
-        ret = await self.redis_cli.get(key)
-        if ret is None:
-            return Empty
+    def get_many(self, keys: Sequence[str]) -> list[T | object]:
+        if not keys:
+            return []
+        return [self._loads(ret) for ret in self.redis_cli.mget(keys)]
 
-        if isinstance(ret, bytes):
-            try:
-                ret = pickle.loads(ret)
-            except pickle.UnpicklingError:
-                pass
+    def get_many_with_ttl(
+        self, keys: Sequence[str]
+    ) -> list[tuple[T | object, float | None]]:
+        if not keys:
+            return []
+        pipe = self.redis_cli.pipeline(transaction=False).mget(keys)
+        for key in keys:
+            pipe.pttl(key)
+        rets, *pttls = pipe.execute()
+        return [self._with_ttl(ret, pttl) for ret, pttl in zip(rets, pttls)]
+
+    def set_many(self, mapping: Mapping[str, T], expire: float):
+        pipe = self.redis_cli.pipeline(transaction=False)
+        for key, value in mapping.items():
+            _value = self._dumps(value)
+            if _value is None:
+                continue
+            if expire is None or expire == float("inf"):
+                pipe.set(key, _value)
+            else:
+                pipe.setex(key, int(expire), _value)
+        pipe.execute()
+
+    def delete_many(self, keys: Iterable[str]):
+        keys = list(keys)
+        if keys:
+            self.redis_cli.delete(*keys)
 
-        return ret
+
+class AsyncRedisStorage[T](_RedisCodec, AsyncStorage):
+
+    async def get(self, key: str) -> T | object:
+        return self._loads(await self.redis_cli.get(key))
 
     async def setex(self, key: str, value: T, expire: float):
-        try:
-            _value = pickle.dumps(value)
-        except pickle.PickleError:
-            logging.error(f"cache value {value} can not pickle.")
+        _value = self._dumps(value)
+        if _value is None:
             return
 
         if expire is None or expire == float("inf"):
             await self.redis_cli.set(key, _value)
         else:
             await self.redis_cli.setex(key, int(expire), _value)
+
+    async def delete(self, key: str):
+        await self.redis_cli.delete(key)
+
+    async def get_with_ttl(self, key: str) -> tuple[T | object, float | None]:
+        pipe = self.redis_cli.pipeline(transaction=False).get(key).pttl(key)
+        ret, pttl = await pipe.execute()
+        return self._with_ttl(ret, pttl)
+
+    async def get_many(self, keys: Sequence[str]) -> list[T | object]:
+        if not keys:
+            return []
+        return [self._loads(ret) for ret in await self.redis_cli.mget(keys)]
+
+    async def get_many_with_ttl(
+        self, keys: Sequence[str]
+    ) -> list[tuple[T | object, float | None]]:
+        if not keys:
+            return []
+        pipe = self.redis_cli.pipeline(transaction=False).mget(keys)
+        for key in keys:
+            pipe.pttl(key)
+        rets, *pttls = await pipe.execute()
+        return [self._with_ttl(ret, pttl) for ret, pttl in zip(rets, pttls)]
+
+    async def set_many(self, mapping: Mapping[str, T], expire: float):
+        pipe = self.redis_cli.pipeline(transaction=False)
+        for key, value in mapping.items():
+            _value = self._dumps(value)
+            if _value is None:
+                continue
+            if expire is None or expire == float("inf"):
+                pipe.set(key, _value)
+            else:
+                pipe.setex(key, int(expire), _value)
+        await pipe.execute()
+
+    async def delete_many(self, keys: Iterable[str]):
+        keys = list(keys)
+        if keys:
+            await self.redis_cli.delete(*keys)
+
+
+class InvalidationChannel(metaclass=abc.ABCMeta):
+    """broadcast messages to every subscriber, in this process or others."""
+
+    @abc.abstractmethod
+    def publish(self, message: str):
+        pass
+
+    @abc.abstractmethod
+    def subscribe(self, callback: Callable[[str], None]):
+        pass
+
+    async def apublish(self, message: str):
+        """`publish` from an event loop, in a thread unless it never blocks."""
+        await asyncio.to_thread(self.publish, message)
+
+
+class LocalChannel(InvalidationChannel):
+    """in-process channel, for tests or several tiered storages in one process."""
+
+    def __init__(self):
+        self.callbacks: list[Callable[[str], None]] = []
+
+    def publish(self, message: str):
+        for callback in list(self.callbacks):
+            callback(message)
+
+    async def apublish(self, message: str):
+        self.publish(message)
+
+    def subscribe(self, callback: Callable[[str], None]):
+        self.callbacks.append(callback)
+
+
+class RedisChannel(InvalidationChannel):
+    """
+    channel on redis pub/sub, messages are received in a background thread.
+    `redis_cli` must be a sync client, it works for `AsyncTieredStorage` too.
+    """
+
+    def __init__(self, redis_cli: "Redis", channel: str = "zhtools:cache:invalidate"):
+        self.redis_cli = redis_cli
+        self.channel = channel
+        self.callbacks: list[Callable[[str], None]] = []
+        self._pubsub = None
+        self._thread = None
+
+    def publish(self, message: str):
+        self.redis_cli.publish(self.channel, message)
+
+    def subscribe(self, callback: Callable[[str], None]):
+        self.callbacks.append(callback)
+        if self._pubsub is None:
+            self._pubsub = self.redis_cli.pubsub(ignore_subscribe_messages=True)
+            self._pubsub.subscribe(**{self.channel: self._on_message})
+            self._thread = self._pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    def close(self):
+        if self._thread is not None:
+            self._thread.stop()
+            self._thread = None
+        if self._pubsub is not None:
+            self._pubsub.close()
+            self._pubsub = None
+
+    def _on_message(self, message: dict):
+        data = message["data"]
+        if isinstance(data, bytes):
+            data = data.decode()
+        for callback in list(self.callbacks):
+            callback(data)
+
+
+class _Tiered:
+    def __init__(
+        self,
+        l1: MemoryStorage | None,
+        l1_ttl: float,
+        channel: InvalidationChannel | None,
+    ):
+        self.l1 = l1 if l1 is not None else BoundedMemoryStorage(max_entries=10000)
+        self.l1_ttl = l1_ttl
+        self.channel = channel
+        self.id = uuid.uuid4().hex
+        if channel is not None:
+            channel.subscribe(self._on_invalidate)
+
+    def invalidate_others(self, *keys: str):
+        if self.channel is not None and keys:
+            self.channel.publish(self._message(keys))
+
+    async def ainvalidate_others(self, *keys: str):
+        if self.channel is not None and keys:
+            await self.channel.apublish(self._message(keys))
+
+    def _message(self, keys: Iterable[str]) -> str:
+        # one message per write: sender id, then the keys, one per line
+        return "\n".join((self.id, *keys))
+
+    def _fill(self, key: str, value: Any, ttl: float | None):
+        # never keep a copy in L1 longer than L2 keeps the value
+        if value is Empty:
+            return
+        ttl = self.l1_ttl if ttl is None else min(ttl, self.l1_ttl)
+        if ttl > 0:
+            self.l1.setex(key, value, ttl)
+
+    def _on_invalidate(self, message: str):
+        sender, *keys = message.split("\n")
+        if sender != self.id:
+            self.l1.delete_many(keys)
+
+
+class TieredStorage[T](_Tiered, Storage):
+    """
+    A bounded in-process L1 in front of a shared L2 storage.
+    L1 keeps an entry at most `l1_ttl` seconds, so writes from other processes
+    are seen after that, and never longer than the ttl L2 reports by
+    `get_with_ttl`. With a `channel`, writes and deletes are broadcast
+    and other processes drop their L1 copy at once.
+    >>> config.storage = TieredStorage(
+    >>>     RedisStorage(redis_cli), l1_ttl=5, channel=RedisChannel(redis_cli)
+    >>> )
+    """
+
+    def __init__(
+        self,
+        l2: Storage,
+        l1: MemoryStorage | None = None,
+        l1_ttl: float = 60,
+        channel: InvalidationChannel | None = None,
+    ):
+        super().__init__(l1, l1_ttl, channel)
+        self.l2 = l2
+
+    def get(self, key: str) -> T | object:
+        val = self.l1.get(key)
+        if val is not Empty:
+            return val
+
+        val, ttl = self.l2.get_with_ttl(key)
+        self._fill(key, val, ttl)
+        return val
+
+    def setex(self, key: str, value: T, expire: float):
+        self.l2.setex(key, value, expire)
+        self.l1.setex(key, value, min(expire or float("inf"), self.l1_ttl))
+        self.invalidate_others(key)
+
+    def delete(self, key: str):
+        self.l2.delete(key)
+        self.l1.delete(key)
+        self.invalidate_others(key)
+
+    def get_many(self, keys: Sequence[str]) -> list[T | object]:
+        values = self.l1.get_many(keys)
+        missing = [i for i, val in enumerate(values) if val is Empty]
+        if not missing:
+            return values
+
+        l2_values = self.l2.get_many_with_ttl([keys[i] for i in missing])
+        for i, (val, ttl) in zip(missing, l2_values):
+            if val is not Empty:
+                values[i] = val
+                self._fill(keys[i], val, ttl)
+        return values
+
+    def set_many(self, mapping: Mapping[str, T], expire: float):
+        self.l2.set_many(mapping, expire)
+        self.l1.set_many(mapping, min(expire or float("inf"), self.l1_ttl))
+        self.invalidate_others(*mapping)
+
+    def delete_many(self, keys: Iterable[str]):
+        keys = list(keys)
+        self.l2.delete_many(keys)
+        self.l1.delete_many(keys)
+        self.invalidate_others(*keys)
+
+
+class AsyncTieredStorage[T](_Tiered, AsyncStorage):
+    """`TieredStorage` in front of an `AsyncStorage`, L1 is still in-process."""
+
+    def __init__(
+        self,
+        l2: AsyncStorage,
+        l1: MemoryStorage | None = None,
+        l1_ttl: float = 60,
+        channel: InvalidationChannel | None = None,
+    ):
+        super().__init__(l1, l1_ttl, channel)
+        self.l2 = l2
+
+    async def get(self, key: str) -> T | object:
+        val = self.l1.get(key)
+        if val is not Empty:
+            return val
+
+        val, ttl = await self.l2.get_with_ttl(key)
+        self._fill(key, val, ttl)
+        return val
+
+    async def setex(self, key: str, value: T, expire: float):
+        await self.l2.setex(key, value, expire)
+        self.l1.setex(key, value, min(expire or float("inf"), self.l1_ttl))
+        await self.ainvalidate_others(key)
+
+    async def delete(self, key: str):
+        await self.l2.delete(key)
+        self.l1.delete(key)
+        await self.ainvalidate_others(key)
+
+    async def get_many(self, keys: Sequence[str]) -> list[T | object]:
+        values = self.l1.get_many(keys)
+        missing = [i for i, val in enumerate(values) if val is Empty]
+        if not missing:
+            return values
+
+        l2_values = await self.l2.get_many_with_ttl([keys[i] for i in missing])
+        for i, (val, ttl) in zip(missing, l2_values):
+            if val is not Empty:
+                values[i] = val
+                self._fill(keys[i], val, ttl)
+        return values
+
+    async def set_many(self, mapping: Mapping[str, T], expire: float):
+        await self.l2.set_many(mapping, expire)
+        self.l1.set_many(mapping, min(expire or float("inf"), self.l1_ttl))
+        await self.ainvalidate_others(*mapping)
+
+    async def delete_many(self, keys: Iterable[str]):
+        keys = list(keys)
+        await self.l2.delete_many(keys)
+        self.l1.delete_many(keys)
+        await self.ainvalidate_others(*keys)
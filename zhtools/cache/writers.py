@@ -0,0 +1,103 @@
+import asyncio
+import weakref
+from collections.abc import Callable, Coroutine
+from enum import StrEnum
+from typing import Any
+
+from zhtools.config import config
+
+
+class OverflowPolicy(StrEnum):
+    # the caller waits until a pending write finishes (backpressure)
+    WAIT = "wait"
+    # the new write is dropped
+    DROP = "drop"
+
+
+class _LoopState:
+    def __init__(self, max_concurrency: int):
+        self.tasks: set[asyncio.Task] = set()
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+
+
+class AsyncWriter:
+    """
+    Bounded write-behind for the async cache path.
+    At most `max_concurrency` writes run at once and at most `max_pending` are
+    in flight, beyond that `policy` makes the caller wait or drops the write.
+    Pending tasks are referenced until they finish, flush them before shutdown:
+    >>> config.async_writer = AsyncWriter(max_pending=10000, policy=OverflowPolicy.DROP)
+    >>> await config.async_writer.flush()
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 32,
+        max_pending: int = 1024,
+        policy: OverflowPolicy = OverflowPolicy.WAIT,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.policy = OverflowPolicy(policy)
+        self.dropped = 0
+        self.failed = 0
+        # asyncio primitives are bound to a loop, keep one state per loop
+        self._states: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop, _LoopState
+        ] = weakref.WeakKeyDictionary()
+
+    def _state(self) -> _LoopState:
+        loop = asyncio.get_running_loop()
+        state = self._states.get(loop)
+        if state is None:
+            state = self._states[loop] = _LoopState(self.max_concurrency)
+        return state
+
+    @property
+    def pending(self) -> int:
+        try:
+            return len(self._state().tasks)
+        except RuntimeError:
+            return sum(len(state.tasks) for state in self._states.values())
+
+    async def submit[**P](
+        self,
+        func: Callable[P, Coroutine[Any, Any, Any]],
+        *args: P.args,
+        **kwargs: P.kwargs,
+    ) -> bool:
+        """
+        schedule `func(*args, **kwargs)`, return False if it is dropped.
+        the coroutine is only created once admitted.
+        """
+        state = self._state()
+        while len(state.tasks) >= self.max_pending:
+            if self.policy == OverflowPolicy.DROP:
+                self.dropped += 1
+                return False
+            await asyncio.wait(set(state.tasks), return_when=asyncio.FIRST_COMPLETED)
+
+        task = asyncio.create_task(self._run(state, func, args, kwargs))
+        state.tasks.add(task)
+        task.add_done_callback(state.tasks.discard)
+        return True
+
+    async def _run(self, state: _LoopState, func: Callable, args, kwargs):
+        async with state.semaphore:
+            try:
+                await func(*args, **kwargs)
+            except Exception:
+                self.failed += 1
+                config.log_exception(f"background cache write {func} failed.")
+
+    async def flush(self, timeout: float | None = None) -> bool:
+        """wait for pending writes of the running loop, return False on timeout."""
+        state = self._state()
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while state.tasks:
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                return False
+            await asyncio.wait(set(state.tasks), timeout=remaining)
+        return True
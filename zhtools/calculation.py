@@ -1,4 +1,4 @@
-from zhtools.typing import AnyNumber
+from zhtools.typed import AnyNumber
 
 
 def safe_divide[T: AnyNumber](
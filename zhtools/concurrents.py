@@ -1,68 +1,267 @@
+import array
 import asyncio
+import collections
+import contextlib
+import contextvars
+import functools
+import inspect
+import itertools
+import os
+import random
+import sys
+import threading
+import time
 import typing
-from collections.abc import Coroutine
+import uuid
+from collections.abc import (
+    AsyncIterator,
+    Callable,
+    Collection,
+    Coroutine,
+    Hashable,
+    Iterable,
+)
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    FIRST_EXCEPTION,
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
 from multiprocessing import Lock as MpLock
-from multiprocessing import Process
+from multiprocessing import resource_tracker, shared_memory
 from threading import Lock as ThLock
-from threading import Thread
-from typing import Generic, Type, TypeVar, Union
 
-from zhtools.typing import AnyCallable, CommonWrapped, CommonWrapper, P, R
+from zhtools.config import config
+from zhtools.exceptions import LockLost, LockNotAcquired
+from zhtools.typed import CommonWrapped, CommonWrapper, P, R
 
 if typing.TYPE_CHECKING:
     from multiprocessing.synchronize import Lock as TMpLock
 
-TASK_TYPE = Union[Thread, Process]
-TASK_CLI_TYPE = Type[TASK_TYPE]
-
-T = TypeVar("T", bound=TASK_TYPE)
-
-
-class ConcurrentMixin(Generic[T]):
-    _task_cli: type[T]
-
-    def __init__(self):
-        self._tasks: list[T] = []
+    from redis import Redis
+    from redis.asyncio import Redis as AsyncRedis
+
+
+class ConcurrentMixin:
+    _executor_cls: type[Executor]
+
+    def __init__(
+        self, max_workers: int | None = None, executor: Executor | None = None
+    ):
+        # an executor passed in is left running for its owner, the one created
+        # here is shut down when the with block exits
+        self._executor = executor
+        self._owns_executor = executor is None
+        self._pool_size = max_workers
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.results: list = []
+        self._futures: list[Future] = []
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if issubclass(self._executor_cls, ProcessPoolExecutor):
+                # workers share the tracker of shared memory blocks, see `_attach`
+                resource_tracker.ensure_running()
+            self._executor = self._executor_cls(self._pool_size)
+        return self._executor
+
+    def shutdown(self):
+        """shut down the executor created by this instance, if any."""
+        if self._owns_executor and self._executor is not None:
+            executor, self._executor = self._executor, None
+            executor.shutdown(wait=True, cancel_futures=True)
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if exc_type is None:
-            self._run()
-        else:
-            if exc_val is None:
-                exc_val = exc_type()
-            raise exc_val
-
-    def execute(self, func: AnyCallable, *args, **kwargs):
-        self._tasks.append(self._task_cli(target=func, args=args, kwargs=kwargs))
+        try:
+            if exc_type is None:
+                self._run()
+            else:
+                self.cancel()
+                if exc_val is None:
+                    exc_val = exc_type()
+                raise exc_val
+        finally:
+            self.shutdown()
+
+    def execute[**P, R](
+        self, func: Callable[P, R], *args: P.args, **kwargs: P.kwargs
+    ) -> Future[R]:
+        fut = self.executor.submit(func, *args, **kwargs)
+        self._futures.append(fut)
+        return fut
+
+    def cancel(self):
+        """cancel the tasks not started yet."""
+        for fut in self._futures:
+            fut.cancel()
 
     def _run(self):
-        for t in self._tasks:
-            t.start()
-        for t in self._tasks:
-            t.join()
+        futures, self._futures = self._futures, []
+        _, pending = wait(futures, return_when=FIRST_EXCEPTION)
+        if pending:
+            # something failed, drop what has not started and let the rest finish
+            for fut in pending:
+                fut.cancel()
+            wait(pending)
+        for fut in futures:
+            if not fut.cancelled() and fut.exception() is not None:
+                raise fut.exception()
+        self.results = [fut.result() for fut in futures]
 
 
 class ThreadConcurrent(ConcurrentMixin):
     """
-    concurrency with thread
-    >>> with ThreadConcurrent() as c:
-    >>>     c.execute(print, 1)
+    concurrency with a thread pool, results are kept in submission order and
+    the first exception cancels pending tasks and is raised.
+    >>> with ThreadConcurrent(max_workers=8) as c:
+    >>>     c.execute(pow, 2, 3)
+    >>>     c.execute(pow, 2, 4)
+    >>> c.results
+    [8, 16]
+    the pool lives for the with block, to reuse one pass it in:
+    >>> with ThreadPoolExecutor(8) as pool:
+    >>>     with ThreadConcurrent(executor=pool) as c:
+    ...
     """
 
-    _task_cli = Thread
+    _executor_cls = ThreadPoolExecutor
+
+
+class _SharedBuffer(typing.NamedTuple):
+    name: str
+    nbytes: int
+    format: str
+
+
+def _share(value: typing.Any, threshold: int, blocks: list):
+    """value with large buffers, also in a tuple, moved to shared memory."""
+    if type(value) is tuple:
+        return tuple(_share(v, threshold, blocks) for v in value)
+    if not isinstance(value, (bytes, bytearray, memoryview, array.array)):
+        return value
+    view = memoryview(value)
+    if view.nbytes < threshold or not view.c_contiguous:
+        return value
+    shm = shared_memory.SharedMemory(create=True, size=view.nbytes)
+    blocks.append(shm)
+    shm.buf[: view.nbytes] = view.cast("B")
+    return _SharedBuffer(shm.name, view.nbytes, view.format)
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name, track=False)
+    # registered again in the tracker shared with the owner, a no-op as it
+    # keeps a set, and unregistered once by the owner's unlink
+    return shared_memory.SharedMemory(name)
+
+
+def _restore(value: typing.Any, attached: list):
+    if type(value) is tuple:
+        return tuple(_restore(v, attached) for v in value)
+    if not isinstance(value, _SharedBuffer):
+        return value
+    shm = _attach(value.name)
+    view = shm.buf[: value.nbytes]
+    if value.format != "B":
+        view = view.cast(value.format)
+    attached.append((shm, view))
+    return view
+
+
+def _release(blocks: list[shared_memory.SharedMemory]):
+    for shm in blocks:
+        shm.close()
+        shm.unlink()
+
+
+def _map_chunk[R](func: Callable[..., R], chunk: tuple) -> list[R]:
+    results = []
+    for item in chunk:
+        attached: list[tuple[shared_memory.SharedMemory, memoryview]] = []
+        try:
+            results.append(func(_restore(item, attached)))
+        finally:
+            for shm, view in attached:
+                view.release()
+                try:
+                    shm.close()
+                except BufferError:
+                    # func kept a view, closed when collected
+                    pass
+    return results
 
 
 class ProcessConcurrent(ConcurrentMixin):
     """
-    concurrency with subprocess
-    >>> with ThreadConcurrent() as c:
-    >>>     c.execute(print, 1)
+    concurrency with a process pool, functions and arguments must be picklable.
+    >>> with ProcessConcurrent(max_workers=4) as c:
+    >>>     c.execute(pow, 2, 3)
+    apply a function to many items, sent in chunks:
+    >>> for result in ProcessConcurrent().map(transform, records, chunksize=1000):
+    ...
     """
 
-    _task_cli = Process
+    _executor_cls = ProcessPoolExecutor
+
+    def map[R](
+        self,
+        func: Callable[[typing.Any], R],
+        iterable: Iterable,
+        chunksize: int = 1,
+        ordered: bool = True,
+        share_threshold: int = 64 * 1024,
+    ) -> typing.Iterator[R]:
+        """
+        yield `func(item)` for items, in order or as chunks finish.
+        Items are read lazily and sent `chunksize` at a time, with a few chunks
+        per worker in flight. Buffers (bytes, bytearray, memoryview, array) of
+        `share_threshold` bytes or more, as items or in tuple items, are
+        passed through shared memory: func gets a memoryview of them, valid
+        during the call. Outside a with block the pool is shut down when the
+        iteration ends.
+        """
+        owned = self._executor is None
+        window = 2 * self.max_workers
+        chunks = itertools.batched(iterable, chunksize)
+        # future -> shared memory blocks of its chunk
+        running: dict[Future[list[R]], list[shared_memory.SharedMemory]] = {}
+        queue: collections.deque[Future[list[R]]] = collections.deque()
+        try:
+            while True:
+                for chunk in itertools.islice(chunks, window - len(running)):
+                    blocks: list[shared_memory.SharedMemory] = []
+                    chunk = tuple(_share(v, share_threshold, blocks) for v in chunk)
+                    fut = self.executor.submit(_map_chunk, func, chunk)
+                    running[fut] = blocks
+                    if ordered:
+                        queue.append(fut)
+                if not running:
+                    return
+
+                if ordered:
+                    done = [queue.popleft()]
+                else:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    results = fut.result()
+                    _release(running.pop(fut))
+                    yield from results
+        finally:
+            for fut in running:
+                fut.cancel()
+            wait(running)
+            for blocks in running.values():
+                _release(blocks)
+            if owned:
+                self.shutdown()
 
 
 class CoroutineConcurrent:
@@ -70,9 +269,26 @@ class CoroutineConcurrent:
     concurrency with coroutine
     >>> async with CoroutineConcurrent() as c:
     >>>     c.execute(asyncio.sleep(1))
+    at most `limit` coroutines run at once, each for at most `timeout` seconds.
+    Coroutines are taken lazily, so a generator of any length runs with
+    constant memory:
+    >>> c = CoroutineConcurrent(limit=100, timeout=10)
+    >>> async for i, result in c.as_completed(fetch(url) for url in urls):
+    ...
+    by default every coroutine runs and the first exception is raised at the
+    end, `fail_fast=True` cancels the others at once.
     """
 
-    def __init__(self):
+    def __init__(
+        self,
+        limit: int | None = None,
+        timeout: float | None = None,
+        fail_fast: bool = False,
+    ):
+        self.limit = limit
+        self.timeout = timeout
+        self.fail_fast = fail_fast
+        self.results: list = []
         self._tasks: list[Coroutine] = []
 
     def __enter__(self):
@@ -100,24 +316,187 @@ class CoroutineConcurrent:
     def execute(self, cor: Coroutine):
         self._tasks.append(cor)
 
-    async def _run(self):
-        await asyncio.gather(*self._tasks)
-        self._tasks.clear()
+    async def _await(self, cor: Coroutine):
+        if self.timeout is None:
+            return await cor
+        async with asyncio.timeout(self.timeout):
+            return await cor
+
+    def _iter(
+        self, cors: Iterable[Coroutine] | None
+    ) -> tuple[Iterable[Coroutine], int]:
+        """coroutines to run and the number of workers."""
+        if cors is None:
+            cors, self._tasks = self._tasks, []
+        if self.limit is None:
+            cors = list(cors)
+            return cors, len(cors)
+        return cors, self.limit
+
+    async def _run(self, cors: Iterable[Coroutine] | None = None):
+        """run cors, or the executed coroutines, keeping results in order."""
+        cors, workers = self._iter(cors)
+        it = iter(cors)
+        results = self.results = []
+
+        async def worker():
+            for cor in it:
+                i = len(results)
+                results.append(None)
+                try:
+                    results[i] = await self._await(cor)
+                except Exception as e:
+                    if self.fail_fast:
+                        raise
+                    results[i] = e
+
+        try:
+            async with asyncio.TaskGroup() as tg:
+                for _ in range(workers):
+                    tg.create_task(worker())
+        except ExceptionGroup as eg:
+            raise eg.exceptions[0] from None
+        finally:
+            # never started after a failure
+            if isinstance(cors, Collection):
+                for cor in it:
+                    cor.close()
+
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+
+    async def execute_batch(self, tasks: Iterable[Coroutine]) -> list:
+        """run tasks, return their results in order."""
+        await self._run(tasks)
+        return self.results
+
+    async def as_completed(
+        self, cors: Iterable[Coroutine] | None = None
+    ) -> AsyncIterator[tuple[int, typing.Any]]:
+        """
+        yield (index, result) as coroutines finish, nothing is kept after
+        yielded. A failed coroutine yields its exception, or with `fail_fast`
+        raises it and cancels the running ones.
+        """
+        cors, workers = self._iter(cors)
+        it = enumerate(cors)
+        running: dict[asyncio.Task, int] = {}
+        try:
+            while True:
+                for i, cor in itertools.islice(it, workers - len(running)):
+                    running[asyncio.create_task(self._await(cor))] = i
+                if not running:
+                    return
+                done, _ = await asyncio.wait(
+                    running, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    i = running.pop(task)
+                    if task.exception() is None:
+                        yield i, task.result()
+                    elif self.fail_fast:
+                        raise task.exception()
+                    else:
+                        yield i, task.exception()
+        finally:
+            for task in running:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    # finished along with a failure that stopped iteration
+                    task.exception()
+            if isinstance(cors, Collection):
+                for _, cor in it:
+                    cor.close()
+
+
+class SingleFlight[R]:
+    """
+    run a call only once for concurrent callers with the same key,
+    the others wait for it and share its result or exception.
+    >>> flight = SingleFlight()
+    >>> flight.do(f'user:{uid}', get_user, uid)
+    """
+
+    def __init__(self):
+        self._calls: dict[Hashable, Future[R]] = {}
+        self._lock = ThLock()
+
+    def do[**P](
+        self, key: Hashable, func: Callable[P, R], *args: P.args, **kwargs: P.kwargs
+    ) -> R:
+        with self._lock:
+            fut = self._calls.get(key)
+            if fut is not None:
+                leader = False
+            else:
+                leader = True
+                fut = self._calls[key] = Future()
+
+        if not leader:
+            return fut.result()
+
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        else:
+            fut.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class AsyncSingleFlight[R]:
+    """
+    coroutine version of `SingleFlight`, the call runs in its own task so a
+    cancelled caller does not cancel the others, it is cancelled once every
+    caller is gone.
+    >>> flight = AsyncSingleFlight()
+    >>> await flight.do(f'user:{uid}', get_user, uid)
+    """
 
-    async def execute_batch(self, tasks: list[Coroutine]):
-        self._tasks.extend(tasks)
-        await self._run()
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Task[R]] = {}
+        # number of callers waiting for each call
+        self._callers: dict[asyncio.Task[R], int] = {}
+
+    async def do[**P](
+        self,
+        key: Hashable,
+        func: Callable[P, Coroutine[typing.Any, typing.Any, R]],
+        *args: P.args,
+        **kwargs: P.kwargs,
+    ) -> R:
+        task = self._calls.get(key)
+        if task is None:
+            task = self._calls[key] = asyncio.ensure_future(func(*args, **kwargs))
+            task.add_done_callback(functools.partial(self._forget, key))
+        self._callers[task] = self._callers.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._callers[task] -= 1
+            if not self._callers[task]:
+                del self._callers[task]
+                self._forget(key, task)
+                task.cancel()
+
+    def _forget(self, key: Hashable, task: asyncio.Task[R]):
+        if self._calls.get(key) is task:
+            del self._calls[key]
 
 
 __thread_lock_map: dict[str, ThLock] = {}
 
 
 def with_memory_thread_lock(f: CommonWrapped) -> CommonWrapper:
+    lock = __thread_lock_map.setdefault(f.__qualname__, ThLock())
+
     def inner(*args: P.args, **kwargs: P.kwargs) -> R:
-        k = f.__qualname__
-        if k not in __thread_lock_map:
-            __thread_lock_map[k] = ThLock()
-        lock = __thread_lock_map[k]
         with lock:
             return f(*args, **kwargs)
 
@@ -128,11 +507,10 @@ __process_lock_map: dict[str, "TMpLock"] = {}
 
 
 def with_memory_process_lock(f: CommonWrapped) -> CommonWrapper:
+    # created when decorating, so processes forked later share it
+    lock = __process_lock_map.setdefault(f.__qualname__, MpLock())
+
     def inner(*args: P.args, **kwargs: P.kwargs) -> R:
-        k = f.__qualname__
-        if k not in __process_lock_map:
-            __process_lock_map[k] = MpLock()
-        lock = __process_lock_map[k]
         with lock:
             return f(*args, **kwargs)
 
@@ -144,11 +522,376 @@ __coroutine_lock_map: dict[str, asyncio.Lock] = {}
 
 def with_memory_coroutine_lock(f: CommonWrapped) -> CommonWrapper:
     async def inner(*args: P.args, **kwargs: P.kwargs) -> R:
-        k = f.__qualname__
-        if k not in __coroutine_lock_map:
-            __coroutine_lock_map[k] = asyncio.Lock()
-        lock = __coroutine_lock_map[k]
+        # setdefault is atomic, two first callers get the same lock
+        lock = __coroutine_lock_map.setdefault(f.__qualname__, asyncio.Lock())
         async with lock:
             return await f(*args, **kwargs)
 
     return inner
+
+
+class KeyedLock:
+    """
+    A thread lock per key, the entry of a key is dropped when its last holder
+    or waiter leaves, so the table only holds keys in use.
+    >>> locks = KeyedLock()
+    >>> with locks.hold(user_id):
+    ...
+    """
+
+    def __init__(self):
+        # key -> [lock, holders and waiters]
+        self._entries: dict[Hashable, list] = {}
+        self._guard = ThLock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @contextlib.contextmanager
+    def hold(self, key: Hashable) -> typing.Iterator[None]:
+        with self._guard:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = [ThLock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._guard:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._entries[key]
+
+
+class AsyncKeyedLock:
+    """coroutine version of `KeyedLock`, for one event loop."""
+
+    def __init__(self):
+        self._entries: dict[Hashable, list] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @contextlib.asynccontextmanager
+    async def hold(self, key: Hashable) -> AsyncIterator[None]:
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._entries[key]
+
+
+def with_keyed_lock(
+    key: Callable[..., Hashable],
+) -> Callable[[CommonWrapped], CommonWrapper]:
+    """
+    serialize calls with the same `key(*args, **kwargs)`, calls with other
+    keys run concurrently. Works for functions in threads and coroutines.
+    >>> @with_keyed_lock(key=lambda user_id, amount: user_id)
+    >>> def charge(user_id: int, amount: int):
+    ...
+    """
+
+    def decorator(f: CommonWrapped) -> CommonWrapper:
+        if inspect.iscoroutinefunction(f):
+            async_locks = AsyncKeyedLock()
+
+            @functools.wraps(f)
+            async def async_inner(*args: P.args, **kwargs: P.kwargs) -> R:
+                async with async_locks.hold(key(*args, **kwargs)):
+                    return await f(*args, **kwargs)
+
+            async_inner.locks = async_locks  # type: ignore
+            return async_inner
+
+        locks = KeyedLock()
+
+        @functools.wraps(f)
+        def inner(*args: P.args, **kwargs: P.kwargs) -> R:
+            with locks.hold(key(*args, **kwargs)):
+                return f(*args, **kwargs)
+
+        inner.locks = locks  # type: ignore
+        return inner
+
+    return decorator
+
+
+# release / renew the lock only if it still holds our token
+# take the lease and bump the fence at once, the new fence or 0 if held
+ACQUIRE_SCRIPT = """
+if redis.call('set', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return redis.call('incr', KEYS[2])
+end
+return 0
+"""
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# fence of the redis lock held by the current call, see `RedisLock`
+fencing_token: contextvars.ContextVar[int | None] = contextvars.ContextVar(
+    "fencing_token", default=None
+)
+
+
+class _RedisLease:
+    prefix = "zhtools:lock:"
+
+    def __init__(
+        self,
+        redis_cli: typing.Any,
+        name: str,
+        ttl: float = 10,
+        blocking: bool = True,
+        timeout: float | None = None,
+        interval: float = 0.05,
+    ):
+        self.redis_cli = redis_cli
+        self.key = f"{self.prefix}{name}"
+        self.ttl = ttl
+        self.blocking = blocking
+        self.timeout = timeout
+        self.interval = interval
+        self.token: str | None = None
+        self.fence: int | None = None
+        # set when the lease expired while held, e.g. redis was unreachable,
+        # `with` blocks raise `LockLost` on exit then
+        self.lost = False
+
+    def _acquire_args(self, token: str) -> tuple:
+        px = int(self.ttl * 1000)
+        return ACQUIRE_SCRIPT, 2, self.key, f"{self.key}:fence", token, px
+
+    def _wait(self, deadline: float | None) -> float:
+        """seconds to sleep before retrying, 0 to give up."""
+        if not self.blocking:
+            return 0
+        delay = self.interval * random.uniform(0.5, 1.5)
+        if deadline is None:
+            return delay
+        return max(0.0, min(delay, deadline - time.monotonic()))
+
+    def _renewed(self, result: typing.Any) -> bool:
+        if not result:
+            self.lost = True
+            config.log_warning(f"lock {self.key} expired before released.")
+        return bool(result)
+
+    def _check_lost(self, exc_type: type[BaseException] | None):
+        if self.lost and exc_type is None:
+            raise LockLost(self.key)
+
+
+class RedisLock(_RedisLease):
+    """
+    A lease on `name` in redis, renewed every `ttl / 3` seconds while held.
+    Acquiring waits up to `timeout` seconds (forever if None) when `blocking`.
+    `fence` increases with every acquisition, pass it along writes so stale
+    holders can be rejected. A lease lost before release sets `lost`, and
+    raises `LockLost` when the with block exits.
+    >>> lock = RedisLock(redis_cli, "orders:1", ttl=10)
+    >>> with lock:
+    >>>     save(order, fence=lock.fence)
+    """
+
+    redis_cli: "Redis"
+
+    def __init__(self, redis_cli: "Redis", name: str, **kwargs):
+        super().__init__(redis_cli, name, **kwargs)
+        self._stop = threading.Event()
+        self._renewer: threading.Thread | None = None
+
+    def acquire(self) -> bool:
+        token = uuid.uuid4().hex
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while not (fence := self.redis_cli.eval(*self._acquire_args(token))):
+            delay = self._wait(deadline)
+            if not delay:
+                return False
+            time.sleep(delay)
+
+        self.token = token
+        self.fence = int(fence)
+        self.lost = False
+        self._stop.clear()
+        self._renewer = threading.Thread(
+            target=self._renew_forever, name=f"renew-{self.key}", daemon=True
+        )
+        self._renewer.start()
+        return True
+
+    def _renew_forever(self):
+        while not self._stop.wait(self.ttl / 3):
+            try:
+                renewed = self.redis_cli.eval(
+                    RENEW_SCRIPT, 1, self.key, self.token, int(self.ttl * 1000)
+                )
+            except Exception:
+                config.log_exception(f"renew lock {self.key} failed.")
+                continue
+            if not self._renewed(renewed):
+                return
+
+    def release(self):
+        self._stop.set()
+        if self._renewer is not None:
+            self._renewer.join()
+            self._renewer = None
+        if not self.redis_cli.eval(RELEASE_SCRIPT, 1, self.key, self.token):
+            self.lost = True
+        self.token = None
+
+    def __enter__(self) -> typing.Self:
+        if not self.acquire():
+            raise LockNotAcquired(self.key)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+        self._check_lost(exc_type)
+
+
+class AsyncRedisLock(_RedisLease):
+    """
+    `RedisLock` for redis.asyncio clients, renewed by a task.
+    >>> async with AsyncRedisLock(redis_cli, "orders:1"):
+    ...
+    """
+
+    redis_cli: "AsyncRedis"
+
+    def __init__(self, redis_cli: "AsyncRedis", name: str, **kwargs):
+        super().__init__(redis_cli, name, **kwargs)
+        self._task: asyncio.Task | None = None
+
+    async def acquire(self) -> bool:
+        token = uuid.uuid4().hex
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while not (fence := await self.redis_cli.eval(*self._acquire_args(token))):
+            delay = self._wait(deadline)
+            if not delay:
+                return False
+            await asyncio.sleep(delay)
+
+        self.token = token
+        self.fence = int(fence)
+        self.lost = False
+        self._task = asyncio.create_task(self._renew_forever())
+        return True
+
+    async def _renew_forever(self):
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                renewed = await self.redis_cli.eval(
+                    RENEW_SCRIPT, 1, self.key, self.token, int(self.ttl * 1000)
+                )
+            except Exception:
+                config.log_exception(f"renew lock {self.key} failed.")
+                continue
+            if not self._renewed(renewed):
+                return
+
+    async def release(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if not await self.redis_cli.eval(RELEASE_SCRIPT, 1, self.key, self.token):
+            self.lost = True
+        self.token = None
+
+    async def __aenter__(self) -> typing.Self:
+        if not await self.acquire():
+            raise LockNotAcquired(self.key)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.release()
+        self._check_lost(exc_type)
+
+
+def _lock_name(f: Callable, key: Callable[..., str] | None, args, kwargs) -> str:
+    if key is None:
+        return f"{f.__module__}.{f.__qualname__}"
+    return key(*args, **kwargs)
+
+
+def with_redis_lock(
+    redis_cli: "Redis",
+    key: Callable[..., str] | None = None,
+    ttl: float = 10,
+    blocking: bool = True,
+    timeout: float | None = None,
+) -> Callable[[CommonWrapped], CommonWrapper]:
+    """
+    serialize calls across processes and hosts with `RedisLock`, by function
+    or by `key(*args, **kwargs)`. `LockNotAcquired` is raised when not
+    `blocking` or after `timeout`, `LockLost` when the lease expired before
+    the call returned. `fencing_token` holds the lock's fence during the call.
+    >>> @with_redis_lock(redis_cli, key=lambda order_id: f"order:{order_id}")
+    >>> def pay(order_id: int):
+    ...
+    """
+
+    def decorator(f: CommonWrapped) -> CommonWrapper:
+        @functools.wraps(f)
+        def inner(*args: P.args, **kwargs: P.kwargs) -> R:
+            name = _lock_name(f, key, args, kwargs)
+            lock = RedisLock(
+                redis_cli, name, ttl=ttl, blocking=blocking, timeout=timeout
+            )
+            with lock:
+                reset = fencing_token.set(lock.fence)
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    fencing_token.reset(reset)
+
+        return inner
+
+    return decorator
+
+
+def with_async_redis_lock(
+    redis_cli: "AsyncRedis",
+    key: Callable[..., str] | None = None,
+    ttl: float = 10,
+    blocking: bool = True,
+    timeout: float | None = None,
+) -> Callable[[CommonWrapped], CommonWrapper]:
+    """coroutine version of `with_redis_lock`, for redis.asyncio clients."""
+
+    def decorator(f: CommonWrapped) -> CommonWrapper:
+        @functools.wraps(f)
+        async def inner(*args: P.args, **kwargs: P.kwargs) -> R:
+            name = _lock_name(f, key, args, kwargs)
+            lock = AsyncRedisLock(
+                redis_cli, name, ttl=ttl, blocking=blocking, timeout=timeout
+            )
+            async with lock:
+                reset = fencing_token.set(lock.fence)
+                try:
+                    return await f(*args, **kwargs)
+                finally:
+                    fencing_token.reset(reset)
+
+        return inner
+
+    return decorator
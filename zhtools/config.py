@@ -1,10 +1,11 @@
 import dataclasses
 import typing
 
-from zhtools.typing import LoggerType
+from zhtools.typed import LoggerType
 
 if typing.TYPE_CHECKING:
     from zhtools.cache.storages import Storage
+    from zhtools.cache.writers import AsyncWriter
 
 __all__ = ["config"]
 
@@ -16,6 +17,11 @@ class Config:
     # cache
     _storage: typing.Optional["Storage"] = None
     default_expire: int | None = None
+    # see `zhtools.cache.metrics`
+    cache_stats: bool = True
+    # called with (scope, name, value) for every cache event
+    cache_stats_hook: typing.Callable[[str, str, float], None] | None = None
+    _async_writer: typing.Optional["AsyncWriter"] = None
 
     def set_logger(self, logger: LoggerType):
         self.logger = logger
@@ -32,6 +38,18 @@ class Config:
     def storage(self, val: "Storage"):
         self._storage = val
 
+    @property
+    def async_writer(self):
+        if self._async_writer is None:
+            from zhtools.cache.writers import AsyncWriter
+
+            self._async_writer = AsyncWriter()
+        return self._async_writer
+
+    @async_writer.setter
+    def async_writer(self, val: "AsyncWriter"):
+        self._async_writer = val
+
     def log_debug(self, msg: str, *args, **kwargs):
         if self.logger:
             self.logger.debug(msg, *args, **kwargs)
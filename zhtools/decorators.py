@@ -2,7 +2,7 @@ import datetime
 
 from zhtools.data_structs.convertors import camel_case_to_underline
 from zhtools.timetools import Format
-from zhtools.typing import ClassType
+from zhtools.typed import ClassType
 
 
 def singleton[T: ClassType](cls_: T) -> T:
@@ -8,3 +8,19 @@ class ModuleRequired(Exception):
         if self.version:
             module += f">={self.version}"
         return f"Module [{module}]" f" is required. Please use pip to install it."
+
+
+class LockNotAcquired(Exception):
+    def __init__(self, name: str):
+        self.name = name
+
+    def __str__(self) -> str:
+        return f"Lock [{self.name}] is held by another owner."
+
+
+class LockLost(Exception):
+    def __init__(self, name: str):
+        self.name = name
+
+    def __str__(self) -> str:
+        return f"Lock [{self.name}] expired before it was released."